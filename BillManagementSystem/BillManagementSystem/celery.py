@@ -1,6 +1,5 @@
 import os
 from celery import Celery
-from celery.schedules import crontab
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'BillManagementSystem.settings')
 
@@ -8,9 +7,5 @@ app = Celery('BillManagementSystem')
 app.config_from_object('django.conf:settings', namespace='CELERY')
 app.autodiscover_tasks()
 
-app.conf.beat_schedule = {
-    'send-due-notifications-every-day': {
-        'task': 'bms.tasks.send_due_notifications',
-        'schedule': 60,#crontab(hour=6, minute=0)
-    },
-}
+# periodic tasks are stored in the database (CELERY_BEAT_SCHEDULER) and edited in the admin;
+# the defaults come from bms/migrations/0027_periodic_tasks.py
@@ -42,6 +42,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'bms.apps.BmsConfig',
     'rest_framework',
     'rest_framework_simplejwt',
@@ -49,9 +50,11 @@ INSTALLED_APPS = [
 
     'drf_yasg',
     'auditlog',
+    'django_celery_beat',
 ]
 
 MIDDLEWARE = [
+    'bms.metrics.RequestLatencyMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
@@ -247,17 +250,120 @@ EMAIL_HOST_USER = os.getenv('EMAIL_HOST_USER')
 EMAIL_HOST_PASSWORD = os.getenv('EMAIL_HOST_PASSWORD')
 DEFAULT_FROM_EMAIL = EMAIL_HOST_USER
 EMAIL_SUBJECT_PREFIX = '[Billing System]'
+# notification emails: messages per batch and batches sent in parallel, each on its own kept-open connection
+EMAIL_DELIVERY_BATCH_SIZE = int(os.getenv('EMAIL_DELIVERY_BATCH_SIZE', 100))
+EMAIL_DELIVERY_CONCURRENCY = int(os.getenv('EMAIL_DELIVERY_CONCURRENCY', 4))
+EMAIL_TIMEOUT = int(os.getenv('EMAIL_TIMEOUT', 30))
 
 
 
 
 
 
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.getenv('REDIS_CACHE_URL', 'redis://redis:6379/1'),
+        'KEY_PREFIX': 'bms',
+        'TIMEOUT': 300,
+    }
+}
+
+# rendered serializer fragments, see bms/representation_cache.py
+REPRESENTATION_CACHE_ENABLED = os.getenv('REPRESENTATION_CACHE_ENABLED', 'True') == 'True'
+REPRESENTATION_CACHE_TIMEOUT = int(os.getenv('REPRESENTATION_CACHE_TIMEOUT', 60 * 60))
+# entries kept in each worker's in-process LRU in front of redis, 0 disables it
+REPRESENTATION_CACHE_LOCAL_SIZE = int(os.getenv('REPRESENTATION_CACHE_LOCAL_SIZE', 5000))
+# report how many loads/renders the per-request identity map saved in X-Identity-Map-Hits
+IDENTITY_MAP_DEBUG_HEADER = os.getenv('IDENTITY_MAP_DEBUG_HEADER', str(DEBUG)) == 'True'
+
+
 CELERY_BROKER_URL = 'redis://redis:6379/0'
 CELERY_RESULT_BACKEND = 'redis://redis:6379/0'
 CELERY_ACCEPT_CONTENT = ['json']
 CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = 'Africa/Addis_Ababa'
+# periodic tasks live in the database (django_celery_beat); the defaults are created by migrations
+CELERY_BEAT_SCHEDULER = 'django_celery_beat.schedulers:DatabaseScheduler'
+
+# bills locked, updated and notified per statement by send_due_notifications and dispatch_due_reminders
+DUE_NOTIFICATIONS_BATCH_SIZE = int(os.getenv('DUE_NOTIFICATIONS_BATCH_SIZE', 1000))
+# candidate bills per send_due_notifications subtask; chunks run in parallel on the workers
+DUE_NOTIFICATIONS_CHUNK_SIZE = int(os.getenv('DUE_NOTIFICATIONS_CHUNK_SIZE', 5000))
+# report each chunk's own peak Python memory (tracemalloc; slows the chunk down) besides the worker's peak RSS
+TASK_TRACE_MEMORY = os.getenv('TASK_TRACE_MEMORY', 'False') == 'True'
+# reminder days relative to the due date for billers without reminder policies: the day before and the day after
+REMINDER_DEFAULT_OFFSETS = [int(offset) for offset in os.getenv('REMINDER_DEFAULT_OFFSETS', '-1,1').split(',')]
+
+# notification outbox (bms.outbox), drained by workers consuming the "outbox" queue
+CELERY_TASK_ROUTES = {'bms.tasks.drain_outbox': {'queue': 'outbox'}}
+OUTBOX_REDIS_URL = os.getenv('OUTBOX_REDIS_URL', 'redis://redis:6379/2')
+# token bucket per provider, shared by all sender workers: sustained messages per second and burst
+OUTBOX_PROVIDERS = {
+    'email': {
+        'rate': float(os.getenv('OUTBOX_EMAIL_RATE', 10)),
+        'burst': int(os.getenv('OUTBOX_EMAIL_BURST', 50)),
+    },
+}
+OUTBOX_BATCH_SIZE = int(os.getenv('OUTBOX_BATCH_SIZE', 50))
+OUTBOX_DRAIN_SECONDS = int(os.getenv('OUTBOX_DRAIN_SECONDS', 25))
+# how long a claimed batch is hidden from other senders while its provider is called
+OUTBOX_LEASE_SECONDS = int(os.getenv('OUTBOX_LEASE_SECONDS', 5 * 60))
+# retries back off exponentially from BASE up to MAX seconds; after MAX_ATTEMPTS the message is dead-lettered
+OUTBOX_MAX_ATTEMPTS = int(os.getenv('OUTBOX_MAX_ATTEMPTS', 6))
+OUTBOX_BACKOFF_BASE = int(os.getenv('OUTBOX_BACKOFF_BASE', 30))
+OUTBOX_BACKOFF_MAX = int(os.getenv('OUTBOX_BACKOFF_MAX', 60 * 60))
+# consecutive fully failed batches that open the circuit, and how long it stays open (seconds)
+OUTBOX_BREAKER_THRESHOLD = int(os.getenv('OUTBOX_BREAKER_THRESHOLD', 3))
+OUTBOX_BREAKER_COOLDOWN = int(os.getenv('OUTBOX_BREAKER_COOLDOWN', 60))
+
+# SMS and WhatsApp reminders (bms.channels) over Twilio's Messages API; point TWILIO_API_URL
+# at `manage.py fake_gateway` to run without Twilio
+TWILIO_API_URL = os.getenv('TWILIO_API_URL', 'https://api.twilio.com')
+TWILIO_ACCOUNT_SID = os.getenv('TWILIO_ACCOUNT_SID')
+TWILIO_AUTH_TOKEN = os.getenv('TWILIO_AUTH_TOKEN')
+# sender number and requests in flight per sender worker; a channel is offered once its number is set
+CHANNEL_GATEWAYS = {
+    'sms': {
+        'from': os.getenv('TWILIO_SMS_FROM'),
+        'concurrency': int(os.getenv('SMS_CONCURRENCY', 20)),
+    },
+    'whatsapp': {
+        'from': os.getenv('TWILIO_WHATSAPP_FROM'),
+        'concurrency': int(os.getenv('WHATSAPP_CONCURRENCY', 10)),
+    },
+}
+CHANNEL_TIMEOUT = int(os.getenv('CHANNEL_TIMEOUT', 10))
+if CHANNEL_GATEWAYS['sms']['from']:
+    OUTBOX_PROVIDERS['sms'] = {
+        'rate': float(os.getenv('OUTBOX_SMS_RATE', 30)),
+        'burst': int(os.getenv('OUTBOX_SMS_BURST', 100)),
+    }
+if CHANNEL_GATEWAYS['whatsapp']['from']:
+    OUTBOX_PROVIDERS['whatsapp'] = {
+        'rate': float(os.getenv('OUTBOX_WHATSAPP_RATE', 20)),
+        'burst': int(os.getenv('OUTBOX_WHATSAPP_BURST', 60)),
+    }
+
+
+
+# bearer token Prometheus sends to scrape /api/metrics; while unset the endpoint refuses every request
+METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+
+
+# how often (seconds) a worker checks the shared permission catalogue version
+PERMISSION_CATALOGUE_CHECK_INTERVAL = int(os.getenv('PERMISSION_CATALOGUE_CHECK_INTERVAL', 5))
+
+
+# list counts: exact, capped ("N+" past the cap), estimate (planner estimate for unfiltered tables) or none;
+# views can override with `count_strategy` and clients with ?count=
+PAGINATION_COUNT_STRATEGY = os.getenv('PAGINATION_COUNT_STRATEGY', 'exact')
+PAGINATION_COUNT_CAP = int(os.getenv('PAGINATION_COUNT_CAP', 10000))
+PAGINATION_COUNT_CACHE_TIMEOUT = int(os.getenv('PAGINATION_COUNT_CACHE_TIMEOUT', 30))
 
 
+# customer typeahead: characters needed before searching, default and maximum results
+TYPEAHEAD_MIN_LENGTH = int(os.getenv('TYPEAHEAD_MIN_LENGTH', 2))
+TYPEAHEAD_DEFAULT_LIMIT = int(os.getenv('TYPEAHEAD_DEFAULT_LIMIT', 10))
+TYPEAHEAD_MAX_LIMIT = int(os.getenv('TYPEAHEAD_MAX_LIMIT', 50))
@@ -8,3 +8,7 @@ admin.site.register(Biller)
 admin.site.register(CustomerBiller)
 admin.site.register(Payment)
 admin.site.register(Bill)
+admin.site.register(OutboxMessage)
+admin.site.register(ReminderPolicy)
+admin.site.register(DunningStage)
+admin.site.register(DunningEvent)
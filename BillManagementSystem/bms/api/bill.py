@@ -7,29 +7,34 @@ from django.contrib.auth import get_user_model
 from rest_framework.decorators import api_view,permission_classes
 from rest_framework.permissions import IsAuthenticated, DjangoModelPermissions
 from rest_framework.filters import OrderingFilter,SearchFilter
-from bms.api.custom_pagination import CustomPagination
+from bms.api.filters import RankedSearchFilter
+from bms.api.custom_pagination import HybridPagination
+from bms.api.mixins import DatabaseJSONListMixin, EagerLoadingViewMixin, ExportViewMixin
 import datetime
 from django_filters.rest_framework import DjangoFilterBackend
 
 
 User = get_user_model()
 
-class BillListView(generics.ListAPIView):
+class BillListView(DatabaseJSONListMixin, generics.ListAPIView):
     queryset = Bill.objects.all()
     serializer_class = BillSerializer
+    json_engine = 'database'
     permission_classes = [IsAuthenticated, DjangoModelPermissions]
-    filter_backends = [SearchFilter, OrderingFilter,DjangoFilterBackend]
-    search_fields = [field.name for field in Bill._meta.fields]
-    ordering_fields = [field.name for field in Bill._meta.fields]
+    filter_backends = [OrderingFilter, RankedSearchFilter, DjangoFilterBackend]
+    search_fields = ['bill_number', 'biller__name', 'biller__company_name', 'customer__email', 'customer__first_name', 'customer__last_name', 'description']
+    search_vector_field = 'search_vector'
+    search_trigram_fields = ['bill_number']
+    ordering_fields = [field.name for field in Bill._meta.fields if field.name != 'search_vector']
     ordering = ['id']
-    pagination_class = CustomPagination
+    pagination_class = HybridPagination
     filterset_fields = {
         'customer__email':['exact'],
         'biller__company_name':['exact'],
         'bill_number':['exact'],
         'biller__user__id':['exact'],
         'status':['exact'],
-        
+        'dunning_stage__action':['exact'],
     }
     
     def get_queryset(self):
@@ -44,7 +49,11 @@ class BillListView(generics.ListAPIView):
         return Bill.objects.filter(customer=user)
 
 
-class BillRetrieveView(generics.RetrieveAPIView):
+class BillExportView(ExportViewMixin, BillListView):
+    pass
+
+
+class BillRetrieveView(EagerLoadingViewMixin, generics.RetrieveAPIView):
     queryset = Bill.objects.all()
     serializer_class = BillSerializer
     permission_classes = [IsAuthenticated, DjangoModelPermissions]
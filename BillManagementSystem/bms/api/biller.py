@@ -9,13 +9,14 @@ from rest_framework.decorators import api_view,permission_classes
 from rest_framework.permissions import IsAuthenticated, DjangoModelPermissions
 from rest_framework.filters import OrderingFilter,SearchFilter
 from bms.api.custom_pagination import CustomPagination
+from bms.api.mixins import EagerLoadingViewMixin
 import datetime
 from django_filters.rest_framework import DjangoFilterBackend
 
 
 User = get_user_model()
 
-class BillerListView(generics.ListAPIView):
+class BillerListView(EagerLoadingViewMixin, generics.ListAPIView):
     queryset = Biller.objects.all()
     serializer_class = BillerSerializer
     permission_classes = []
@@ -39,7 +40,7 @@ class BillerListView(generics.ListAPIView):
     }
 
 
-class BillerRetrieveView(generics.RetrieveAPIView):
+class BillerRetrieveView(EagerLoadingViewMixin, generics.RetrieveAPIView):
     queryset = Biller.objects.all()
     serializer_class = BillerSerializer
     permission_classes = []
@@ -51,12 +52,12 @@ from rest_framework.response import Response
 from rest_framework.permissions import AllowAny
 from drf_yasg.utils import swagger_auto_schema
 from drf_yasg import openapi
-from django.core.mail import send_mail
 from django.conf import settings
 from urllib.parse import urljoin
 
 from ..models import CustomUser, Biller, EmailVerification
 from ..serializers import UserSerializer
+from ..tasks import send_email_on_commit
 
 
 class BillerRegistrationView(generics.CreateAPIView):
@@ -134,7 +135,7 @@ class BillerRegistrationView(generics.CreateAPIView):
             f"Best regards,\nBilling System"
         )
 
-        send_mail(mail_subject, message, settings.EMAIL_HOST_USER, [user.email])
+        send_email_on_commit(mail_subject, message, [user.email])
 
         return Response(
             {
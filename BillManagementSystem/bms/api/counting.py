@@ -0,0 +1,142 @@
+"""
+Count strategies for page-number pagination.
+
+* exact: COUNT(*) over the filtered queryset.
+* capped: count at most PAGINATION_COUNT_CAP rows and report "N+" beyond.
+* estimate: the planner's row estimate (pg_class.reltuples) for unfiltered
+  querysets on PostgreSQL when it is above the cap; exact below it, capped
+  for filtered querysets.
+* none: no count at all.
+
+Results are cached for PAGINATION_COUNT_CACHE_TIMEOUT seconds per view, filter
+signature and tenant. Whether a page has a successor is decided by fetching
+one extra row whenever the count is not exact.
+"""
+import hashlib
+import math
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.paginator import EmptyPage, Page, PageNotAnInteger, Paginator
+from django.db import connections
+from django.utils.functional import cached_property
+
+
+EXACT = 'exact'
+CAPPED = 'capped'
+ESTIMATE = 'estimate'
+NONE = 'none'
+COUNT_STRATEGIES = (EXACT, CAPPED, ESTIMATE, NONE)
+
+CACHE_KEY = 'pagination_count:{strategy}:{view}:{tenant}:{signature}'
+
+
+def get_cap():
+    return getattr(settings, 'PAGINATION_COUNT_CAP', 10000)
+
+
+def count_exact(queryset):
+    return queryset.count(), EXACT
+
+
+def count_capped(queryset):
+    cap = get_cap()
+    count = queryset[:cap + 1].count()
+    if count > cap:
+        return cap, CAPPED
+    return count, EXACT
+
+
+def count_estimate(queryset):
+    query = queryset.query
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql' or query.where or query.distinct:
+        return count_capped(queryset)
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass',
+            [connection.ops.quote_name(queryset.model._meta.db_table)],
+        )
+        row = cursor.fetchone()
+    # -1 until the table has been vacuumed or analyzed
+    if row is None or row[0] < get_cap():
+        return count_exact(queryset)
+    return row[0], ESTIMATE
+
+
+COUNTERS = {EXACT: count_exact, CAPPED: count_capped, ESTIMATE: count_estimate}
+
+
+def get_count(queryset, strategy, cache_key):
+    """(count, kind), where kind is the strategy that produced an inexact count or EXACT."""
+    if strategy == NONE:
+        return None, NONE
+
+    result = cache.get(cache_key)
+    if result is None:
+        result = COUNTERS[strategy](queryset)
+        cache.set(cache_key, result, timeout=getattr(settings, 'PAGINATION_COUNT_CACHE_TIMEOUT', 30))
+    return tuple(result)
+
+
+def get_cache_key(strategy, view, tenant, filter_params):
+    signature = hashlib.md5('&'.join(sorted(filter_params)).encode()).hexdigest()
+    return CACHE_KEY.format(strategy=strategy, view=view, tenant=tenant, signature=signature)
+
+
+class CountedPage(Page):
+    has_more = False
+
+    def has_next(self):
+        if self.paginator.count_kind == EXACT:
+            return super().has_next()
+        return self.has_more
+
+
+class CountedPaginator(Paginator):
+    """Paginator over a precomputed count that may be inexact or missing."""
+
+    def __init__(self, object_list, per_page, count=None, count_kind=EXACT, **kwargs):
+        super().__init__(object_list, per_page, **kwargs)
+        self.count_kind = count_kind
+        if count_kind != EXACT or count is not None:
+            self.__dict__['count'] = count
+
+    @cached_property
+    def num_pages(self):
+        if self.count is None:
+            return None
+        if self.count == 0 and not self.allow_empty_first_page:
+            return 0
+        return math.ceil(max(1, self.count - self.orphans) / self.per_page)
+
+    def validate_number(self, number):
+        if self.count_kind == EXACT:
+            return super().validate_number(number)
+        # pages past an inexact count are served until they come back empty
+        try:
+            if isinstance(number, float) and not number.is_integer():
+                raise ValueError
+            number = int(number)
+        except (TypeError, ValueError):
+            raise PageNotAnInteger(self.error_messages['invalid_page'])
+        if number < 1:
+            raise EmptyPage(self.error_messages['min_page'])
+        return number
+
+    def page(self, number):
+        if self.count_kind == EXACT:
+            return super().page(number)
+
+        number = self.validate_number(number)
+        bottom = (number - 1) * self.per_page
+        rows = list(self.object_list[bottom:bottom + self.per_page + 1])
+        if not rows and number > 1:
+            raise EmptyPage(self.error_messages['no_results'])
+        page = self._get_page(rows[:self.per_page], number, self)
+        page.has_more = len(rows) > self.per_page
+        return page
+
+    def _get_page(self, *args, **kwargs):
+        return CountedPage(*args, **kwargs)
@@ -1,18 +1,246 @@
+from django.conf import settings
+from django.core import signing
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.core.paginator import InvalidPage
+from django.db.models import Q
+from rest_framework.exceptions import NotFound, ValidationError
 from rest_framework.pagination import PageNumberPagination
 from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+from . import counting
+from .counting import CountedPaginator
 
 class CustomPagination(PageNumberPagination):
+    """
+    Page-number pagination with a choice of count strategy (see counting.py):
+    `?count=exact|capped|estimate|none`, else the view's `count_strategy`,
+    else PAGINATION_COUNT_STRATEGY. Inexact counts are reported as strings,
+    "N+" when capped and "~N" when estimated; no count is reported as null.
+    """
     page_size = 10
     page_size_query_param = 'page_size'
     max_page_size = 500
+    django_paginator_class = CountedPaginator
+    count_query_param = 'count'
+    count_formats = {counting.EXACT: None, counting.CAPPED: '{}+', counting.ESTIMATE: '~{}'}
 
-    def get_paginated_response(self, data):
-        return Response({
-            'count': self.page.paginator.count,
-            'total_pages': self.page.paginator.num_pages,
+    def get_count_strategy(self, request, view=None):
+        strategy = (
+            request.query_params.get(self.count_query_param)
+            or getattr(view, 'count_strategy', None)
+            or getattr(settings, 'PAGINATION_COUNT_STRATEGY', counting.EXACT)
+        )
+        if strategy not in counting.COUNT_STRATEGIES:
+            choices = ', '.join(counting.COUNT_STRATEGIES)
+            raise ValidationError({self.count_query_param: [f'Expected one of: {choices}.']})
+        return strategy
+
+    def get_count_filter_params(self, request):
+        """The query parameters that can change the count."""
+        ignored = {
+            self.page_query_param, self.page_size_query_param, self.count_query_param,
+            'ordering', 'fields', 'expand', 'format',
+        }
+        return [
+            f'{key}={value}'
+            for key, values in request.query_params.lists() if key not in ignored
+            for value in values
+        ]
+
+    def get_count_tenant(self, request):
+        user = request.user
+        if user.is_superuser:
+            return 'all'
+        return user.pk
+
+    def get_paginator(self, queryset, page_size, request, view=None):
+        strategy = self.get_count_strategy(request, view)
+        view_label = f'{type(view).__module__}.{type(view).__qualname__}' if view is not None else queryset.model._meta.label
+        cache_key = counting.get_cache_key(
+            strategy, view_label, self.get_count_tenant(request), self.get_count_filter_params(request)
+        )
+        count, count_kind = counting.get_count(queryset, strategy, cache_key)
+        return self.django_paginator_class(queryset, page_size, count=count, count_kind=count_kind)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if self.paginate_queryset_lazily(queryset, request, view) is None:
+            return None
+        if (self.page.paginator.num_pages or 0) > 1 and self.template is not None:
+            self.display_page_controls = True
+        return list(self.page)
+
+    def paginate_queryset_lazily(self, queryset, request, view=None):
+        """
+        Like paginate_queryset, but returns the page as an unevaluated, sliced
+        queryset (already fetched rows when the count is not exact).
+        """
+        self.request = request
+        page_size = self.get_page_size(request)
+        if not page_size:
+            return None
+
+        paginator = self.get_paginator(queryset, page_size, request, view)
+        page_number = self.get_page_number(request, paginator)
+        try:
+            self.page = paginator.page(page_number)
+        except InvalidPage as exc:
+            msg = self.invalid_page_message.format(page_number=page_number, message=str(exc))
+            raise NotFound(msg)
+        return self.page.object_list
+
+    def format_count(self, value):
+        count_format = self.count_formats.get(self.page.paginator.count_kind)
+        if value is None or count_format is None:
+            return value
+        return count_format.format(value)
+
+    def get_paginated_data(self, data):
+        return {
+            'count': self.format_count(self.page.paginator.count),
+            'total_pages': self.format_count(self.page.paginator.num_pages),
             'current_page': self.page.number,
             'next': self.get_next_link(),
             'previous': self.get_previous_link(),
             'page_size': self.page_size,
             'data': data
-        })
\ No newline at end of file
+        }
+
+    def get_paginated_response(self, data):
+        return Response(self.get_paginated_data(data))
+
+
+class HybridPagination(CustomPagination):
+    """
+    Page numbers by default, keyset pagination on request.
+
+    `?pagination=cursor` (or any `?cursor=`) switches to keyset mode: no
+    COUNT(*) and no OFFSET, each page is a range scan starting after the
+    previous one, so deep pages cost the same as the first. It follows the
+    view's ordering, which has to be `id` or one of `cursor_ordering_fields`
+    (view attribute, defaults to created_at) followed by `id`. Cursors are
+    signed and carry the ordering they were issued for.
+    """
+    cursor_query_param = 'cursor'
+    mode_query_param = 'pagination'
+    cursor_ordering_fields = ('created_at',)
+    cursor_salt = 'bms.pagination.cursor'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def uses_cursor(self, request):
+        params = request.query_params
+        return self.cursor_query_param in params or params.get(self.mode_query_param) == 'cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.keyset = self.uses_cursor(request)
+        if not self.keyset:
+            return super().paginate_queryset(queryset, request, view)
+        return self.paginate_queryset_by_cursor(queryset, request, view)
+
+    def paginate_queryset_lazily(self, queryset, request, view=None):
+        # keyset pages need the boundary rows' values, so they are not rendered lazily
+        if self.uses_cursor(request):
+            return None
+        self.keyset = False
+        return super().paginate_queryset_lazily(queryset, request, view)
+
+    def get_keyset_ordering(self, queryset, view):
+        ordering = list(queryset.query.order_by) or list(queryset.model._meta.ordering)
+        allowed = getattr(view, 'cursor_ordering_fields', self.cursor_ordering_fields)
+        if not ordering or not all(isinstance(name, str) for name in ordering):
+            ordering = ['id']
+
+        names = [name.lstrip('-') for name in ordering]
+        if names in (['pk'], ['id']):
+            return [ordering[0].replace('pk', 'id')]
+        if len(names) == 1 and names[0] in allowed:
+            return ordering + [('-' if ordering[0].startswith('-') else '') + 'id']
+        if len(names) == 2 and names[0] in allowed and names[1] in ('id', 'pk'):
+            return [ordering[0], ordering[1].replace('pk', 'id')]
+
+        choices = ', '.join(('id',) + tuple(allowed))
+        raise ValidationError({'ordering': [f'Cursor pagination supports ordering by one of: {choices}.']})
+
+    def encode_cursor(self, ordering, instance, reverse):
+        values = []
+        for name in ordering:
+            value = getattr(instance, name.lstrip('-'))
+            values.append(value.isoformat() if hasattr(value, 'isoformat') else value)
+        return signing.dumps({'o': ordering, 'v': values, 'r': reverse}, salt=self.cursor_salt, compress=True)
+
+    def decode_cursor(self, request, model, ordering):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None, False
+        try:
+            cursor = signing.loads(encoded, salt=self.cursor_salt)
+            if cursor['o'] != ordering or len(cursor['v']) != len(ordering):
+                raise ValueError
+            values = [
+                model._meta.get_field(name.lstrip('-')).to_python(value)
+                for name, value in zip(ordering, cursor['v'])
+            ]
+            return values, bool(cursor['r'])
+        except (signing.BadSignature, KeyError, TypeError, ValueError, DjangoValidationError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def get_keyset_filter(self, ordering, values, reverse):
+        """Rows strictly after `values` in `ordering` (before, when reverse)."""
+        condition = Q()
+        equal = Q()
+        for name, value in zip(ordering, values):
+            field = name.lstrip('-')
+            ascending = name.startswith('-') == reverse
+            condition |= equal & Q(**{f'{field}__{"gt" if ascending else "lt"}': value})
+            equal &= Q(**{field: value})
+
+        # the leading column bound on its own lets the planner use the index range
+        first = ordering[0]
+        ascending = first.startswith('-') == reverse
+        return Q(**{f'{first.lstrip("-")}__{"gte" if ascending else "lte"}': values[0]}) & condition
+
+    def paginate_queryset_by_cursor(self, queryset, request, view=None):
+        self.request = request
+        self.cursor_page_size = self.get_page_size(request) or self.page_size
+        ordering = self.get_keyset_ordering(queryset, view)
+        values, reverse = self.decode_cursor(request, queryset.model, ordering)
+
+        field_names, deferred = queryset.query.deferred_loading
+        if field_names and not deferred:
+            # boundary values are read from the first and last rows
+            queryset = queryset.only(*field_names, *[name.lstrip('-') for name in ordering])
+
+        if values is not None:
+            queryset = queryset.filter(self.get_keyset_filter(ordering, values, reverse))
+        if reverse:
+            queryset = queryset.order_by(*[name[1:] if name.startswith('-') else '-' + name for name in ordering])
+        else:
+            queryset = queryset.order_by(*ordering)
+
+        results = list(queryset[:self.cursor_page_size + 1])
+        has_more = len(results) > self.cursor_page_size
+        results = results[:self.cursor_page_size]
+        if reverse:
+            results.reverse()
+
+        has_next = has_more if not reverse else True
+        has_previous = has_more if reverse else values is not None
+        self.next_cursor = self.encode_cursor(ordering, results[-1], False) if results and has_next else None
+        self.previous_cursor = self.encode_cursor(ordering, results[0], True) if results and has_previous else None
+        return results
+
+    def get_cursor_link(self, cursor):
+        if cursor is None:
+            return None
+        url = remove_query_param(self.request.build_absolute_uri(), self.page_query_param)
+        return replace_query_param(url, self.cursor_query_param, cursor)
+
+    def get_paginated_data(self, data):
+        if not getattr(self, 'keyset', False):
+            return super().get_paginated_data(data)
+        return {
+            'next': self.get_cursor_link(self.next_cursor),
+            'previous': self.get_cursor_link(self.previous_cursor),
+            'page_size': self.cursor_page_size,
+            'data': data
+        }
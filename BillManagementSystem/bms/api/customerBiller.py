@@ -8,13 +8,14 @@ from rest_framework.decorators import api_view,permission_classes
 from rest_framework.permissions import IsAuthenticated, DjangoModelPermissions
 from rest_framework.filters import OrderingFilter,SearchFilter
 from bms.api.custom_pagination import CustomPagination
+from bms.api.mixins import EagerLoadingViewMixin
 import datetime
 from django_filters.rest_framework import DjangoFilterBackend
 
 
 User = get_user_model()
 
-class CustomerBillerListView(generics.ListAPIView):
+class CustomerBillerListView(EagerLoadingViewMixin, generics.ListAPIView):
     queryset = CustomerBiller.objects.all()
     serializer_class = CustomerBillerSerializer
     permission_classes = [IsAuthenticated, DjangoModelPermissions]
@@ -35,7 +36,7 @@ class CustomerBillerListView(generics.ListAPIView):
     }
 
 
-class CustomerBillerRetrieveView(generics.RetrieveAPIView):
+class CustomerBillerRetrieveView(EagerLoadingViewMixin, generics.RetrieveAPIView):
     queryset = CustomerBiller.objects.all()
     serializer_class = CustomerBillerSerializer
     permission_classes = [IsAuthenticated, DjangoModelPermissions]
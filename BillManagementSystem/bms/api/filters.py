@@ -0,0 +1,57 @@
+import re
+
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db import connections
+from django.db.models import F, Q
+from rest_framework.filters import SearchFilter
+from rest_framework.settings import api_settings
+
+from ..search import get_config
+
+
+class RankedSearchFilter(SearchFilter):
+    """
+    `?search=` against the view's `search_vector_field` (see bms.search) and
+    the trigram indexed `search_trigram_fields`, ranked by relevance.
+
+    Every word is matched as a prefix in the vector, and the whole search
+    text as a substring of the trigram columns, so both conditions are served
+    by GIN indexes. Results are ordered by rank unless the request asks for
+    an ordering or a cursor page; put this filter after OrderingFilter.
+    Falls back to SearchFilter over `search_fields` on other databases.
+    """
+    rank_annotation = 'search_rank'
+
+    def get_search_query(self, terms):
+        words = [word for term in terms for word in re.findall(r'\w+', term)]
+        if not words:
+            return None
+        return SearchQuery(' & '.join(f'{word}:*' for word in words), search_type='raw', config=get_config())
+
+    def orders_by_rank(self, request, view):
+        if api_settings.ORDERING_PARAM in request.query_params:
+            return False
+        uses_cursor = getattr(view.paginator, 'uses_cursor', None)
+        return not (uses_cursor and uses_cursor(request))
+
+    def filter_queryset(self, request, queryset, view):
+        terms = self.get_search_terms(request)
+        vector_field = getattr(view, 'search_vector_field', None)
+        if not terms or vector_field is None or connections[queryset.db].vendor != 'postgresql':
+            return super().filter_queryset(request, queryset, view)
+
+        query = self.get_search_query(terms)
+        condition = Q(**{vector_field: query}) if query is not None else Q()
+        text = ' '.join(terms)
+        for field in getattr(view, 'search_trigram_fields', ()):
+            condition |= Q(**{f'{field}__icontains': text})
+        if not condition:
+            return queryset.none()
+
+        queryset = queryset.filter(condition)
+        if query is None:
+            return queryset
+        queryset = queryset.annotate(**{self.rank_annotation: SearchRank(F(vector_field), query)})
+        if self.orders_by_rank(request, view):
+            queryset = queryset.order_by(f'-{self.rank_annotation}', 'pk')
+        return queryset
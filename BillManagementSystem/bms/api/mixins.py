@@ -0,0 +1,228 @@
+import csv
+import datetime
+import decimal
+import io
+import json
+import uuid
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections
+from django.db.models import QuerySet
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from rest_framework.exceptions import NotFound
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework.renderers import JSONRenderer
+
+from ..database_json import build_row_json, dumps
+from ..identity_map import CONTEXT_KEY as IDENTITY_MAP_CONTEXT_KEY, IdentityMap
+from ..serializers import EagerLoadingMixin, FlexFieldsMixin, parse_field_paths
+
+
+class EagerLoadingViewMixin:
+    """
+    Sparse fieldsets and expansion for list and detail views.
+
+    On reads, `?fields=` and `?expand=` (comma separated, dotted for nested
+    objects) are handed to the serializer, and the filtered queryset gets the
+    matching select_related/Prefetch plan and only() columns, so a page costs
+    the same number of queries whatever its size.
+    Works with views that override get_queryset for scoping.
+
+    Serializers of one request share an identity map; with DEBUG or
+    IDENTITY_MAP_DEBUG_HEADER on, the number of loads and renders it saved is
+    reported in the X-Identity-Map-Hits response header.
+    """
+    fields_query_param = 'fields'
+    expand_query_param = 'expand'
+
+    def get_requested_fields(self):
+        if self.request is None or self.request.method not in SAFE_METHODS:
+            return {}
+        return parse_field_paths(self.request.query_params.get(self.fields_query_param))
+
+    def get_requested_expand(self):
+        if self.request is None or self.request.method not in SAFE_METHODS:
+            return {}
+        return parse_field_paths(self.request.query_params.get(self.expand_query_param))
+
+    def get_identity_map(self):
+        if getattr(self, '_identity_map', None) is None:
+            self._identity_map = IdentityMap()
+        return self._identity_map
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context[IDENTITY_MAP_CONTEXT_KEY] = self.get_identity_map()
+        return context
+
+    def get_serializer(self, *args, **kwargs):
+        if issubclass(self.get_serializer_class(), FlexFieldsMixin):
+            kwargs.setdefault('fields', self.get_requested_fields())
+            kwargs.setdefault('expand', self.get_requested_expand())
+        return super().get_serializer(*args, **kwargs)
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        serializer_class = self.get_serializer_class()
+        if issubclass(serializer_class, EagerLoadingMixin):
+            queryset = serializer_class.setup_eager_loading(
+                queryset, fields=self.get_requested_fields(), expand=self.get_requested_expand()
+            )
+        return queryset
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        identity_map = getattr(self, '_identity_map', None)
+        if identity_map is not None and getattr(settings, 'IDENTITY_MAP_DEBUG_HEADER', settings.DEBUG):
+            response['X-Identity-Map-Hits'] = str(identity_map.hits)
+        return response
+
+
+class DatabaseJSONListMixin(EagerLoadingViewMixin):
+    """
+    Selects how a list view renders its pages.
+
+    With `json_engine = 'database'` the page is rendered by PostgreSQL (see
+    bms.database_json) and streamed as rows arrive, for the same body the
+    serializer would produce. Requests the database path cannot reproduce
+    exactly (expanded relations, non-JSON or indented output, other
+    databases, unsupported fields) go through the serializer as usual.
+    """
+    json_engine = 'serializer'
+    json_chunk_size = 500
+
+    def list(self, request, *args, **kwargs):
+        if self.json_engine == 'database':
+            response = self.database_list(request)
+            if response is not None:
+                return response
+        return super().list(request, *args, **kwargs)
+
+    def can_render_in_database(self, request):
+        if connections[self.get_queryset().db].vendor != 'postgresql':
+            return False
+        if self.paginator is None or not hasattr(self.paginator, 'paginate_queryset_lazily'):
+            return False
+        if self.get_requested_expand():
+            return False
+
+        renderer = request.accepted_renderer
+        if type(renderer) is not JSONRenderer or renderer.ensure_ascii or not renderer.compact:
+            return False
+        return renderer.get_indent(request.accepted_media_type, {}) is None
+
+    def database_list(self, request):
+        if not self.can_render_in_database(request):
+            return None
+        row_json = build_row_json(self.get_serializer())
+        if row_json is None:
+            return None
+
+        queryset = self.filter_queryset(self.get_queryset())
+        rows = queryset.prefetch_related(None).values_list(row_json, flat=True)
+        page = self.paginator.paginate_queryset_lazily(rows, request, view=self)
+        if page is None:
+            return None
+
+        envelope = dumps(self.paginator.get_paginated_data([]))
+        assert envelope.endswith('"data":[]}')
+        return StreamingHttpResponse(
+            self.stream_page(envelope[:-2], page), content_type=JSONRenderer.media_type
+        )
+
+    def stream_page(self, prefix, page):
+        yield prefix
+        chunk = []
+        separator = ''
+        # inexact counts fetch the page up front to see whether another one follows
+        rows = page.iterator(chunk_size=self.json_chunk_size) if isinstance(page, QuerySet) else page
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) == self.json_chunk_size:
+                yield separator + ','.join(chunk)
+                separator, chunk = ',', []
+        if chunk:
+            yield separator + ','.join(chunk)
+        yield ']}'
+
+
+class ExportViewMixin:
+    """
+    Streams a list view's whole result set as CSV or NDJSON.
+
+    Mix into a list view to reuse its get_queryset scoping and filter
+    backends. Rows come from values() over a server-side cursor and are
+    written out chunk by chunk, so memory use does not grow with the export
+    and the CSV header goes out before the query runs. `?fields=` narrows the
+    columns (default: every concrete field, relations as ids).
+    """
+    pagination_class = None
+    export_formats = {
+        'csv': 'text/csv; charset=utf-8',
+        'ndjson': 'application/x-ndjson',
+    }
+    export_fields = None
+    export_exclude = ('search_vector',)
+    export_chunk_size = 2000
+
+    def get_export_fields(self):
+        model = self.get_queryset().model
+        fields = list(self.export_fields or [
+            field.name for field in model._meta.concrete_fields if field.name not in self.export_exclude
+        ])
+        requested = self.get_requested_fields() if hasattr(self, 'get_requested_fields') else {}
+        if requested:
+            fields = [name for name in fields if name in requested]
+        return fields
+
+    def get(self, request, *args, export_format=None, **kwargs):
+        if export_format not in self.export_formats:
+            raise NotFound(f'Unsupported export format "{export_format}".')
+
+        fields = self.get_export_fields()
+        queryset = self.filter_queryset(self.get_queryset())
+        rows = queryset.prefetch_related(None).values_list(*fields).iterator(chunk_size=self.export_chunk_size)
+        writer = getattr(self, f'write_{export_format}')
+
+        response = StreamingHttpResponse(writer(fields, rows), content_type=self.export_formats[export_format])
+        model = queryset.model._meta.verbose_name_plural.replace(' ', '_').lower()
+        response['Content-Disposition'] = f'attachment; filename="{model}-{timezone.now():%Y%m%d}.{export_format}"'
+        return response
+
+    def chunked(self, rows):
+        chunk = []
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) == self.export_chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    def write_csv(self, fields, rows):
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(fields)
+        yield buffer.getvalue()
+        for chunk in self.chunked(rows):
+            buffer.seek(0)
+            buffer.truncate()
+            writer.writerows([export_value(value) for value in row] for row in chunk)
+            yield buffer.getvalue()
+
+    def write_ndjson(self, fields, rows):
+        for chunk in self.chunked(rows):
+            yield ''.join(
+                json.dumps(dict(zip(fields, row)), cls=DjangoJSONEncoder, ensure_ascii=False) + '\n'
+                for row in chunk
+            )
+
+
+def export_value(value):
+    if value is None:
+        return ''
+    if isinstance(value, (datetime.date, datetime.time, decimal.Decimal, uuid.UUID)):
+        return DjangoJSONEncoder().default(value)
+    return value
@@ -7,22 +7,27 @@ from django.contrib.auth import get_user_model
 from rest_framework.decorators import api_view,permission_classes
 from rest_framework.permissions import IsAuthenticated, DjangoModelPermissions
 from rest_framework.filters import OrderingFilter,SearchFilter
-from bms.api.custom_pagination import CustomPagination
+from bms.api.filters import RankedSearchFilter
+from bms.api.custom_pagination import HybridPagination
+from bms.api.mixins import EagerLoadingViewMixin, ExportViewMixin
 import datetime
 from django_filters.rest_framework import DjangoFilterBackend
 
 
 User = get_user_model()
 
-class NotificationListView(generics.ListAPIView):
+class NotificationListView(EagerLoadingViewMixin, generics.ListAPIView):
     queryset = Notification.objects.all()
     serializer_class = NotificationSerializer
     permission_classes = [IsAuthenticated, DjangoModelPermissions]
-    filter_backends = [SearchFilter, OrderingFilter,DjangoFilterBackend]
-    search_fields = [field.name for field in Notification._meta.fields]
-    ordering_fields = [field.name for field in Notification._meta.fields]
+    filter_backends = [OrderingFilter, RankedSearchFilter, DjangoFilterBackend]
+    search_fields = ['subject', 'bill__bill_number', 'message']
+    search_vector_field = 'search_vector'
+    search_trigram_fields = ['subject']
+    ordering_fields = [field.name for field in Notification._meta.fields if field.name != 'search_vector']
     ordering = ['id']
-    pagination_class = CustomPagination
+    pagination_class = HybridPagination
+    cursor_ordering_fields = ('created_at', 'sent_at')
     filterset_fields = {
         'bill__bill_number':['exact'],
         'customer__id':['exact'],
@@ -34,7 +39,11 @@ class NotificationListView(generics.ListAPIView):
     }
 
 
-class NotificationRetrieveView(generics.RetrieveAPIView):
+class NotificationExportView(ExportViewMixin, NotificationListView):
+    pass
+
+
+class NotificationRetrieveView(EagerLoadingViewMixin, generics.RetrieveAPIView):
     queryset = Notification.objects.all()
     serializer_class = NotificationSerializer
     permission_classes = [IsAuthenticated, DjangoModelPermissions]
@@ -1,19 +1,28 @@
+from decimal import Decimal, InvalidOperation
+
+from auditlog.models import LogEntry
 from rest_framework import generics, permissions, status
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.filters import SearchFilter, OrderingFilter
 from django_filters.rest_framework import DjangoFilterBackend
-from django.db import transaction
+from django.db import IntegrityError, transaction
 from drf_yasg.utils import swagger_auto_schema
 from drf_yasg import openapi
 from django.contrib.auth import get_user_model
+from ..audit import bulk_log
 from ..models import Payment, PaymentBill, Bill
 from ..serializers import PaymentSerializer
-from bms.api.custom_pagination import CustomPagination
+from bms.api.custom_pagination import HybridPagination
+from bms.api.mixins import DatabaseJSONListMixin, EagerLoadingViewMixin, ExportViewMixin
 from rest_framework.permissions import IsAuthenticated, DjangoModelPermissions
 
 User = get_user_model()
 
+CENT = Decimal('0.01')
+# Payment.amount holds 10 digits, 2 of them decimals
+MAX_AMOUNT = Decimal('100000000')
+
 
 from rest_framework import generics
 from rest_framework.permissions import IsAuthenticated, DjangoModelPermissions
@@ -24,12 +33,15 @@ from ..serializers import PaymentSerializer
 from bms.api.custom_pagination import CustomPagination
 
 
-class PaymentListView(generics.ListAPIView):
+class PaymentListView(DatabaseJSONListMixin, generics.ListAPIView):
     queryset = Payment.objects.all()
     serializer_class = PaymentSerializer
+    json_engine = 'database'
+    # the biller scope counts over a distinct payment_bills join
+    count_strategy = 'capped'
     permission_classes = [IsAuthenticated, DjangoModelPermissions]
     filter_backends = [SearchFilter, OrderingFilter, DjangoFilterBackend]
-    pagination_class = CustomPagination
+    pagination_class = HybridPagination
 
     # Search and ordering
     search_fields = ['payment_method', 'reference_number']
@@ -58,7 +70,11 @@ class PaymentListView(generics.ListAPIView):
         return Payment.objects.filter(customer=user).distinct()
 
 
-class PaymentRetrieveView(generics.RetrieveAPIView):
+class PaymentExportView(ExportViewMixin, PaymentListView):
+    pass
+
+
+class PaymentRetrieveView(EagerLoadingViewMixin, generics.RetrieveAPIView):
     queryset = Payment.objects.all()
     serializer_class = PaymentSerializer
     permission_classes = [IsAuthenticated, DjangoModelPermissions]
@@ -84,7 +100,8 @@ class PaymentCreateView(generics.CreateAPIView):
 
 class BulkPaymentCreateView(APIView):
     """
-    Create one Payment and multiple PaymentBill allocations atomically.
+    Create one Payment and multiple PaymentBill allocations atomically, in
+    the same handful of queries however many bills it settles.
     """
     permission_classes = [permissions.IsAuthenticated]
 
@@ -122,10 +139,37 @@ class BulkPaymentCreateView(APIView):
         if not allocations or not isinstance(allocations, list):
             return Response({"error": "allocations must be a non-empty list"}, status=400)
 
-        total_amount = sum(float(a["amount_applied"]) for a in allocations)
+        try:
+            amounts = [(int(alloc["bill_id"]), Decimal(str(alloc["amount_applied"]))) for alloc in allocations]
+        except (KeyError, TypeError, ValueError, InvalidOperation):
+            return Response({"error": "each allocation needs a bill_id and a numeric amount_applied"}, status=400)
+        if any(not amount.is_finite() or amount <= 0 for _, amount in amounts):
+            return Response({"error": "amount_applied must be positive"}, status=400)
+        if any(amount >= MAX_AMOUNT for _, amount in amounts):
+            return Response({"error": f"amount_applied must be under {MAX_AMOUNT}"}, status=400)
+        if any(amount != amount.quantize(CENT) for _, amount in amounts):
+            return Response({"error": "amount_applied has at most two decimal places"}, status=400)
+        amounts = [(bill_id, amount.quantize(CENT)) for bill_id, amount in amounts]
+
+        total_amount = sum((amount for _, amount in amounts), Decimal('0.00'))
+        if total_amount >= MAX_AMOUNT:
+            return Response({"error": f"the payment must be under {MAX_AMOUNT}"}, status=400)
+        if payment_method not in dict(Payment.PAYMENT_METHODS):
+            return Response({"error": "payment_method must be one of " + ", ".join(dict(Payment.PAYMENT_METHODS))}, status=400)
+        if reference_number is not None and len(str(reference_number)) > Payment._meta.get_field('reference_number').max_length:
+            return Response({"error": "reference_number is too long"}, status=400)
 
         try:
             with transaction.atomic():
+                # one query for every bill, locked in id order so concurrent settlements cannot deadlock
+                bills = {
+                    bill.pk: bill
+                    for bill in Bill.objects.select_for_update().filter(pk__in={bill_id for bill_id, _ in amounts})
+                    .only('bill_number').order_by('pk')
+                }
+                if len(bills) != len({bill_id for bill_id, _ in amounts}):
+                    return Response({"error": "Invalid Bill ID"}, status=400)
+
                 payment = Payment.objects.create(
                     customer=user,
                     amount=total_amount,
@@ -134,29 +178,31 @@ class BulkPaymentCreateView(APIView):
                     notes=notes,
                 )
 
-                created_allocations = []
-                for alloc in allocations:
-                    bill = Bill.objects.get(id=alloc["bill_id"])
-                    PaymentBill.objects.create(
-                        payment=payment,
-                        bill=bill,
-                        amount_applied=alloc["amount_applied"]
-                    )
-                    created_allocations.append({
-                        "bill_id": bill.id,
-                        "bill_number": bill.bill_number,
-                        "amount_applied": alloc["amount_applied"],
-                        "bill_status": bill.status
-                    })
+                payment_bills = PaymentBill.objects.bulk_create([
+                    PaymentBill(payment=payment, bill=bills[bill_id], amount_applied=amount)
+                    for bill_id, amount in amounts
+                ])
+                bulk_log(payment_bills, LogEntry.Action.CREATE)
+                statuses = Bill.objects.apply_allocations(payment, list(bills))
+
+                created_allocations = [
+                    {
+                        "bill_id": bill_id,
+                        "bill_number": bills[bill_id].bill_number,
+                        "amount_applied": str(amount),
+                        "bill_status": statuses[bill_id],
+                    }
+                    for bill_id, amount in amounts
+                ]
 
                 return Response({
                     "message": "Payment created successfully",
                     "payment_id": payment.id,
-                    "total_amount": total_amount,
+                    "total_amount": str(total_amount),
                     "allocations": created_allocations
                 }, status=201)
 
-        except Bill.DoesNotExist:
-            return Response({"error": "Invalid Bill ID"}, status=400)
-        except Exception as e:
-            return Response({"error": str(e)}, status=400)
+        except IntegrityError:
+            # a bill deleted or a constraint broken between the checks above and the writes
+            return Response({"error": "the payment could not be recorded; check the allocations and try again"},
+                            status=400)
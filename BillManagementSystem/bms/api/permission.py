@@ -1,5 +1,6 @@
 from django.contrib.auth.models import Permission
-from rest_framework import generics
+from rest_framework import generics, status
+from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated,DjangoModelPermissions
 from rest_framework.filters import OrderingFilter,SearchFilter
 from ..serializers import PermissionSerializer
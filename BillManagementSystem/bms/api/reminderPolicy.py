@@ -0,0 +1,57 @@
+from rest_framework import generics
+from rest_framework.exceptions import PermissionDenied, ValidationError
+from rest_framework.filters import OrderingFilter
+from rest_framework.permissions import IsAuthenticated, DjangoModelPermissions
+from django_filters.rest_framework import DjangoFilterBackend
+
+from ..models import Biller, ReminderPolicy
+from ..serializers import ReminderPolicySerializer
+from bms.api.custom_pagination import CustomPagination
+
+
+class BillerPoliciesMixin:
+    """A biller works on its own policies only; superusers see every biller's."""
+
+    def get_queryset(self):
+        user = self.request.user
+
+        if user.is_superuser:
+            return ReminderPolicy.objects.all()
+
+        return ReminderPolicy.objects.filter(biller__user=user)
+
+
+class ReminderPolicyListView(BillerPoliciesMixin, generics.ListAPIView):
+    queryset = ReminderPolicy.objects.all()
+    serializer_class = ReminderPolicySerializer
+    permission_classes = [IsAuthenticated, DjangoModelPermissions]
+    filter_backends = [OrderingFilter, DjangoFilterBackend]
+    ordering_fields = ['biller', 'days_offset']
+    ordering = ['biller', 'days_offset']
+    pagination_class = CustomPagination
+    filterset_fields = {
+        'biller__id': ['exact'],
+        'biller__user__id': ['exact'],
+        'days_offset': ['exact'],
+    }
+
+
+class ReminderPolicyCreateView(generics.CreateAPIView):
+    queryset = ReminderPolicy.objects.all()
+    serializer_class = ReminderPolicySerializer
+    permission_classes = [IsAuthenticated, DjangoModelPermissions]
+
+    def perform_create(self, serializer):
+        biller = Biller.objects.filter(user=self.request.user).first()
+        if biller is None:
+            raise PermissionDenied("only billers set reminder policies")
+        days_offset = serializer.validated_data['days_offset']
+        if ReminderPolicy.objects.filter(biller=biller, days_offset=days_offset).exists():
+            raise ValidationError({"days_offset": ["a reminder is already set for this day"]})
+        serializer.save(biller=biller)
+
+
+class ReminderPolicyDeleteView(BillerPoliciesMixin, generics.DestroyAPIView):
+    queryset = ReminderPolicy.objects.all()
+    serializer_class = ReminderPolicySerializer
+    permission_classes = [IsAuthenticated, DjangoModelPermissions]
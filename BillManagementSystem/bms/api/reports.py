@@ -41,12 +41,12 @@ def outstanding_payments(user):
     """Outstanding (unpaid) bills summary for the customer."""
     today = timezone.now().date()
     total_due = (
-        Bill.objects.filter(customer=user, status='pending')
-        .aggregate(total_due=Sum('amount'))['total_due'] or 0
+        Bill.objects.filter(customer=user, status__in=['pending', 'partially_paid', 'overdue'])
+        .aggregate(total_due=Sum('balance'))['total_due'] or 0
     )
 
     overdue_count = (
-        Bill.objects.filter(customer=user, status='pending', due_date__lt=today)
+        Bill.objects.filter(customer=user, status__in=['pending', 'partially_paid', 'overdue'], due_date__lt=today)
         .count()
     )
 
@@ -128,8 +128,8 @@ def biller_outstanding_invoices(biller):
     today = timezone.now().date()
 
     total_outstanding = (
-        Bill.objects.filter(biller=biller, status__in=['pending', 'overdue'])
-        .aggregate(total_outstanding=Sum('amount'))['total_outstanding'] or 0
+        Bill.objects.filter(biller=biller, status__in=['pending', 'partially_paid', 'overdue'])
+        .aggregate(total_outstanding=Sum('balance'))['total_outstanding'] or 0
     )
 
     overdue_invoices = (
@@ -142,11 +142,17 @@ def biller_outstanding_invoices(biller):
         .count()
     )
 
+    partially_paid_invoices = (
+        Bill.objects.filter(biller=biller, status='partially_paid')
+        .count()
+    )
+
     return {
         'total_outstanding': total_outstanding,
         'overdue_invoices': overdue_invoices,
         'pending_invoices': pending_invoices,
-        'total_unpaid_invoices': overdue_invoices + pending_invoices
+        'partially_paid_invoices': partially_paid_invoices,
+        'total_unpaid_invoices': overdue_invoices + pending_invoices + partially_paid_invoices
     }
 
 
@@ -156,7 +162,7 @@ def biller_customer_statistics(biller):
     active_customers = (
         CustomerBiller.objects.filter(
             biller=biller,
-            user__bills__status__in=['pending', 'overdue']
+            user__bills__status__in=['pending', 'partially_paid', 'overdue']
         )
         .distinct()
         .count()
@@ -2,13 +2,15 @@ from django.contrib.auth.models import Permission,Group
 from rest_framework import generics
 from rest_framework.permissions import IsAuthenticated,DjangoModelPermissions
 from rest_framework.filters import OrderingFilter,SearchFilter
+from bms.api.filters import RankedSearchFilter
 from ..serializers import UserSerializer
-from bms.api.custom_pagination import CustomPagination
+from ..tasks import send_email_on_commit
+from bms.api.custom_pagination import CustomPagination, HybridPagination
+from bms.api.mixins import EagerLoadingViewMixin
 from rest_framework.decorators import api_view,permission_classes
 from rest_framework import status
 from rest_framework.response import Response
 from django.contrib.auth import get_user_model
-from django.core.mail import send_mail
 from rest_framework_simplejwt.tokens import RefreshToken,AccessToken
 from django.urls import reverse
 from django.contrib.sites.shortcuts import get_current_site
@@ -22,21 +24,26 @@ from rest_framework.permissions import AllowAny
 import os
 from django_filters.rest_framework import DjangoFilterBackend
 from django.db.models import Q
+from django.db.models import Case, Exists, OuterRef, When
+import re
 
 
 User = get_user_model()
 EMAIL_HOST_USER = os.getenv("EMAIL_HOST_USER")
 #SITE_URL = settings.SITE_URL
 
-class UserListView(generics.ListAPIView):
+class UserListView(EagerLoadingViewMixin, generics.ListAPIView):
     queryset = User.objects.all()
     serializer_class = UserSerializer
     permission_classes = [IsAuthenticated,DjangoModelPermissions]
-    filter_backends = [OrderingFilter,SearchFilter,DjangoFilterBackend]
-    search_fields = [field.name for field in User._meta.fields]
-    ordering_fields = [field.name for field in User._meta.fields]
+    filter_backends = [OrderingFilter,RankedSearchFilter,DjangoFilterBackend]
+    search_fields = ['email', 'first_name', 'middle_name', 'last_name', 'phone_number', 'address']
+    search_vector_field = 'search_vector'
+    search_trigram_fields = ['email', 'first_name', 'last_name']
+    ordering_fields = [field.name for field in User._meta.fields if field.name != 'search_vector']
     ordering = ['id']
-    pagination_class = CustomPagination
+    pagination_class = HybridPagination
+    cursor_ordering_fields = ('date_joined',)
     filterset_fields = {
         'email': ['exact', 'icontains'],
         'first_name': ['exact', 'icontains'],
@@ -51,7 +58,7 @@ class UserListView(generics.ListAPIView):
     }
 
 
-class UserRetrieveView(generics.RetrieveAPIView):
+class UserRetrieveView(EagerLoadingViewMixin, generics.RetrieveAPIView):
     queryset = User.objects.all()
     serializer_class = UserSerializer
     permission_classes = [IsAuthenticated, DjangoModelPermissions]
@@ -172,13 +179,12 @@ def send_password_reset_email(request):
     '''
     
     # Send email with both plain text and HTML content
-    send_mail(
+    send_email_on_commit(
         subject="Password reset request",
         message=f"Click the link below to reset your password:\n\n{dummy_site}",  # Plain text version
         html_message=html_message,  # HTML version
         from_email="ketsebaotertumo@gmail.com",
         recipient_list=[email],
-        fail_silently=False
     )
 
 
@@ -271,13 +277,15 @@ def update_user(request,id):
 
 
 
-class GetTenats(generics.ListAPIView):
+class GetTenats(EagerLoadingViewMixin, generics.ListAPIView):
     queryset = User.objects.filter(groups__name="tenant")
     serializer_class = UserSerializer
     permission_classes = [IsAuthenticated,DjangoModelPermissions]
-    filter_backends = [OrderingFilter,SearchFilter]
-    search_fields = [field.name for field in User._meta.fields]
-    ordering_fields = [field.name for field in User._meta.fields]
+    filter_backends = [OrderingFilter,RankedSearchFilter]
+    search_fields = ['email', 'first_name', 'middle_name', 'last_name', 'phone_number', 'address']
+    search_vector_field = 'search_vector'
+    search_trigram_fields = ['email', 'first_name', 'last_name']
+    ordering_fields = [field.name for field in User._meta.fields if field.name != 'search_vector']
     ordering = ['id']
     pagination_class = CustomPagination
 
@@ -326,7 +334,6 @@ from rest_framework.response import Response
 from rest_framework.permissions import AllowAny
 from drf_yasg.utils import swagger_auto_schema
 from drf_yasg import openapi
-from django.core.mail import send_mail
 from django.conf import settings
 from urllib.parse import urljoin
 
@@ -335,7 +342,6 @@ from ..serializers import UserSerializer
 
 
 from django.db import transaction
-from django.core.mail import send_mail
 from django.conf import settings
 from rest_framework import generics, status
 from rest_framework.response import Response
@@ -435,7 +441,7 @@ class CustomerRegistrationView(generics.CreateAPIView):
             f"Please verify your email by clicking the link below:\n\n{absolute_url}\n\n"
             f"You are registering with the following billers: {', '.join(created_links)}"
         )
-        send_mail(mail_subject, message, settings.EMAIL_HOST_USER, [user.email])
+        send_email_on_commit(mail_subject, message, [user.email])
 
         return Response({
             "message": "Registration successful. Please check your email to verify your account.",
@@ -454,7 +460,7 @@ def verify_email(request, token):
             user.is_active = True
             user.save()
             verification.delete()  
-            send_mail("verification successful", "Your email has been successfully verified. You can now log in.", EMAIL_HOST_USER, [user.email])
+            send_email_on_commit("verification successful", "Your email has been successfully verified. You can now log in.", [user.email], from_email=EMAIL_HOST_USER)
             return Response({'message': 'Your email has been successfully verified. You can now log in.'}, status=status.HTTP_200_OK)
         else:
             return Response({'message': 'Your email has already been verified.'}, status=status.HTTP_200_OK)
@@ -481,7 +487,7 @@ def contact_us(request):
     if not(full_name or email or subject or message or recepient_email):
         return Response({"error":"please provide all the fields needed"},status=status.HTTP_400_BAD_REQUEST)
 
-    send_mail(subject=subject,message=message,from_email=email,recipient_list=['jni@gmail.com'])
+    send_email_on_commit(subject=subject,message=message,from_email=email,recipient_list=['jni@gmail.com'])
 
     return Response({"success":"sent email successfully"},status=status.HTTP_200_OK)
 
@@ -507,10 +513,79 @@ def get_customers(request):
                 Q(phone_number__icontains=search_term)
             )
         paginator = CustomPagination()
+        customers = UserSerializer.setup_eager_loading(customers)
         paginated_customers = paginator.paginate_queryset(customers, request)
         serializer = UserSerializer(paginated_customers, many=True)
         return paginator.get_paginated_response(serializer.data)
 
 
+TYPEAHEAD_FIELDS = ('id', 'first_name', 'middle_name', 'last_name', 'email', 'phone_number')
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def customer_typeahead(request):
+    """
+    Autocomplete over the caller's customers: ?q=<text>&limit=<k>.
+
+    Every word has to prefix-match the first name, last name or email, and a
+    number prefix-matches the phone number with formatting stripped; both use
+    the prefix indexes on CustomUser. Exact matches rank first. When that
+    gives fewer than `limit` customers the rest is filled with substring
+    matches from the trigram indexes.
+    """
+    term = ' '.join(request.query_params.get('q', '').split())
+    try:
+        limit = int(request.query_params.get('limit', settings.TYPEAHEAD_DEFAULT_LIMIT))
+    except ValueError:
+        return Response({"error": "limit must be a number"}, status=status.HTTP_400_BAD_REQUEST)
+    limit = max(1, min(limit, settings.TYPEAHEAD_MAX_LIMIT))
 
-    
\ No newline at end of file
+    if request.user.is_superuser:
+        customers = User.objects.filter(groups__name="Customer")
+    elif request.user.is_biller:
+        customers = User.objects.filter(Exists(
+            CustomerBiller.objects.filter(biller__user=request.user, user=OuterRef('pk'))
+        ))
+    else:
+        return Response({"error": "only billers can look up customers"}, status=status.HTTP_403_FORBIDDEN)
+
+    if len(term) < settings.TYPEAHEAD_MIN_LENGTH:
+        return Response({"data": []}, status=status.HTTP_200_OK)
+
+    digits = re.sub(r'\D', '', term)
+    if re.fullmatch(r'[\d\s+()\-.]+', term) and len(digits) >= settings.TYPEAHEAD_MIN_LENGTH:
+        customers = customers.annotate(phone_digits=PhoneDigits('phone_number'))
+        matches = Q(phone_digits__startswith=digits)
+        rank = Case(When(phone_digits=digits, then=Value(0)), default=Value(1))
+        fallback = None
+    else:
+        words = term.split()
+        matches = Q()
+        for word in words:
+            matches &= Q(first_name__istartswith=word) | Q(last_name__istartswith=word) | Q(email__istartswith=word)
+        rank = Case(
+            When(email__iexact=term, then=Value(0)),
+            When(Q(first_name__iexact=words[0]) | Q(last_name__iexact=words[0]), then=Value(1)),
+            default=Value(2),
+        )
+        fallback = Q(first_name__icontains=term) | Q(last_name__icontains=term) | Q(email__icontains=term)
+
+    ordering = ('last_name', 'first_name', 'id')
+    found = list(
+        customers.filter(matches).annotate(rank=rank).order_by('rank', *ordering).values(*TYPEAHEAD_FIELDS)[:limit]
+    )
+    if len(found) < limit and fallback is not None:
+        found += customers.filter(fallback).exclude(id__in=[customer['id'] for customer in found]) \
+            .order_by(*ordering).values(*TYPEAHEAD_FIELDS)[:limit - len(found)]
+
+    data = [
+        {
+            "id": customer['id'],
+            "name": ' '.join(filter(None, (customer['first_name'], customer['middle_name'], customer['last_name']))),
+            "email": customer['email'],
+            "phone_number": customer['phone_number'],
+        }
+        for customer in found
+    ]
+    return Response({"data": data}, status=status.HTTP_200_OK)
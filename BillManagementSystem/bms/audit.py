@@ -0,0 +1,35 @@
+"""
+Audit log entries for rows written in bulk.
+
+bulk_create() and QuerySet.update() do not send the model signals
+django-auditlog listens to, so code writing in bulk records the entries
+itself, one INSERT per batch.
+"""
+from auditlog.cid import get_cid
+from auditlog.diff import model_instance_diff
+from auditlog.models import LogEntry
+from django.contrib.contenttypes.models import ContentType
+from django.utils.encoding import smart_str
+
+
+def bulk_log(instances, action, changes=None):
+    """
+    Write the LogEntry auditlog would have written for each instance.
+
+    `changes` applies to every instance; without it each instance is diffed
+    against nothing, which is how creations are logged.
+    """
+    cid = get_cid()
+    entries = [
+        LogEntry(
+            content_type=ContentType.objects.get_for_model(instance),
+            object_pk=smart_str(instance.pk),
+            object_id=instance.pk if isinstance(instance.pk, int) else None,
+            object_repr=smart_str(instance),
+            action=action,
+            changes=changes if changes is not None else model_instance_diff(None, instance),
+            cid=cid,
+        )
+        for instance in instances
+    ]
+    return LogEntry.objects.bulk_create(entries)
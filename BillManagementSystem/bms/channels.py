@@ -0,0 +1,111 @@
+"""
+SMS and WhatsApp reminders over Twilio's Messages API.
+
+Each sender thread keeps an event loop and, per channel, an aiohttp session
+whose keep-alive connector is reused across batches and task runs. A batch
+is posted concurrently with at most CHANNEL_GATEWAYS[channel]['concurrency']
+requests in flight. deliver() fits outbox.SENDERS: it sets each
+notification's status, sent_at and error_message.
+
+Customers list their channels in order of preference
+(CustomUser.notification_channels). A reminder goes out on the first channel
+that is configured and that the customer has an address for; a message
+dead-lettered on one channel moves on to the next (outbox._send).
+
+Point TWILIO_API_URL at the fake_gateway command to run without Twilio.
+"""
+import asyncio
+import threading
+
+import aiohttp
+from django.conf import settings
+
+from .delivery import record
+
+
+# Twilio addresses WhatsApp numbers with a prefix, SMS numbers without
+PREFIXES = {'sms': '', 'whatsapp': 'whatsapp:'}
+
+_local = threading.local()
+
+
+def address(channel, user):
+    if channel == 'email':
+        return user.email
+    return user.phone_number and PREFIXES[channel] + user.phone_number
+
+
+def pick(user, after=None):
+    """
+    The user's first preferred channel (after `after`, if given) that has a
+    provider configured and an address for them, or None.
+    """
+    preferred = list(user.notification_channels or ['email'])
+    if after is not None:
+        preferred = preferred[preferred.index(after) + 1:] if after in preferred else []
+    for channel in preferred:
+        if channel in settings.OUTBOX_PROVIDERS and address(channel, user):
+            return channel
+    return None
+
+
+def get_loop():
+    loop = getattr(_local, 'loop', None)
+    if loop is None:
+        loop = _local.loop = asyncio.new_event_loop()
+    return loop
+
+
+def get_session(channel):
+    """This thread's session for `channel`; call it on the thread's loop."""
+    sessions = _local.__dict__.setdefault('sessions', {})
+    session = sessions.get(channel)
+    if session is None or session.closed:
+        session = sessions[channel] = aiohttp.ClientSession(
+            auth=aiohttp.BasicAuth(settings.TWILIO_ACCOUNT_SID or '', settings.TWILIO_AUTH_TOKEN or ''),
+            connector=aiohttp.TCPConnector(limit=settings.CHANNEL_GATEWAYS[channel]['concurrency']),
+            timeout=aiohttp.ClientTimeout(total=settings.CHANNEL_TIMEOUT),
+        )
+    return session
+
+
+def close():
+    """Close this thread's sessions, e.g. before a short-lived process exits."""
+    sessions = _local.__dict__.pop('sessions', {})
+    for session in sessions.values():
+        get_loop().run_until_complete(session.close())
+
+
+def messages_url():
+    return f"{settings.TWILIO_API_URL.rstrip('/')}/2010-04-01/Accounts/{settings.TWILIO_ACCOUNT_SID}/Messages.json"
+
+
+async def post(session, url, data):
+    """POST one message; an error message or None."""
+    if not data['To']:
+        return 'no phone number'
+    try:
+        async with session.post(url, data=data) as response:
+            if response.status < 300:
+                return None
+            body = await response.json(content_type=None)
+            return f"{response.status} {body.get('message', '')}".strip()
+    except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+        return str(e) or e.__class__.__name__
+
+
+async def send_all(channel, notifications):
+    session = get_session(channel)
+    url = messages_url()
+    sender = PREFIXES[channel] + (settings.CHANNEL_GATEWAYS[channel]['from'] or '')
+    return await asyncio.gather(*[
+        post(session, url, {'To': address(channel, notification.customer), 'From': sender, 'Body': notification.message})
+        for notification in notifications
+    ])
+
+
+def deliver(channel, notifications):
+    """Send each notification to its customer on `channel` and set its status, sent_at and error_message."""
+    errors = get_loop().run_until_complete(send_all(channel, notifications))
+    record(notifications, errors)
+    return notifications
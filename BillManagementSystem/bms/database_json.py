@@ -0,0 +1,125 @@
+"""
+Serializer-equivalent JSON rendered by PostgreSQL.
+
+For flat serializers (relations as ids, nothing expanded) every readable field
+maps to one column, so the row's JSON text can be assembled in SQL and
+streamed to the client as it is fetched, without instantiating models or
+running DRF fields. The output has to be byte for byte what JSONRenderer
+produces for the same serializer:
+
+* compact separators, non-ascii characters left as is, U+2028/U+2029 escaped,
+* decimals as strings with the column's scale,
+* datetimes in UTC as ISO 8601 with a 'Z' suffix and microseconds only when
+  they are not zero, dates as ISO 8601.
+
+build_row_json() returns None for anything it cannot reproduce exactly, and
+callers fall back to the serializer.
+"""
+import json
+import re
+
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import F, Func, TextField
+from django.utils import timezone
+from rest_framework import ISO_8601, serializers
+from rest_framework.relations import PrimaryKeyRelatedField
+from rest_framework.settings import api_settings
+
+
+TEMPLATES = {
+    'json': 'to_json({value})::text',
+    'string': 'replace(replace(to_json({value})::text, chr(8232), %s), chr(8233), %s)',
+    'decimal': 'to_json(({value})::text)::text',
+    'datetime': (
+        "to_json(to_char({value} AT TIME ZONE 'UTC', %s)"
+        " || CASE WHEN date_trunc('second', {value}) = {value} THEN '' ELSE to_char({value} AT TIME ZONE 'UTC', %s) END"
+        " || 'Z')::text"
+    ),
+}
+PLACEHOLDER_RE = re.compile(r'\{value\}|%s')
+TEMPLATE_PARAMS = {
+    'json': [],
+    'string': ['\\u2028', '\\u2029'],
+    'decimal': [],
+    'datetime': ['YYYY-MM-DD"T"HH24:MI:SS', '.US'],
+}
+
+
+def dumps(data):
+    """json.dumps with the options JSONRenderer uses for compact responses."""
+    text = json.dumps(data, ensure_ascii=False, allow_nan=False, separators=(',', ':'))
+    return text.replace('\u2028', '\\u2028').replace('\u2029', '\\u2029')
+
+
+class RowJSON(Func):
+    """One JSON object per row, keys in serializer order."""
+    output_field = TextField()
+
+    def __init__(self, columns):
+        # columns: [(key, kind, expression)]
+        self.columns = [(key, kind) for key, kind, _ in columns]
+        super().__init__(*[expression for _, _, expression in columns], output_field=TextField())
+
+    def as_sql(self, compiler, connection, **extra_context):
+        parts, params = [], []
+        for index, ((key, kind), expression) in enumerate(zip(self.columns, self.get_source_expressions())):
+            value_sql, value_params = compiler.compile(expression)
+            template = TEMPLATES[kind]
+            template_params = iter(TEMPLATE_PARAMS[kind])
+            sql_params = []
+            for placeholder in PLACEHOLDER_RE.findall(template):
+                if placeholder == '{value}':
+                    sql_params.extend(value_params)
+                else:
+                    sql_params.append(next(template_params))
+
+            prefix = ('{' if index == 0 else ',') + dumps(key) + ':'
+            parts.append("%s::text || coalesce({}, 'null')".format(template.format(value=value_sql)))
+            params.extend([prefix] + sql_params)
+        return '(' + ' || '.join(parts) + " || '}')", params
+
+
+def get_column_kind(field):
+    if isinstance(field, serializers.BooleanField):
+        return 'json'
+    if isinstance(field, (serializers.IntegerField, PrimaryKeyRelatedField)):
+        return 'json'
+    if isinstance(field, serializers.DecimalField):
+        if not getattr(field, 'coerce_to_string', api_settings.COERCE_DECIMAL_TO_STRING) or field.localize:
+            return None
+        return 'decimal'
+    if isinstance(field, serializers.DateTimeField):
+        if getattr(field, 'format', api_settings.DATETIME_FORMAT) != ISO_8601:
+            return None
+        if timezone.get_current_timezone_name() != 'UTC':
+            return None
+        return 'datetime'
+    if isinstance(field, serializers.DateField):
+        if getattr(field, 'format', api_settings.DATE_FORMAT) != ISO_8601:
+            return None
+        return 'json'
+    if isinstance(field, (serializers.CharField, serializers.ChoiceField)):
+        return 'string'
+    return None
+
+
+def build_row_json(serializer):
+    """The RowJSON expression for `serializer`'s readable fields, or None."""
+    model = serializer.Meta.model
+    columns = []
+    for field in serializer._readable_fields:
+        kind = get_column_kind(field)
+        if kind is None or '.' in field.source or field.source == '*':
+            return None
+        try:
+            model_field = model._meta.get_field(field.source)
+        except FieldDoesNotExist:
+            return None
+        if not model_field.concrete or model_field.many_to_many:
+            return None
+        # generated columns carry their type on output_field
+        column_type = model_field.output_field if model_field.generated else model_field
+        if isinstance(field, serializers.DecimalField) and getattr(column_type, 'decimal_places', None) != field.decimal_places:
+            return None
+        columns.append((field.field_name, kind, F(model_field.attname)))
+    return RowJSON(columns) if columns else None
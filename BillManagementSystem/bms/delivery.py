@@ -0,0 +1,133 @@
+"""
+Notification email delivery over persistent SMTP connections.
+
+Each delivery thread keeps one connection from get_connection() open across
+batches and task runs, instead of connecting, starting TLS and logging in for
+every email. Notifications are split into batches of EMAIL_DELIVERY_BATCH_SIZE
+and sent by up to EMAIL_DELIVERY_CONCURRENCY threads. Messages go through
+send_messages() one at a time so each notification gets its own outcome; a
+dropped connection is reopened and the message retried once. write_back()
+records the outcomes with one statement per status.
+"""
+import smtplib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.utils import timezone
+
+from .models import Notification
+
+
+# the connection is gone (server timeout, restart, network); anything else is about the message
+RECONNECT_ERRORS = (smtplib.SMTPServerDisconnected, ConnectionError, TimeoutError)
+
+_local = threading.local()
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_worker_connection():
+    """This thread's mail connection, opened if it is not."""
+    connection = getattr(_local, 'connection', None)
+    if connection is None:
+        connection = _local.connection = get_connection(fail_silently=False)
+    connection.open()
+    return connection
+
+
+def reset_worker_connection():
+    connection = getattr(_local, 'connection', None)
+    if connection is not None:
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.EMAIL_DELIVERY_CONCURRENCY, thread_name_prefix='email-delivery',
+            )
+    return _executor
+
+
+def build_message(notification):
+    return EmailMessage(
+        notification.subject,
+        notification.message,
+        settings.DEFAULT_FROM_EMAIL,
+        [notification.customer.email],
+    )
+
+
+def send_batch(messages):
+    """Send `messages` on this thread's connection; one error message or None per message."""
+    errors = []
+    for message in messages:
+        for retry in (False, True):
+            try:
+                get_worker_connection().send_messages([message])
+                errors.append(None)
+                break
+            except RECONNECT_ERRORS as e:
+                reset_worker_connection()
+                if retry:
+                    errors.append(str(e) or e.__class__.__name__)
+            except Exception as e:
+                errors.append(str(e) or e.__class__.__name__)
+                break
+    return errors
+
+
+def deliver(notifications):
+    """Email each notification's customer and set its status, sent_at and error_message."""
+    batch_size = settings.EMAIL_DELIVERY_BATCH_SIZE
+    batches = [notifications[start:start + batch_size] for start in range(0, len(notifications), batch_size)]
+    messages = [[build_message(notification) for notification in batch] for batch in batches]
+    if settings.EMAIL_DELIVERY_CONCURRENCY > 1 and len(batches) > 1:
+        results = get_executor().map(send_batch, messages)
+    else:
+        results = map(send_batch, messages)
+
+    for batch, errors in zip(batches, results):
+        record(batch, errors)
+    return notifications
+
+
+def record(notifications, errors):
+    """Set status, sent_at and error_message from one error message or None per notification."""
+    now = timezone.now()
+    for notification, error in zip(notifications, errors):
+        notification.updated_at = now
+        if error is None:
+            notification.status = 'sent'
+            notification.sent_at = now
+        else:
+            notification.status = 'failed'
+            notification.error_message = error
+
+
+def write_back(notifications):
+    """
+    Store the outcomes deliver() set: one UPDATE for the sent, one for the
+    failed, and one each for the reminders their digests cover (bms.digests).
+    """
+    sent = [notification for notification in notifications if notification.status == 'sent']
+    failed = [notification for notification in notifications if notification.status == 'failed']
+    if sent:
+        Notification.objects.bulk_update(sent, ['status', 'sent_at', 'updated_at'])
+        covered(sent).update(status='sent', sent_at=timezone.now(), updated_at=timezone.now())
+    if failed:
+        Notification.objects.bulk_update(failed, ['status', 'error_message', 'updated_at'])
+        covered(failed).update(status='failed', error_message='digest not delivered', updated_at=timezone.now())
+
+
+def covered(digests):
+    """The other reminders `digests` were sent for."""
+    ids = [digest.pk for digest in digests if digest.digest_id is not None]
+    return Notification.objects.filter(digest__in=ids).exclude(pk__in=ids)
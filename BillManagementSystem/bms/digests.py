@@ -0,0 +1,76 @@
+"""
+Reminder digests.
+
+Reminders for the bills of billers with `digest_reminders` on are claimed per
+bill like any other (so each bill keeps its Notification and its
+de-duplication) but not queued. At the end of a run package() picks them up,
+groups them by customer and reminder type and rewrites the first of each
+group into one message listing every bill. Each row of the group points at
+that one (Notification.digest) and only it is queued. The outbox copies its
+outcome to the rest of the group (delivery.write_back).
+"""
+from itertools import groupby
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from . import outbox, search
+from .models import Biller, Notification
+
+
+DIGEST_TEXT = {
+    'overdue': ('{count} overdue bills', 'The following bills are past their due date:'),
+    'upcoming_due': ('{count} bills coming due', 'The following bills are coming due:'),
+}
+
+
+def digest_billers(bills):
+    """Which of the `bills`' billers want digests."""
+    return set(
+        Biller.objects.filter(digest_reminders=True, pk__in={bill.biller_id for bill in bills})
+        .values_list('pk', flat=True)
+    )
+
+
+def compose(notif_type, customer, bills):
+    subject, heading = DIGEST_TEXT[notif_type]
+    lines = '\n'.join(f"- {bill.biller} #{bill.bill_number}: {bill.amount} ETB, due {bill.due_date}" for bill in bills)
+    total = sum(bill.amount for bill in bills)
+    return (
+        subject.format(count=len(bills)),
+        f"Dear {customer.first_name or 'Customer'},\n\n{heading}\n\n{lines}\n\nTotal: {total} ETB",
+    )
+
+
+def package():
+    """Fold the claimed, unqueued reminders into one per customer and type and queue them; returns how many."""
+    undigested = (
+        Notification.objects.filter(
+            status='pending', digest__isnull=True, outbox__isnull=True, notification_type__in=DIGEST_TEXT,
+        )
+        .select_related('customer', 'bill__biller')
+        .select_for_update(skip_locked=True, of=('self',))
+        .order_by('customer_id', 'notification_type', 'bill__due_date', 'pk')
+    )
+    queued = 0
+    while True:
+        with transaction.atomic():
+            notifications = list(undigested[:settings.DUE_NOTIFICATIONS_BATCH_SIZE])
+            if not notifications:
+                return queued
+            now = timezone.now()
+            digests = []
+            for (_, notif_type), group in groupby(notifications, key=lambda n: (n.customer_id, n.notification_type)):
+                group = list(group)
+                digest = group[0]
+                if len(group) > 1:
+                    digest.subject, digest.message = compose(notif_type, digest.customer, [n.bill for n in group])
+                for notification in group:
+                    notification.digest = digest
+                    notification.updated_at = now
+                digests.append(digest)
+            Notification.objects.bulk_update(notifications, ['subject', 'message', 'digest', 'updated_at'])
+            search.update_search_vectors(Notification.objects.filter(pk__in=[digest.pk for digest in digests]))
+            outbox.enqueue(digests)
+        queued += len(digests)
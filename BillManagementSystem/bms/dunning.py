@@ -0,0 +1,102 @@
+"""
+Dunning.
+
+Unpaid bills past their due date climb a ladder of DunningStage rows: a
+reminder, a final notice, then a flag for disconnection or collections. A
+bill is at the furthest stage whose `days_past_due` it has reached while
+still owing at least the stage's `min_outstanding` (Bill.balance); paying
+enough of it moves it back down, and paying it off takes it out.
+
+advance() works out the whole book in one statement (ADVANCE_SQL): a window
+function ranks the stages each bill qualifies for, and only the bills whose
+stage differs from Bill.dunning_stage are updated and get a DunningEvent
+row. A run therefore writes as many rows as there are
+transitions, however many bills are overdue. tasks.run_dunning then queues a
+notice for bills reaching a notice stage; the flag stages are only recorded
+for billers to act on (get_bills?dunning_stage__action=disconnection).
+"""
+from collections import defaultdict, namedtuple
+
+from auditlog.models import LogEntry
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.utils import timezone
+
+from .audit import bulk_log
+from .models import Bill, DunningEvent, DunningStage
+
+User = get_user_model()
+
+
+# stages that send the customer a notice; the others flag the bill
+NOTICE_ACTIONS = ('reminder', 'final_notice')
+
+# candidates: bills unpaid past their due date, plus those at a stage (to take
+# them down once paid); both are covered by bill_dunning_idx
+ADVANCE_SQL = """
+    WITH candidate AS (
+        SELECT
+            bill.id, bill.status, bill.dunning_stage_id, %(today)s - bill.due_date AS days_past_due,
+            bill.balance AS outstanding
+        FROM {bill} AS bill
+        WHERE (bill.status IN ('overdue', 'partially_paid') AND bill.due_date < %(today)s)
+            OR bill.dunning_stage_id IS NOT NULL
+    ),
+    ranked AS (
+        SELECT
+            candidate.*, stage.id AS stage_id,
+            ROW_NUMBER() OVER (
+                PARTITION BY candidate.id ORDER BY stage.days_past_due DESC, stage.min_outstanding DESC, stage.id DESC
+            ) AS position
+        FROM candidate
+        LEFT JOIN {stage} AS stage
+            ON candidate.status IN ('overdue', 'partially_paid')
+            AND stage.days_past_due <= candidate.days_past_due
+            AND stage.min_outstanding <= candidate.outstanding
+    ),
+    moved AS (
+        UPDATE {bill} AS bill SET dunning_stage_id = ranked.stage_id, dunning_stage_at = %(now)s, updated_at = %(now)s
+        FROM ranked
+        WHERE ranked.position = 1 AND bill.id = ranked.id
+            AND bill.dunning_stage_id IS DISTINCT FROM ranked.stage_id
+        RETURNING bill.id, bill.status, bill.customer_id, ranked.dunning_stage_id AS previous_stage_id, ranked.stage_id,
+            ranked.days_past_due, ranked.outstanding
+    ),
+    event AS (
+        INSERT INTO {event} (bill_id, previous_stage_id, stage_id, days_past_due, outstanding, created_at)
+        SELECT id, previous_stage_id, stage_id, days_past_due, outstanding, %(now)s FROM moved
+    )
+    SELECT moved.id, moved.status, customer.email, moved.previous_stage_id, moved.stage_id, moved.days_past_due,
+        moved.outstanding
+    FROM moved JOIN {user} AS customer ON customer.id = moved.customer_id
+    ORDER BY moved.id
+"""
+
+Transition = namedtuple('Transition', 'bill_id previous_stage_id stage_id days_past_due outstanding')
+
+
+def advance(today):
+    """
+    Move every bill to the dunning stage it has reached by `today` and
+    return the Transitions made; call it in a transaction.
+    """
+    quote = connection.ops.quote_name
+    sql = ADVANCE_SQL.format(
+        bill=quote(Bill._meta.db_table),
+        stage=quote(DunningStage._meta.db_table),
+        event=quote(DunningEvent._meta.db_table),
+        user=quote(User._meta.db_table),
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, {'today': today, 'now': timezone.now()})
+        rows = cursor.fetchall()
+
+    # the audit log shows each bill's dunning_stage change, one entry per bill
+    logged = defaultdict(list)
+    transitions = []
+    for bill_id, status, email, previous_stage_id, stage_id, days_past_due, outstanding in rows:
+        logged[previous_stage_id, stage_id].append(Bill(id=bill_id, status=status, customer=User(email=email)))
+        transitions.append(Transition(bill_id, previous_stage_id, stage_id, days_past_due, outstanding))
+    for (previous_stage_id, stage_id), bills in logged.items():
+        bulk_log(bills, LogEntry.Action.UPDATE, changes={'dunning_stage': [str(previous_stage_id), str(stage_id)]})
+    return transitions
@@ -0,0 +1,103 @@
+"""
+Request-scoped identity map for objects shared across nested serializers.
+
+One page of payments can reference the same customer as the payment's
+customer, as each allocated bill's customer and as a biller's user. Instead
+of joining those rows in once per path, relations to identity-mapped
+serializers (see `identity_mapped` on the serializers) are left out of the
+eager-loading plan and resolved here after the page is fetched: every distinct
+object is loaded once per request, shared by all the rows that point to it,
+and rendered once per field selection.
+"""
+from collections import defaultdict
+
+from django.db.models import prefetch_related_objects
+
+
+CONTEXT_KEY = 'identity_map'
+
+
+def get_identity_map(context):
+    identity_map = context.get(CONTEXT_KEY)
+    if identity_map is None:
+        identity_map = context[CONTEXT_KEY] = IdentityMap()
+    return identity_map
+
+
+class IdentityMap:
+    def __init__(self):
+        self.objects = {}
+        self.rendered = {}
+        self.load_hits = 0
+        self.render_hits = 0
+
+    @property
+    def hits(self):
+        return self.load_hits + self.render_hits
+
+    def attach(self, requests):
+        """
+        Resolve forward relations in one query per model.
+
+        `requests` is a list of (field, instances, prefetch_lookups). Each
+        instance gets the shared related object cached on `field`; the
+        return value lists the distinct related objects per request.
+        """
+        wanted = defaultdict(set)
+        lookups = defaultdict(set)
+        references = 0
+        for field, instances, prefetch_lookups in requests:
+            model = field.related_model
+            lookups[model].update(prefetch_lookups)
+            for instance in instances:
+                if field.is_cached(instance):
+                    related = field.get_cached_value(instance)
+                    if related is not None:
+                        self.objects.setdefault((model, related.pk), related)
+                    continue
+                pk = getattr(instance, field.attname)
+                if pk is not None:
+                    wanted[model].add(pk)
+                    references += 1
+
+        loaded = 0
+        for model, pks in wanted.items():
+            missing = [pk for pk in pks if (model, pk) not in self.objects]
+            if missing:
+                for obj in model._default_manager.filter(pk__in=missing):
+                    self.objects[(model, obj.pk)] = obj
+                    loaded += 1
+        self.load_hits += max(references - loaded, 0)
+
+        results = []
+        targets = defaultdict(dict)
+        for field, instances, prefetch_lookups in requests:
+            model = field.related_model
+            related = {}
+            for instance in instances:
+                if field.is_cached(instance):
+                    obj = field.get_cached_value(instance)
+                else:
+                    pk = getattr(instance, field.attname)
+                    obj = self.objects.get((model, pk)) if pk is not None else None
+                    field.set_cached_value(instance, obj)
+                if obj is not None:
+                    related[obj.pk] = obj
+            targets[model].update(related)
+            results.append(list(related.values()))
+
+        for model, objs in targets.items():
+            if lookups[model]:
+                # skips objects whose lookups were already prefetched earlier in the request
+                prefetch_related_objects(list(objs.values()), *lookups[model])
+        return results
+
+    def get_rendered(self, key):
+        representation = self.rendered.get(key)
+        if representation is None:
+            return None
+        self.render_hits += 1
+        return dict(representation)
+
+    def set_rendered(self, key, representation):
+        self.rendered[key] = dict(representation)
@@ -0,0 +1,66 @@
+import base64
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+
+from bms import channels
+from bms.models import Notification
+
+
+class Command(BaseCommand):
+    help = (
+        'Send synthetic SMS or WhatsApp reminders through bms.channels and report messages per second. '
+        'Nothing is written to the database; run it against the fake_gateway command.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--channel', choices=sorted(channels.PREFIXES), default='sms')
+        parser.add_argument('--count', type=int, default=1000)
+        parser.add_argument('--baseline', action='store_true',
+                            help='also time one blocking request at a time')
+
+    def handle(self, *args, **options):
+        User = get_user_model()
+        channel = options['channel']
+        notifications = [
+            Notification(customer=User(phone_number=f'+2519{index:08d}'), notification_type='general',
+                         sent_via=channel, subject=f'Benchmark {index}', message='Benchmark message.')
+            for index in range(options['count'])
+        ]
+
+        if options['baseline']:
+            started = time.perf_counter()
+            failed = sum(self.post_blocking(channel, notification) is not None for notification in notifications)
+            self.report('one request at a time', len(notifications), time.perf_counter() - started, failed)
+
+        started = time.perf_counter()
+        channels.deliver(channel, notifications)
+        elapsed = time.perf_counter() - started
+        channels.close()
+        failed = sum(notification.status == 'failed' for notification in notifications)
+        self.report(f'bms.channels ({settings.CHANNEL_GATEWAYS[channel]["concurrency"]} in flight)',
+                    len(notifications), elapsed, failed)
+
+    def post_blocking(self, channel, notification):
+        data = urllib.parse.urlencode({
+            'To': channels.address(channel, notification.customer),
+            'From': channels.PREFIXES[channel] + (settings.CHANNEL_GATEWAYS[channel]['from'] or ''),
+            'Body': notification.message,
+        }).encode()
+        credentials = f'{settings.TWILIO_ACCOUNT_SID or ""}:{settings.TWILIO_AUTH_TOKEN or ""}'
+        request = urllib.request.Request(channels.messages_url(), data=data, headers={
+            'Authorization': 'Basic ' + base64.b64encode(credentials.encode()).decode(),
+        })
+        try:
+            with urllib.request.urlopen(request, timeout=settings.CHANNEL_TIMEOUT):
+                return None
+        except (urllib.error.URLError, OSError) as e:
+            return str(e)
+
+    def report(self, label, count, elapsed, failed=0):
+        self.stdout.write(f'{label}: {count} messages in {elapsed:.2f}s ({count / elapsed:.0f}/s), {failed} failed')
@@ -0,0 +1,43 @@
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.mail import get_connection
+from django.core.management.base import BaseCommand
+
+from bms import delivery
+from bms.models import Notification
+
+
+class Command(BaseCommand):
+    help = (
+        'Send synthetic notification emails through bms.delivery and report messages per second. '
+        'Nothing is written to the database; run it against the smtp_sink command.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=1000)
+        parser.add_argument('--baseline', action='store_true',
+                            help='also time one connection per message, as send_mail() does')
+
+    def handle(self, *args, **options):
+        User = get_user_model()
+        notifications = [
+            Notification(customer=User(email=f'customer{index}@example.com'), notification_type='general',
+                         subject=f'Benchmark {index}', message='Benchmark message.')
+            for index in range(options['count'])
+        ]
+
+        if options['baseline']:
+            started = time.perf_counter()
+            for notification in notifications:
+                get_connection().send_messages([delivery.build_message(notification)])
+            self.report('one connection per message', len(notifications), time.perf_counter() - started)
+
+        started = time.perf_counter()
+        delivery.deliver(notifications)
+        elapsed = time.perf_counter() - started
+        failed = sum(notification.status == 'failed' for notification in notifications)
+        self.report('bms.delivery', len(notifications), elapsed, failed)
+
+    def report(self, label, count, elapsed, failed=0):
+        self.stdout.write(f'{label}: {count} messages in {elapsed:.2f}s ({count / elapsed:.0f}/s), {failed} failed')
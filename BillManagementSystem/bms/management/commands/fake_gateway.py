@@ -0,0 +1,88 @@
+import asyncio
+import random
+import re
+import uuid
+
+from aiohttp import web
+from django.core.management.base import BaseCommand
+
+
+MESSAGES_PATH = '/2010-04-01/Accounts/{account}/Messages.json'
+
+
+class Gateway:
+    """Accepts Twilio Messages API requests without sending anything."""
+
+    def __init__(self, latency=0.0, failure_rate=0.0):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.received = []
+        self.connections = set()
+
+    def app(self):
+        app = web.Application()
+        app.router.add_post(MESSAGES_PATH, self.create_message)
+        return app
+
+    async def create_message(self, request):
+        self.connections.add(request.transport)
+        form = await request.post()
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if not re.fullmatch(r'(whatsapp:)?\+?[0-9 ()-]{7,}', form.get('To', '')):
+            return web.json_response(
+                {'code': 21211, 'message': f"The 'To' number {form.get('To')} is not a valid phone number.", 'status': 400},
+                status=400,
+            )
+        if random.random() < self.failure_rate:
+            return web.json_response({'code': 20500, 'message': 'Internal Server Error', 'status': 500}, status=500)
+        self.received.append(dict(form))
+        return web.json_response(
+            {'sid': f'SM{uuid.uuid4().hex}', 'to': form['To'], 'from': form.get('From'), 'status': 'queued'},
+            status=201,
+        )
+
+
+class Command(BaseCommand):
+    help = (
+        "Run a local stand-in for Twilio's Messages API that accepts SMS and WhatsApp messages and reports "
+        'throughput, for testing and benchmarking bms.channels offline. Point the app at it with '
+        'TWILIO_API_URL=http://127.0.0.1:<port>.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8025)
+        parser.add_argument('--latency', type=float, default=0.0,
+                            help='seconds to wait before answering each request, to mimic the real API')
+        parser.add_argument('--failure-rate', type=float, default=0.0,
+                            help='fraction of valid requests answered with a 500')
+
+    def handle(self, *args, **options):
+        self.gateway = Gateway(options['latency'], options['failure_rate'])
+        try:
+            asyncio.run(self.serve(options['host'], options['port']))
+        except KeyboardInterrupt:
+            pass
+        self.stdout.write(f'{len(self.gateway.received)} messages over {len(self.gateway.connections)} connections')
+
+    async def serve(self, host, port):
+        runner = web.AppRunner(self.gateway.app())
+        await runner.setup()
+        await web.TCPSite(runner, host, port).start()
+        self.stdout.write(f'Fake gateway listening on http://{host}:{port}')
+        try:
+            await self.report()
+        finally:
+            await runner.cleanup()
+
+    async def report(self):
+        last = 0
+        while True:
+            await asyncio.sleep(1)
+            received = len(self.gateway.received)
+            if received != last:
+                self.stdout.write(
+                    f'{received} received, {received - last}/s, {len(self.gateway.connections)} connections'
+                )
+                last = received
@@ -0,0 +1,44 @@
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import DecimalField, F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+from bms.models import Bill, PaymentBill
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute every bill's paid_amount from its PaymentBill allocations, and its status with it, "
+        'for bills written around the signals (bulk_create, update, raw SQL). Only bills whose '
+        'paid_amount is off are written; one UPDATE per id range.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=10000, help='bill ids per UPDATE')
+        parser.add_argument('--dry-run', action='store_true', help='count the bills that are off without fixing them')
+
+    def handle(self, *args, **options):
+        allocated = Coalesce(
+            Subquery(
+                PaymentBill.objects.filter(bill=OuterRef('pk')).order_by().values('bill')
+                .annotate(total=Sum('amount_applied')).values('total')
+            ),
+            Value(Decimal('0')),
+            output_field=DecimalField(max_digits=10, decimal_places=2),
+        )
+        last_id = Bill.objects.order_by('-pk').values_list('pk', flat=True).first() or 0
+        repaired = 0
+        for first in range(0, last_id + 1, options['batch_size']):
+            bills = (
+                Bill.objects.filter(pk__range=(first, first + options['batch_size'] - 1))
+                .alias(allocated=allocated).exclude(paid_amount=F('allocated'))
+            )
+            if options['dry_run']:
+                repaired += bills.count()
+                continue
+            with transaction.atomic():
+                # set_paid() bumps updated_at, so cached representations refresh, and audits the status changes
+                repaired += len(Bill.objects.set_paid(list(bills.values_list('pk', flat=True)), allocated))
+        self.stdout.write(f"{repaired} bills {'to repair' if options['dry_run'] else 'repaired'}")
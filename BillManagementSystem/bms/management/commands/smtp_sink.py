@@ -0,0 +1,68 @@
+import asyncio
+
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = (
+        'Run a local SMTP server that accepts and discards every message and reports throughput, '
+        'for benchmarking email delivery offline. Point the app at it with EMAIL_HOST=127.0.0.1, '
+        'EMAIL_PORT=<port>, EMAIL_USE_TLS=False and no EMAIL_HOST_USER.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=1025)
+        parser.add_argument('--latency', type=float, default=0.0,
+                            help='seconds to wait before accepting each message, to mimic a remote server')
+
+    def handle(self, *args, **options):
+        self.latency = options['latency']
+        self.received = 0
+        self.sessions = 0
+        try:
+            asyncio.run(self.serve(options['host'], options['port']))
+        except KeyboardInterrupt:
+            pass
+        self.stdout.write(f'{self.received} messages in {self.sessions} sessions')
+
+    async def serve(self, host, port):
+        server = await asyncio.start_server(self.session, host, port)
+        self.stdout.write(f'SMTP sink listening on {host}:{port}')
+        async with server:
+            await self.report()
+
+    async def report(self):
+        last = self.received
+        while True:
+            await asyncio.sleep(1)
+            if self.received != last:
+                self.stdout.write(f'{self.received} received, {self.received - last}/s, {self.sessions} sessions')
+                last = self.received
+
+    async def session(self, reader, writer):
+        self.sessions += 1
+        writer.write(b'220 bms-smtp-sink ESMTP\r\n')
+        try:
+            while line := await reader.readline():
+                command = line[:4].upper()
+                if command == b'EHLO':
+                    writer.write(b'250-bms-smtp-sink\r\n250-8BITMIME\r\n250 SMTPUTF8\r\n')
+                elif command == b'DATA':
+                    writer.write(b'354 End data with <CR><LF>.<CR><LF>\r\n')
+                    await writer.drain()
+                    while (data := await reader.readline()) and data.rstrip(b'\r\n') != b'.':
+                        pass
+                    if self.latency:
+                        await asyncio.sleep(self.latency)
+                    self.received += 1
+                    writer.write(b'250 OK\r\n')
+                elif command == b'QUIT':
+                    writer.write(b'221 Bye\r\n')
+                    break
+                else:
+                    # HELO, MAIL, RCPT, RSET, NOOP
+                    writer.write(b'250 OK\r\n')
+                await writer.drain()
+        finally:
+            writer.close()
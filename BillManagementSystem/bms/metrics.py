@@ -0,0 +1,62 @@
+"""
+Prometheus metrics, served at /api/metrics.
+
+RequestLatencyMiddleware times every request into a histogram labelled with
+the resolved URL name, so percentiles per endpoint come from e.g.
+
+    histogram_quantile(0.99, sum by (le) (rate(bms_request_latency_seconds_bucket{view="sign_up"}[5m])))
+
+Each gunicorn worker keeps its own samples. Point PROMETHEUS_MULTIPROC_DIR
+at a directory shared by the workers (emptied before they start) and the
+endpoint reports all of them.
+
+The endpoint answers only a scraper sending settings.METRICS_TOKEN as
+`Authorization: Bearer <token>`, and no one while the token is unset.
+"""
+import hmac
+import os
+import time
+
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Histogram, generate_latest, multiprocess
+
+
+REQUEST_LATENCY = Histogram(
+    'bms_request_latency_seconds',
+    'Time from the request reaching Django to the response leaving it.',
+    ['view', 'method'],
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+)
+
+
+class RequestLatencyMiddleware:
+    """Keep it first in MIDDLEWARE so the other middleware is timed too."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        started = time.perf_counter()
+        response = self.get_response(request)
+        match = request.resolver_match
+        # unresolved paths (404s) share one label instead of one per path
+        view = match.url_name or match.view_name if match else 'unresolved'
+        REQUEST_LATENCY.labels(view=view, method=request.method).observe(time.perf_counter() - started)
+        return response
+
+
+def get_registry():
+    if 'PROMETHEUS_MULTIPROC_DIR' not in os.environ:
+        return REGISTRY
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return registry
+
+
+def metrics(request):
+    token = getattr(settings, 'METRICS_TOKEN', None)
+    supplied = request.headers.get('Authorization', '')
+    if not token or not hmac.compare_digest(supplied.encode(), f'Bearer {token}'.encode()):
+        return HttpResponseForbidden()
+    return HttpResponse(generate_latest(get_registry()), content_type=CONTENT_TYPE_LATEST)
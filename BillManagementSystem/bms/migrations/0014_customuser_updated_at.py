@@ -0,0 +1,18 @@
+# Generated by Django 5.2.6 on 2026-10-18 12:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bms', '0013_remove_payment_bill_paymentbill'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customuser',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+    ]
@@ -0,0 +1,84 @@
+# Generated by Django 5.2.6 on 2026-10-18 12:58
+
+import bms.models
+import django.contrib.postgres.indexes
+import django.db.models.functions.text
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+# rows per UPDATE; each batch commits on its own, so no table is locked for the whole backfill
+BATCH_SIZE = 10000
+
+
+def build_search_vectors(apps, schema_editor):
+    from bms import search
+
+    for model_name in ('Bill', 'Notification', 'CustomUser'):
+        manager = apps.get_model('bms', model_name)._default_manager
+        last_id = manager.order_by('-pk').values_list('pk', flat=True).first() or 0
+        for first in range(0, last_id + 1, BATCH_SIZE):
+            search.update_search_vectors(manager.filter(pk__range=(first, first + BATCH_SIZE - 1)), apps=apps)
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction; the tables stay writable while they build
+    atomic = False
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('bms', '0015_search_vectors'),
+    ]
+
+    operations = [
+        # filled before the GIN indexes exist so the backfill does not maintain them row by row
+        migrations.RunPython(build_search_vectors, migrations.RunPython.noop),
+        AddIndexConcurrently(
+            model_name='bill',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='bill_search_vector_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='bill',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper('bill_number'), name='gin_trgm_ops'), name='bill_number_trgm_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='customuser',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='user_search_vector_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='customuser',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper('email'), name='gin_trgm_ops'), name='user_email_trgm_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='customuser',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper('first_name'), name='gin_trgm_ops'), name='user_first_name_trgm_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='customuser',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper('last_name'), name='gin_trgm_ops'), name='user_last_name_trgm_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='notification',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='notification_search_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='notification',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper('subject'), name='gin_trgm_ops'), name='notification_subject_trgm_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='customuser',
+            index=models.Index(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper('email'), name='text_pattern_ops'), name='user_email_prefix_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='customuser',
+            index=models.Index(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper('first_name'), name='text_pattern_ops'), name='user_first_name_prefix_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='customuser',
+            index=models.Index(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper('last_name'), name='text_pattern_ops'), name='user_last_name_prefix_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='customuser',
+            index=models.Index(django.contrib.postgres.indexes.OpClass(bms.models.PhoneDigits('phone_number'), name='text_pattern_ops'), name='user_phone_digits_idx'),
+        ),
+    ]
@@ -0,0 +1,64 @@
+# Generated by Django 5.2.6 on 2026-10-18 13:00
+
+import django.db.models.deletion
+from django.conf import settings
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction; the tables stay writable while it builds
+    atomic = False
+
+    dependencies = [
+        ('bms', '0016_search_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='bill',
+            index=models.Index(condition=models.Q(('status', 'pending')), fields=['due_date'], name='bill_pending_due_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='bill',
+            index=models.Index(condition=models.Q(('status__in', ['pending', 'overdue'])), fields=['biller', 'status', 'due_date'], name='bill_biller_open_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='bill',
+            index=models.Index(condition=models.Q(('status__in', ['pending', 'overdue'])), fields=['customer', 'status', 'due_date'], name='bill_customer_open_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='notification',
+            index=models.Index(fields=['bill', 'notification_type', 'status'], name='notification_bill_type_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='payment',
+            index=models.Index(fields=['customer', 'payment_date'], name='payment_customer_date_idx'),
+        ),
+        # the single column foreign key indexes are prefixes of the composites above
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunSQL(
+                    'DROP INDEX CONCURRENTLY IF EXISTS "bms_notification_bill_id_983aa5d4"',
+                    'CREATE INDEX CONCURRENTLY IF NOT EXISTS "bms_notification_bill_id_983aa5d4" ON "bms_notification" ("bill_id")',
+                ),
+                migrations.RunSQL(
+                    'DROP INDEX CONCURRENTLY IF EXISTS "bms_payment_customer_id_86b59e59"',
+                    'CREATE INDEX CONCURRENTLY IF NOT EXISTS "bms_payment_customer_id_86b59e59" ON "bms_payment" ("customer_id")',
+                ),
+            ],
+            state_operations=[
+                migrations.AlterField(
+                    model_name='notification',
+                    name='bill',
+                    field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='notifications', to='bms.bill'),
+                ),
+                migrations.AlterField(
+                    model_name='payment',
+                    name='customer',
+                    field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='payments', to=settings.AUTH_USER_MODEL),
+                ),
+            ],
+        ),
+    ]
@@ -0,0 +1,54 @@
+# Generated by Django 5.2.6 on 2026-10-18 13:05
+
+from django.db import migrations, models
+
+
+# mark the last reminder already sent for each bill and type, so deploying does not send them again
+BACKFILL_SQL = """
+    UPDATE bms_notification AS notification SET reminder_period = bill.due_date
+    FROM bms_bill AS bill
+    WHERE bill.id = notification.bill_id AND notification.id IN (
+        SELECT DISTINCT ON (bill_id, notification_type) id FROM bms_notification
+        WHERE notification_type IN ('overdue', 'upcoming_due') AND status = 'sent'
+        ORDER BY bill_id, notification_type, id DESC
+    )
+"""
+
+
+class Migration(migrations.Migration):
+    # the unique index is built CONCURRENTLY, which cannot run inside a transaction
+    atomic = False
+
+    dependencies = [
+        ('bms', '0017_hot_path_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notification',
+            name='reminder_period',
+            field=models.DateField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='notification',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('sent', 'Sent'), ('failed', 'Failed')], default='sent', max_length=10),
+        ),
+        migrations.RunSQL(BACKFILL_SQL, migrations.RunSQL.noop),
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunSQL(
+                    'CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS "notification_reminder_once" ON "bms_notification" '
+                    '("bill_id", "notification_type", "reminder_period") '
+                    'WHERE ("reminder_period" IS NOT NULL AND NOT ("status" = \'failed\'))',
+                    'DROP INDEX CONCURRENTLY IF EXISTS "notification_reminder_once"',
+                ),
+            ],
+            state_operations=[
+                migrations.AddConstraint(
+                    model_name='notification',
+                    constraint=models.UniqueConstraint(condition=models.Q(('reminder_period__isnull', False), models.Q(('status', 'failed'), _negated=True)), fields=('bill', 'notification_type', 'reminder_period'), name='notification_reminder_once'),
+                ),
+            ],
+        ),
+    ]
@@ -0,0 +1,14 @@
+# Generated by Django 5.2.6 on 2026-10-18 13:10
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    # added notification_pending_idx, which 0021 dropped again once delivery moved to the
+    # outbox (outbox_due_idx); both are kept empty so the chain stays intact and no index is built for nothing
+
+    dependencies = [
+        ('bms', '0018_notification_reminder_once'),
+    ]
+
+    operations = []
@@ -0,0 +1,44 @@
+# Generated by Django 5.2.6 on 2026-10-18 13:12
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+def queue_pending_notifications(apps, schema_editor):
+    """Reminders claimed but not delivered before the outbox existed."""
+    Notification = apps.get_model('bms', 'Notification')
+    OutboxMessage = apps.get_model('bms', 'OutboxMessage')
+    pending = Notification.objects.filter(status='pending').exclude(outbox__isnull=False)
+    OutboxMessage.objects.bulk_create(
+        (OutboxMessage(notification_id=pk, provider=sent_via) for pk, sent_via in pending.values_list('pk', 'sent_via').iterator()),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bms', '0019_notification_pending_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OutboxMessage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('provider', models.CharField(default='email', max_length=50)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('sent', 'Sent'), ('dead', 'Dead Letter')], default='pending', max_length=10)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('next_attempt_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('last_error', models.TextField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('notification', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='outbox', to='bms.notification')),
+            ],
+            options={
+                'indexes': [models.Index(condition=models.Q(('status', 'pending')), fields=['provider', 'next_attempt_at'], name='outbox_due_idx')],
+            },
+        ),
+        migrations.RunPython(queue_pending_notifications, migrations.RunPython.noop),
+    ]
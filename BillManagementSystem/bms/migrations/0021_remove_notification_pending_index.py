@@ -0,0 +1,17 @@
+# Generated by Django 5.2.6 on 2026-10-18 13:13
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    # notification_pending_idx is no longer created (see 0019); delivery reads the outbox (outbox_due_idx).
+    # Databases that built it from an earlier 0019 still drop it here.
+    atomic = False
+
+    dependencies = [
+        ('bms', '0020_outboxmessage'),
+    ]
+
+    operations = [
+        migrations.RunSQL('DROP INDEX CONCURRENTLY IF EXISTS "notification_pending_idx"', migrations.RunSQL.noop),
+    ]
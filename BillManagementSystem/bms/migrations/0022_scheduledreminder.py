@@ -0,0 +1,42 @@
+# Generated by Django 5.2.6 on 2026-10-18 13:14
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+# every pending bill gets its upcoming_due (start of the day before the due date, UTC) and overdue
+# (start of the day after) moments; the dispatcher ignores moments of bills no longer pending
+BACKFILL_SQL = """
+    INSERT INTO bms_scheduledreminder (bill_id, notification_type, run_at, created_at)
+    SELECT id, 'upcoming_due', (due_date - 1)::timestamp AT TIME ZONE 'UTC', now()
+    FROM bms_bill WHERE status = 'pending' AND due_date > current_date
+    UNION ALL
+    SELECT id, 'overdue', (due_date + 1)::timestamp AT TIME ZONE 'UTC', now()
+    FROM bms_bill WHERE status = 'pending'
+    ON CONFLICT DO NOTHING
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bms', '0021_remove_notification_pending_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ScheduledReminder',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('notification_type', models.CharField(choices=[('overdue', 'Overdue Reminder'), ('upcoming_due', 'Upcoming Due Date Reminder'), ('payment_confirmation', 'Payment Confirmation'), ('general', 'General Notification')], max_length=50)),
+                ('run_at', models.DateTimeField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('bill', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='scheduled_reminders', to='bms.bill')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['run_at'], name='scheduled_reminder_run_at_idx')],
+                'constraints': [models.UniqueConstraint(fields=('bill', 'notification_type'), name='scheduled_reminder_once')],
+            },
+        ),
+        migrations.RunSQL(BACKFILL_SQL, migrations.RunSQL.noop),
+    ]
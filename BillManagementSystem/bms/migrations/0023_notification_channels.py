@@ -0,0 +1,25 @@
+# Generated by Django 5.2.6 on 2026-10-18 13:19
+
+import bms.models
+import django.contrib.postgres.fields
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bms', '0022_scheduledreminder'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customuser',
+            name='notification_channels',
+            field=django.contrib.postgres.fields.ArrayField(base_field=models.CharField(choices=[('email', 'Email'), ('sms', 'SMS'), ('whatsapp', 'WhatsApp')], max_length=20), blank=True, default=bms.models.default_notification_channels, size=None),
+        ),
+        migrations.AlterField(
+            model_name='notification',
+            name='sent_via',
+            field=models.CharField(choices=[('email', 'Email'), ('sms', 'SMS'), ('whatsapp', 'WhatsApp')], default='email', max_length=50),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.6 on 2026-10-18 13:24
+
+import django.db.models.deletion
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('bms', '0023_notification_channels'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='biller',
+            name='digest_reminders',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='notification',
+            name='digest',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='covered', to='bms.notification'),
+        ),
+        AddIndexConcurrently(
+            model_name='notification',
+            index=models.Index(condition=models.Q(('digest__isnull', False)), fields=['digest'], name='notification_digest_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='notification',
+            index=models.Index(condition=models.Q(('digest__isnull', True), ('status', 'pending')), fields=['customer', 'notification_type'], name='notification_undigested_idx'),
+        ),
+    ]
@@ -0,0 +1,62 @@
+# Generated by Django 5.2.6 on 2026-10-18 13:41
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+# reminder_period becomes the day a reminder is for rather than the due date: shift the reminders
+# of the last days so today's runs recognise them (upcoming_due went out the day before the due date,
+# overdue the day after)
+SHIFT_REMINDER_PERIODS_SQL = """
+    UPDATE bms_notification
+    SET reminder_period = reminder_period + CASE notification_type WHEN 'upcoming_due' THEN -1 ELSE 1 END
+    WHERE notification_type IN ('upcoming_due', 'overdue') AND reminder_period >= current_date - 2
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bms', '0024_reminder_digests'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReminderPolicy',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('days_offset', models.SmallIntegerField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('biller', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='reminder_policies', to='bms.biller')),
+            ],
+            options={
+                'ordering': ['biller', 'days_offset'],
+                'indexes': [models.Index(fields=['days_offset', 'biller'], name='reminder_policy_offset_idx')],
+                'constraints': [models.UniqueConstraint(fields=('biller', 'days_offset'), name='reminder_policy_once')],
+            },
+        ),
+        # the schedule is keyed by offset: upcoming_due was the day before the due date, overdue the day after
+        migrations.AddField(
+            model_name='scheduledreminder',
+            name='days_offset',
+            field=models.SmallIntegerField(default=1),
+            preserve_default=False,
+        ),
+        migrations.RunSQL(
+            "UPDATE bms_scheduledreminder SET days_offset = -1 WHERE notification_type = 'upcoming_due'",
+            migrations.RunSQL.noop,
+        ),
+        migrations.RemoveConstraint(
+            model_name='scheduledreminder',
+            name='scheduled_reminder_once',
+        ),
+        migrations.RemoveField(
+            model_name='scheduledreminder',
+            name='notification_type',
+        ),
+        migrations.AddConstraint(
+            model_name='scheduledreminder',
+            constraint=models.UniqueConstraint(fields=('bill', 'days_offset'), name='scheduled_reminder_once'),
+        ),
+        migrations.RunSQL(SHIFT_REMINDER_PERIODS_SQL, migrations.RunSQL.noop),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.6 on 2026-10-18 13:41
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('bms', '0025_reminder_policies'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='bill',
+            index=models.Index(condition=models.Q(('status', 'overdue')), fields=['due_date'], name='bill_overdue_due_idx'),
+        ),
+    ]
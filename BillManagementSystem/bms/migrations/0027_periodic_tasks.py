@@ -0,0 +1,48 @@
+# Generated by Django 5.2.6 on 2026-10-18 13:41
+
+from django.db import migrations
+
+
+# the schedule formerly hard-coded in celery.py; edit it in the admin from now on
+INTERVALS = [
+    # pops the reminders whose moment has come (bms.reminders)
+    ('dispatch-due-reminders', 'bms.tasks.dispatch_due_reminders', 10),
+    # picks up outbox retries whose backoff has elapsed
+    ('drain-outbox', 'bms.tasks.drain_outbox', 30),
+]
+CRONTABS = [
+    # reconciliation for bills written around the signals; reminders normally come from the schedule
+    ('send-due-notifications-every-day', 'bms.tasks.send_due_notifications', {'hour': '6', 'minute': '0'}),
+]
+
+
+def create_periodic_tasks(apps, schema_editor):
+    PeriodicTask = apps.get_model('django_celery_beat', 'PeriodicTask')
+    IntervalSchedule = apps.get_model('django_celery_beat', 'IntervalSchedule')
+    CrontabSchedule = apps.get_model('django_celery_beat', 'CrontabSchedule')
+
+    for name, task, seconds in INTERVALS:
+        interval, _ = IntervalSchedule.objects.get_or_create(every=seconds, period='seconds')
+        PeriodicTask.objects.get_or_create(name=name, defaults={'task': task, 'interval': interval})
+    for name, task, fields in CRONTABS:
+        crontab, _ = CrontabSchedule.objects.get_or_create(
+            day_of_week='*', day_of_month='*', month_of_year='*', timezone='Africa/Addis_Ababa', **fields,
+        )
+        PeriodicTask.objects.get_or_create(name=name, defaults={'task': task, 'crontab': crontab})
+
+
+def delete_periodic_tasks(apps, schema_editor):
+    PeriodicTask = apps.get_model('django_celery_beat', 'PeriodicTask')
+    PeriodicTask.objects.filter(name__in=[name for name, *_ in INTERVALS + CRONTABS]).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bms', '0026_bill_overdue_due_idx'),
+        ('django_celery_beat', '0019_alter_periodictasks_options'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_periodic_tasks, delete_periodic_tasks),
+    ]
@@ -0,0 +1,93 @@
+# Generated by Django 5.2.6 on 2026-10-18 13:38
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+# a starting ladder; billers' operators tune it in the admin
+STAGES = [
+    ('Reminder', 'reminder', 7, 0),
+    ('Final notice', 'final_notice', 14, 0),
+    ('Disconnection', 'disconnection', 30, 100),
+    ('Collections', 'collections', 60, 1000),
+]
+TASK = 'run-dunning-every-day'
+
+
+def create_stages(apps, schema_editor):
+    DunningStage = apps.get_model('bms', 'DunningStage')
+    DunningStage.objects.bulk_create([
+        DunningStage(name=name, action=action, days_past_due=days, min_outstanding=amount)
+        for name, action, days, amount in STAGES
+    ])
+
+    PeriodicTask = apps.get_model('django_celery_beat', 'PeriodicTask')
+    CrontabSchedule = apps.get_model('django_celery_beat', 'CrontabSchedule')
+    # after the overdue sweep
+    crontab, _ = CrontabSchedule.objects.get_or_create(
+        minute='30', hour='6', day_of_week='*', day_of_month='*', month_of_year='*', timezone='Africa/Addis_Ababa',
+    )
+    PeriodicTask.objects.get_or_create(name=TASK, defaults={'task': 'bms.tasks.run_dunning', 'crontab': crontab})
+
+
+def delete_stages(apps, schema_editor):
+    apps.get_model('django_celery_beat', 'PeriodicTask').objects.filter(name=TASK).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bms', '0027_periodic_tasks'),
+        ('django_celery_beat', '0019_alter_periodictasks_options'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DunningStage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100)),
+                ('action', models.CharField(choices=[('reminder', 'Reminder'), ('final_notice', 'Final Notice'), ('disconnection', 'Flag for Disconnection'), ('collections', 'Flag for Collections')], max_length=20)),
+                ('days_past_due', models.PositiveSmallIntegerField()),
+                ('min_outstanding', models.DecimalField(decimal_places=2, default=0, max_digits=10)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'ordering': ['days_past_due', 'min_outstanding'],
+                'indexes': [models.Index(fields=['days_past_due', 'min_outstanding'], name='dunning_stage_reached_idx')],
+            },
+        ),
+        migrations.AddField(
+            model_name='bill',
+            name='dunning_stage_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AlterField(
+            model_name='notification',
+            name='notification_type',
+            field=models.CharField(choices=[('overdue', 'Overdue Reminder'), ('upcoming_due', 'Upcoming Due Date Reminder'), ('payment_confirmation', 'Payment Confirmation'), ('dunning', 'Dunning Notice'), ('general', 'General Notification')], max_length=50),
+        ),
+        migrations.CreateModel(
+            name='DunningEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('days_past_due', models.IntegerField()),
+                ('outstanding', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('bill', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='dunning_events', to='bms.bill')),
+                ('previous_stage', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='bms.dunningstage')),
+                ('stage', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='events', to='bms.dunningstage')),
+            ],
+            options={
+                'ordering': ['-created_at'],
+            },
+        ),
+        migrations.AddField(
+            model_name='bill',
+            name='dunning_stage',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, db_index=False, related_name='bills', to='bms.dunningstage'),
+        ),
+        migrations.RunPython(create_stages, delete_stages),
+    ]
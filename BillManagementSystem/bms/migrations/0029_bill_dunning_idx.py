@@ -0,0 +1,20 @@
+# Generated by Django 5.2.6 on 2026-10-18 13:38
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction; the tables stay writable while it builds
+    atomic = False
+
+    dependencies = [
+        ('bms', '0028_dunning'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='bill',
+            index=models.Index(condition=models.Q(('status__in', ['overdue', 'partially_paid']), ('dunning_stage__isnull', False), _connector='OR'), fields=['dunning_stage'], name='bill_dunning_idx'),
+        ),
+    ]
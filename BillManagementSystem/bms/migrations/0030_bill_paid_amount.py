@@ -0,0 +1,38 @@
+# Generated by Django 5.2.6 on 2026-10-18 13:43
+
+import django.db.models.expressions
+from django.db import migrations, models
+
+
+# the allocations made so far; from here on signals.py keeps paid_amount in step
+BACKFILL_SQL = """
+    UPDATE bms_bill SET paid_amount = allocated.total
+    FROM (SELECT bill_id, SUM(amount_applied) AS total FROM bms_paymentbill GROUP BY bill_id) AS allocated
+    WHERE bms_bill.id = allocated.bill_id
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bms', '0029_bill_dunning_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bill',
+            name='paid_amount',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=10),
+        ),
+        migrations.RunSQL(BACKFILL_SQL, migrations.RunSQL.noop),
+        migrations.AlterField(
+            model_name='bill',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('partially_paid', 'Partially Paid'), ('paid', 'Paid'), ('overdue', 'Overdue')], default='pending', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='bill',
+            name='balance',
+            field=models.GeneratedField(db_persist=True, expression=django.db.models.expressions.CombinedExpression(models.F('amount'), '-', models.F('paid_amount')), output_field=models.DecimalField(decimal_places=2, max_digits=10)),
+        ),
+    ]
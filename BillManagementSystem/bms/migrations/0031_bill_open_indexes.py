@@ -0,0 +1,33 @@
+# Generated by Django 5.2.6 on 2026-10-18 13:43
+
+from django.contrib.postgres.operations import AddIndexConcurrently, RemoveIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction; the tables stay writable while they build
+    atomic = False
+
+    dependencies = [
+        ('bms', '0030_bill_paid_amount'),
+    ]
+
+    operations = [
+        # partially paid bills are open too
+        RemoveIndexConcurrently(
+            model_name='bill',
+            name='bill_biller_open_idx',
+        ),
+        AddIndexConcurrently(
+            model_name='bill',
+            index=models.Index(condition=models.Q(('status__in', ['pending', 'partially_paid', 'overdue'])), fields=['biller', 'status', 'due_date'], name='bill_biller_open_idx'),
+        ),
+        RemoveIndexConcurrently(
+            model_name='bill',
+            name='bill_customer_open_idx',
+        ),
+        AddIndexConcurrently(
+            model_name='bill',
+            index=models.Index(condition=models.Q(('status__in', ['pending', 'partially_paid', 'overdue'])), fields=['customer', 'status', 'due_date'], name='bill_customer_open_idx'),
+        ),
+    ]
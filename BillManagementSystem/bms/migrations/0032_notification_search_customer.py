@@ -0,0 +1,30 @@
+# Generated by Django 5.2.6 on 2026-10-18 15:02
+
+from django.db import migrations
+
+
+# rows per UPDATE; each batch commits on its own, so the table is never locked for the whole backfill
+BATCH_SIZE = 10000
+
+
+def rebuild_notification_vectors(apps, schema_editor):
+    from bms import search
+
+    manager = apps.get_model('bms', 'Notification')._default_manager
+    last_id = manager.order_by('-pk').values_list('pk', flat=True).first() or 0
+    for first in range(0, last_id + 1, BATCH_SIZE):
+        search.update_search_vectors(manager.filter(pk__range=(first, first + BATCH_SIZE - 1)), apps=apps)
+
+
+class Migration(migrations.Migration):
+    # the batches commit one by one rather than in one long transaction
+    atomic = False
+
+    dependencies = [
+        ('bms', '0031_bill_open_indexes'),
+    ]
+
+    operations = [
+        # notification vectors now embed the customer's email and names
+        migrations.RunPython(rebuild_notification_vectors, migrations.RunPython.noop),
+    ]
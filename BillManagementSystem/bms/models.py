@@ -1,4 +1,4 @@
-from django.db import models
+from django.db import connections, models, transaction
 
 # Create your models here.
 
@@ -17,10 +17,19 @@ from django.utils import timezone
 import os
 from django.core.exceptions import ValidationError
 
+from auditlog.models import LogEntry
 from auditlog.registry import auditlog
+from django.contrib.postgres.fields import ArrayField
+from django.contrib.postgres.indexes import GinIndex, OpClass
+from django.contrib.postgres.search import SearchVectorField
+from django.db.models.functions import Upper
+from django.db.models.lookups import GreaterThan
+from collections import defaultdict
 from datetime import timedelta
 import uuid
 
+from .audit import bulk_log
+
 
 
 def validate_uploaded_image_extension(value):
@@ -36,6 +45,24 @@ def get_upload_path(instance,filename):
     return new_file_name
 
 
+class PhoneDigits(models.Func):
+    """A phone number with everything but the digits stripped, as indexed for lookups."""
+    function = 'REGEXP_REPLACE'
+    template = "%(function)s(%(expressions)s, '[^0-9]', '', 'g')"
+    output_field = models.TextField()
+
+
+NOTIFICATION_CHANNELS = [
+    ('email', 'Email'),
+    ('sms', 'SMS'),
+    ('whatsapp', 'WhatsApp'),
+]
+
+
+def default_notification_channels():
+    return ['email']
+
+
 # Custom manager for user model
 class CustomUserManager(BaseUserManager):
     def create_user(self, email, password=None, **extra_fields):
@@ -68,6 +95,12 @@ class CustomUser(AbstractBaseUser,PermissionsMixin):
     is_superuser = models.BooleanField(default=False)
     is_biller = models.BooleanField(default=False)
     is_customer = models.BooleanField(default=False)
+    updated_at = models.DateTimeField(auto_now=True)
+    search_vector = SearchVectorField(null=True, editable=False)
+    # reminder channels in order of preference; the next one takes over when one gives up (bms.channels)
+    notification_channels = ArrayField(
+        models.CharField(max_length=20, choices=NOTIFICATION_CHANNELS), default=default_notification_channels, blank=True,
+    )
 
     # Make groups and user_permissions optional by adding blank=True and null=True
     groups = models.ManyToManyField(
@@ -102,6 +135,17 @@ class CustomUser(AbstractBaseUser,PermissionsMixin):
         #db_table = "user"
         verbose_name = 'User'
         verbose_name_plural = 'Users'
+        indexes = [
+            GinIndex(fields=['search_vector'], name='user_search_vector_idx'),
+            GinIndex(OpClass(Upper('email'), name='gin_trgm_ops'), name='user_email_trgm_idx'),
+            GinIndex(OpClass(Upper('first_name'), name='gin_trgm_ops'), name='user_first_name_trgm_idx'),
+            GinIndex(OpClass(Upper('last_name'), name='gin_trgm_ops'), name='user_last_name_trgm_idx'),
+            # prefix lookups (istartswith) for the customer typeahead
+            models.Index(OpClass(Upper('email'), name='text_pattern_ops'), name='user_email_prefix_idx'),
+            models.Index(OpClass(Upper('first_name'), name='text_pattern_ops'), name='user_first_name_prefix_idx'),
+            models.Index(OpClass(Upper('last_name'), name='text_pattern_ops'), name='user_last_name_prefix_idx'),
+            models.Index(OpClass(PhoneDigits('phone_number'), name='text_pattern_ops'), name='user_phone_digits_idx'),
+        ]
 
     def delete(self, *args, **kwargs):
         if self.profile_picture:
@@ -118,7 +162,7 @@ class CustomUser(AbstractBaseUser,PermissionsMixin):
 User = settings.AUTH_USER_MODEL
 
 
-auditlog.register(CustomUser)
+auditlog.register(CustomUser, exclude_fields=['search_vector'])
 
 class EmailVerification(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
@@ -150,6 +194,8 @@ class Biller(models.Model):
     address = models.TextField(blank=True, null=True)
     phone_number = models.CharField(max_length=20, blank=True, null=True)
     email = models.EmailField(blank=True, null=True)
+    # fold a customer's reminders for this biller's bills into one message per run (bms.digests)
+    digest_reminders = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -177,9 +223,62 @@ auditlog.register(CustomerBiller)
 
 from django.utils import timezone
 
+
+def payment_status(paid):
+    """A bill's status once `paid` (an expression over the bill's columns) has been paid towards it."""
+    return models.Case(
+        models.When(amount__lte=paid, then=models.Value('paid')),
+        models.When(GreaterThan(paid, 0), then=models.Value('partially_paid')),
+        models.When(due_date__lt=timezone.now().date(), then=models.Value('overdue')),
+        default=models.Value('pending'),
+    )
+
+
+class BillManager(models.Manager):
+    def apply_payment(self, bill_id, delta):
+        """
+        Add `delta` (negative to take an allocation back) to the bill's
+        paid_amount and derive its status from the new total, in one UPDATE.
+        No allocation is read, and concurrent payments to a bill add up.
+        """
+        return self.set_paid([bill_id], models.F('paid_amount') + delta)
+
+    def apply_allocations(self, payment, bill_ids):
+        """
+        Add `payment`'s allocations to `bill_ids`, written with bulk_create()
+        and so unseen by signals.py, to the bills in one aggregate UPDATE.
+        """
+        allocated = models.Subquery(
+            PaymentBill.objects.filter(payment=payment, bill=models.OuterRef('pk')).order_by().values('bill')
+            .annotate(total=models.Sum('amount_applied')).values('total')
+        )
+        return self.set_paid(bill_ids, models.F('paid_amount') + allocated)
+
+    def set_paid(self, bill_ids, paid):
+        """
+        Set the paid_amount of `bill_ids` to `paid` (an expression over the
+        bill's columns) and derive their status from it, logging each status
+        change as auditlog would. Returns {bill id: status}.
+        """
+        # locked in id order, so the statuses read are the ones the UPDATE replaces
+        previous = dict(self.select_for_update().filter(pk__in=bill_ids).order_by('pk').values_list('pk', 'status'))
+        self.filter(pk__in=bill_ids).update(paid_amount=paid, status=payment_status(paid), updated_at=timezone.now())
+
+        statuses = {}
+        changed = defaultdict(list)
+        for bill in self.filter(pk__in=bill_ids).select_related('customer').only('status', 'customer__email'):
+            statuses[bill.pk] = bill.status
+            if bill.status != previous[bill.pk]:
+                changed[previous[bill.pk], bill.status].append(bill)
+        for (was, status), bills in changed.items():
+            bulk_log(bills, LogEntry.Action.UPDATE, changes={'status': [was, status]})
+        return statuses
+
+
 class Bill(models.Model):
     STATUS_CHOICES = [
         ('pending', 'Pending'),
+        ('partially_paid', 'Partially Paid'),
         ('paid', 'Paid'),
         ('overdue', 'Overdue'),
     ]
@@ -187,21 +286,66 @@ class Bill(models.Model):
     biller = models.ForeignKey(Biller, on_delete=models.CASCADE, related_name='bills')
     customer = models.ForeignKey(User, on_delete=models.CASCADE, related_name='bills')
     amount = models.DecimalField(max_digits=10, decimal_places=2)
+    # what the bill's PaymentBill allocations add up to, kept by Bill.objects.apply_payment()
+    # (see signals.py); the repair_paid_amounts command recomputes it
+    paid_amount = models.DecimalField(max_digits=10, decimal_places=2, default=0, editable=False)
+    balance = models.GeneratedField(
+        expression=models.F('amount') - models.F('paid_amount'),
+        output_field=models.DecimalField(max_digits=10, decimal_places=2),
+        db_persist=True,
+    )
     due_date = models.DateField()
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
     description = models.TextField(blank=True, null=True)
+    # the furthest dunning stage the bill has reached, kept by bms.dunning
+    # indexed by bill_dunning_idx
+    dunning_stage = models.ForeignKey('DunningStage', on_delete=models.SET_NULL, null=True, blank=True,
+                                      related_name='bills', editable=False, db_index=False)
+    dunning_stage_at = models.DateTimeField(null=True, blank=True, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    objects = BillManager()
+
+    class Meta:
+        indexes = [
+            GinIndex(fields=['search_vector'], name='bill_search_vector_idx'),
+            GinIndex(OpClass(Upper('bill_number'), name='gin_trgm_ops'), name='bill_number_trgm_idx'),
+            # unpaid bills only: due date sweeps (tasks.py) and the per biller/customer summaries (reports.py)
+            models.Index(fields=['due_date'], condition=models.Q(status='pending'), name='bill_pending_due_idx'),
+            models.Index(fields=['biller', 'status', 'due_date'],
+                         condition=models.Q(status__in=['pending', 'partially_paid', 'overdue']),
+                         name='bill_biller_open_idx'),
+            models.Index(fields=['customer', 'status', 'due_date'],
+                         condition=models.Q(status__in=['pending', 'partially_paid', 'overdue']),
+                         name='bill_customer_open_idx'),
+            # overdue bills due on a day, across billers: the overdue reminder offsets (tasks.py)
+            models.Index(fields=['due_date'], condition=models.Q(status='overdue'), name='bill_overdue_due_idx'),
+            # bills the dunning run looks at: unpaid past their due date, or still at a stage
+            models.Index(fields=['dunning_stage'],
+                         condition=models.Q(status__in=['overdue', 'partially_paid']) | models.Q(dunning_stage__isnull=False),
+                         name='bill_dunning_idx'),
+        ]
 
     def __str__(self):
         return f"Bill #{self.id} - {self.customer.email} - {self.status}"
 
-    def check_overdue(self):
-        if self.status == 'pending' and self.due_date < timezone.now().date():
-            self.status = 'overdue'
-            self.save()
-            
-auditlog.register(Bill)
+    def save(self, *args, **kwargs):
+        # paid_amount and status only move through BillManager; a copy loaded before a payment must not undo them
+        updating = not self._state.adding and not kwargs.get('force_insert')
+        if updating and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and not field.generated and field.name not in ('paid_amount', 'status')
+            ]
+        super().save(*args, **kwargs)
+        if updating and {'amount', 'due_date'} & set(kwargs['update_fields']):
+            # derived from the paid_amount in the row, not this copy's
+            self.status = Bill.objects.set_paid([self.pk], models.F('paid_amount'))[self.pk]
+
+
+auditlog.register(Bill, exclude_fields=['search_vector'])
 
 
 
@@ -218,7 +362,8 @@ class Payment(models.Model):
         ('card', 'Card'),
     ]
 
-    customer = models.ForeignKey(User, on_delete=models.CASCADE, related_name='payments')
+    # indexed by payment_customer_date_idx
+    customer = models.ForeignKey(User, on_delete=models.CASCADE, related_name='payments', db_index=False)
     amount = models.DecimalField(max_digits=10, decimal_places=2)
     payment_method = models.CharField(max_length=30, choices=PAYMENT_METHODS)
     payment_date = models.DateTimeField(default=timezone.now)
@@ -227,11 +372,16 @@ class Payment(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['customer', 'payment_date'], name='payment_customer_date_idx'),
+        ]
+
     def __str__(self):
         return f"Payment {self.id} - {self.amount} ETB"
 
     def total_allocated(self):
-        return sum(a.amount_applied for a in self.payment_bills.all())
+        return self.payment_bills.aggregate(total=models.Sum('amount_applied'))['total'] or 0
 
 
 auditlog.register(Payment)
@@ -246,16 +396,11 @@ class PaymentBill(models.Model):
         return f"{self.amount_applied} ETB → {self.bill.bill_number}"
 
     def save(self, *args, **kwargs):
-        super().save(*args, **kwargs)
-
-        total_paid = sum(a.amount_applied for a in self.bill.payment_bills.all())
-        if total_paid >= self.bill.amount:
-            self.bill.status = 'paid'
-        elif total_paid > 0:
-            self.bill.status = 'partially_paid'
-        else:
-            self.bill.status = 'pending'
-        self.bill.save()
+        # the allocation and the bill's paid_amount change together (signals.py)
+        with transaction.atomic(using=kwargs.get('using')):
+            super().save(*args, **kwargs)
+        if PaymentBill.bill.is_cached(self):
+            self.bill.refresh_from_db(fields=['paid_amount', 'balance', 'status', 'updated_at'])
 
 
 
@@ -264,39 +409,189 @@ auditlog.register(PaymentBill)
 
 
 
+class NotificationManager(models.Manager):
+    def claim(self, notifications):
+        """
+        Insert `notifications`, skipping any whose reminder another run already
+        claimed (see notification_reminder_once), and return the ones inserted.
+
+        A single INSERT ... ON CONFLICT DO NOTHING RETURNING, so concurrent runs
+        never both send the same reminder.
+        """
+        if not notifications:
+            return []
+        connection = connections[self.db]
+        opts = self.model._meta
+        fields = [field for field in opts.local_concrete_fields if not field.primary_key]
+        key_fields = [opts.get_field(name) for name in ('bill', 'notification_type', 'reminder_period')]
+
+        rows, params = [], []
+        for notification in notifications:
+            rows.append('(' + ', '.join(['%s'] * len(fields)) + ')')
+            params.extend(field.get_db_prep_save(field.pre_save(notification, True), connection) for field in fields)
+        sql = 'INSERT INTO {} ({}) VALUES {} ON CONFLICT DO NOTHING RETURNING {}'.format(
+            connection.ops.quote_name(opts.db_table),
+            ', '.join(connection.ops.quote_name(field.column) for field in fields),
+            ', '.join(rows),
+            ', '.join(connection.ops.quote_name(field.column) for field in [opts.pk] + key_fields),
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            claimed = {tuple(row[1:]): row[0] for row in cursor.fetchall()}
+
+        result = []
+        for notification in notifications:
+            pk = claimed.get((notification.bill_id, notification.notification_type, notification.reminder_period))
+            if pk is not None:
+                notification.pk = pk
+                notification._state.adding = False
+                notification._state.db = self.db
+                result.append(notification)
+        return result
+
+
 class Notification(models.Model):
     NOTIFICATION_TYPES = [
         ('overdue', 'Overdue Reminder'),
         ('upcoming_due', 'Upcoming Due Date Reminder'),
         ('payment_confirmation', 'Payment Confirmation'),
+        ('dunning', 'Dunning Notice'),
         ('general', 'General Notification'),
     ]
 
     STATUS_CHOICES = [
+        ('pending', 'Pending'),
         ('sent', 'Sent'),
         ('failed', 'Failed'),
     ]
 
-    bill = models.ForeignKey(Bill, on_delete=models.CASCADE, related_name='notifications')
+    # indexed by notification_bill_type_idx
+    bill = models.ForeignKey(Bill, on_delete=models.CASCADE, related_name='notifications', db_index=False)
     customer = models.ForeignKey(User, on_delete=models.CASCADE, related_name='notifications')
     notification_type = models.CharField(max_length=50, choices=NOTIFICATION_TYPES)
     subject = models.CharField(max_length=255)
     message = models.TextField()
-    sent_via = models.CharField(max_length=50, default='email')  # e.g. email, sms, whatsapp
+    sent_via = models.CharField(max_length=50, choices=NOTIFICATION_CHANNELS, default='email')
     status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='sent')
     sent_at = models.DateTimeField(default=timezone.now)
     error_message = models.TextField(blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    search_vector = SearchVectorField(null=True, editable=False)
+    # the day a reminder is for (due date plus the policy's offset); reminders are sent once per bill, type and period
+    reminder_period = models.DateField(blank=True, null=True)
+    # the reminder whose message also covers this one's bill, itself for the one sent (bms.digests)
+    # indexed by notification_digest_idx
+    digest = models.ForeignKey('self', on_delete=models.SET_NULL, null=True, blank=True, related_name='covered',
+                               db_index=False)
+
+    objects = NotificationManager()
 
     class Meta:
         ordering = ['-sent_at']
+        constraints = [
+            # failed attempts give the reminder up again
+            models.UniqueConstraint(
+                fields=['bill', 'notification_type', 'reminder_period'],
+                condition=models.Q(reminder_period__isnull=False) & ~models.Q(status='failed'),
+                name='notification_reminder_once',
+            ),
+        ]
+        indexes = [
+            GinIndex(fields=['search_vector'], name='notification_search_idx'),
+            GinIndex(OpClass(Upper('subject'), name='gin_trgm_ops'), name='notification_subject_trgm_idx'),
+            # a bill's notifications by type and status
+            models.Index(fields=['bill', 'notification_type', 'status'], name='notification_bill_type_idx'),
+            models.Index(fields=['digest'], condition=models.Q(digest__isnull=False), name='notification_digest_idx'),
+            # reminders waiting to be folded into a digest
+            models.Index(
+                fields=['customer', 'notification_type'],
+                condition=models.Q(status='pending', digest__isnull=True),
+                name='notification_undigested_idx',
+            ),
+        ]
 
     def __str__(self):
-        return f"{self.notification_type} to {self.customer.user.email} ({self.status})"
+        return f"{self.notification_type} to {self.customer.email} ({self.status})"
     
     
-auditlog.register(Notification)
+auditlog.register(Notification, exclude_fields=['search_vector'])
+
+
+
+class OutboxMessage(models.Model):
+    """A notification waiting to be delivered by the sender workers (see bms.outbox)."""
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('sent', 'Sent'),
+        ('dead', 'Dead Letter'),
+    ]
+
+    notification = models.OneToOneField(Notification, on_delete=models.CASCADE, related_name='outbox')
+    provider = models.CharField(max_length=50, default='email')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['provider', 'next_attempt_at'], condition=models.Q(status='pending'),
+                         name='outbox_due_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.provider} outbox for notification {self.notification_id} ({self.status})"
+
+
+
+class ReminderPolicy(models.Model):
+    """
+    A day, relative to the due date, on which a biller's customers are
+    reminded of a bill: -7 is a week before, 0 the due date, 5 five days
+    after. Billers without any use REMINDER_DEFAULT_OFFSETS.
+    """
+    # indexed by reminder_policy_once
+    biller = models.ForeignKey(Biller, on_delete=models.CASCADE, related_name='reminder_policies', db_index=False)
+    days_offset = models.SmallIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['biller', 'days_offset']
+        constraints = [
+            models.UniqueConstraint(fields=['biller', 'days_offset'], name='reminder_policy_once'),
+        ]
+        indexes = [
+            # the billers reminding at an offset
+            models.Index(fields=['days_offset', 'biller'], name='reminder_policy_offset_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.biller}: {self.days_offset:+d} days"
+
+auditlog.register(ReminderPolicy)
+
+
+class ScheduledReminder(models.Model):
+    """A reminder moment of an open bill, popped by dispatch_due_reminders once due (see bms.reminders)."""
+    # indexed by scheduled_reminder_once
+    bill = models.ForeignKey(Bill, on_delete=models.CASCADE, related_name='scheduled_reminders', db_index=False)
+    days_offset = models.SmallIntegerField()
+    run_at = models.DateTimeField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['bill', 'days_offset'], name='scheduled_reminder_once'),
+        ]
+        indexes = [
+            models.Index(fields=['run_at'], name='scheduled_reminder_run_at_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.days_offset:+d} days for bill {self.bill_id} at {self.run_at}"
 
 
 
@@ -304,3 +599,52 @@ auditlog.register(Notification)
 
    
 
+
+
+class DunningStage(models.Model):
+    """
+    A step of the dunning ladder (see bms.dunning): reached `days_past_due`
+    days after the due date by bills with at least `min_outstanding` ETB
+    still unpaid.
+    """
+    ACTION_CHOICES = [
+        ('reminder', 'Reminder'),
+        ('final_notice', 'Final Notice'),
+        ('disconnection', 'Flag for Disconnection'),
+        ('collections', 'Flag for Collections'),
+    ]
+
+    name = models.CharField(max_length=100)
+    action = models.CharField(max_length=20, choices=ACTION_CHOICES)
+    days_past_due = models.PositiveSmallIntegerField()
+    min_outstanding = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['days_past_due', 'min_outstanding']
+        indexes = [
+            # the stages a bill has reached
+            models.Index(fields=['days_past_due', 'min_outstanding'], name='dunning_stage_reached_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.name} ({self.days_past_due} days, {self.min_outstanding} ETB)"
+
+auditlog.register(DunningStage)
+
+
+class DunningEvent(models.Model):
+    """A bill moving between dunning stages; `stage` is null when it leaves dunning."""
+    bill = models.ForeignKey(Bill, on_delete=models.CASCADE, related_name='dunning_events')
+    previous_stage = models.ForeignKey(DunningStage, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    stage = models.ForeignKey(DunningStage, on_delete=models.SET_NULL, null=True, blank=True, related_name='events')
+    days_past_due = models.IntegerField()
+    outstanding = models.DecimalField(max_digits=10, decimal_places=2)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"Bill {self.bill_id}: {self.previous_stage_id} -> {self.stage_id}"
@@ -0,0 +1,214 @@
+"""
+Transactional outbox for notification delivery.
+
+Reminders are queued as OutboxMessage rows in the transaction that creates
+their Notification, so the scan never waits on a provider. Sender workers
+(the drain_outbox task, routed to the "outbox" queue) take due messages in
+batches and hand them to the provider's sender:
+
+* a token bucket per provider in Redis caps the rate across all workers
+  (OUTBOX_PROVIDERS: tokens per second and burst),
+* failed messages are retried with exponential backoff and jitter and
+  dead-lettered after OUTBOX_MAX_ATTEMPTS; the notification is marked
+  failed only then,
+* a circuit breaker per provider stops sending for OUTBOX_BREAKER_COOLDOWN
+  seconds once OUTBOX_BREAKER_THRESHOLD batches in a row failed completely;
+  after the cooldown a single message is sent as a probe,
+* a message out of attempts moves to the customer's next preferred channel
+  (bms.channels) with its attempts reset, and is dead-lettered only when no
+  channel is left.
+
+Providers are notification channels; each is drained by its own tasks, so
+channels send side by side.
+
+A batch is claimed in a short transaction that pushes its next_attempt_at
+OUTBOX_LEASE_SECONDS ahead, so other workers pass over it; the provider is
+called with no transaction or row lock held, and the outcomes are written
+back in a second short transaction. A worker dying mid-batch leaves its
+messages to be sent again once the lease runs out.
+"""
+import random
+import time
+from datetime import timedelta
+from functools import partial
+
+import redis
+from auditlog.models import LogEntry
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from . import channels, delivery
+from .audit import bulk_log
+from .models import Notification, OutboxMessage
+
+
+# provider -> function sending a list of notifications and setting status/error_message on each
+SENDERS = {
+    'email': delivery.deliver,
+    'sms': partial(channels.deliver, 'sms'),
+    'whatsapp': partial(channels.deliver, 'whatsapp'),
+}
+
+# refill by elapsed time, then grant as many of the requested tokens as the bucket holds
+TOKEN_BUCKET_LUA = """
+local rate, burst, requested = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+local time = redis.call('time')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+local state = redis.call('hmget', KEYS[1], 'tokens', 'stamp')
+local tokens = tonumber(state[1]) or burst
+local stamp = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - stamp) * rate)
+local granted = math.min(requested, math.floor(tokens))
+redis.call('hset', KEYS[1], 'tokens', tostring(tokens - granted), 'stamp', tostring(now))
+redis.call('expire', KEYS[1], math.ceil(burst / rate) + 1)
+return granted
+"""
+
+_client = None
+
+
+def get_redis():
+    global _client
+    if _client is None:
+        _client = redis.Redis.from_url(settings.OUTBOX_REDIS_URL)
+    return _client
+
+
+class TokenBucket:
+    def __init__(self, provider):
+        config = settings.OUTBOX_PROVIDERS[provider]
+        self.key = f'outbox:bucket:{provider}'
+        self.rate = config['rate']
+        self.burst = config['burst']
+
+    def take(self, count):
+        """Take up to `count` tokens; returns how many were granted."""
+        return int(get_redis().eval(TOKEN_BUCKET_LUA, 1, self.key, self.rate, self.burst, count))
+
+
+class CircuitBreaker:
+    def __init__(self, provider):
+        self.failures_key = f'outbox:breaker:{provider}:failures'
+        self.open_key = f'outbox:breaker:{provider}:open'
+
+    def is_open(self):
+        return bool(get_redis().exists(self.open_key))
+
+    def is_probing(self):
+        """Closed again after a cooldown but not yet proven healthy."""
+        return int(get_redis().get(self.failures_key) or 0) >= settings.OUTBOX_BREAKER_THRESHOLD
+
+    def record(self, ok):
+        client = get_redis()
+        if ok:
+            client.delete(self.failures_key)
+            return
+        failures = client.incr(self.failures_key)
+        client.expire(self.failures_key, settings.OUTBOX_BREAKER_COOLDOWN * 10)
+        if failures >= settings.OUTBOX_BREAKER_THRESHOLD:
+            client.set(self.open_key, 1, ex=settings.OUTBOX_BREAKER_COOLDOWN)
+
+
+def enqueue(notifications):
+    """Queue `notifications` for delivery; call it in the transaction that created them."""
+    return OutboxMessage.objects.bulk_create([
+        OutboxMessage(notification=notification, provider=notification.sent_via) for notification in notifications
+    ])
+
+
+def backoff(attempts):
+    delay = min(settings.OUTBOX_BACKOFF_MAX, settings.OUTBOX_BACKOFF_BASE * 2 ** (attempts - 1))
+    return timedelta(seconds=delay * random.uniform(0.5, 1))
+
+
+def drain(provider, seconds):
+    """Send `provider`'s due messages until none are left or `seconds` have passed."""
+    deadline = time.monotonic() + seconds
+    bucket, breaker, send = TokenBucket(provider), CircuitBreaker(provider), SENDERS[provider]
+    stats = {'sent': 0, 'retried': 0, 'moved': 0, 'dead': 0, 'breaker_open': False}
+
+    while time.monotonic() < deadline:
+        if breaker.is_open():
+            stats['breaker_open'] = True
+            break
+        messages = _claim(provider, bucket, 1 if breaker.is_probing() else settings.OUTBOX_BATCH_SIZE)
+        if messages is None:
+            break
+        if messages:
+            _send(messages, send, stats)
+            breaker.record(any(message.status == 'sent' for message in messages))
+        else:
+            time.sleep(min(1 / bucket.rate, max(0, deadline - time.monotonic())))
+    return stats
+
+
+def _claim(provider, bucket, size):
+    """
+    Lease up to `size` of `provider`'s due messages, as many as the bucket
+    grants; None when none are due.
+    """
+    due = (
+        OutboxMessage.objects.filter(provider=provider, status='pending', next_attempt_at__lte=timezone.now())
+        .select_related('notification__customer')
+        .select_for_update(skip_locked=True, of=('self',))
+        .order_by('next_attempt_at')
+    )
+    with transaction.atomic():
+        messages = list(due[:size])
+        if not messages:
+            return None
+        messages = messages[:bucket.take(len(messages))]
+        if messages:
+            OutboxMessage.objects.filter(pk__in=[message.pk for message in messages]).update(
+                next_attempt_at=timezone.now() + timedelta(seconds=settings.OUTBOX_LEASE_SECONDS),
+            )
+    return messages
+
+
+def _send(messages, send, stats):
+    notifications = [message.notification for message in messages]
+    send(notifications)
+
+    now = timezone.now()
+    finished, moved = [], []
+    for message, notification in zip(messages, notifications):
+        message.attempts += 1
+        message.updated_at = now
+        fallback = None
+        if notification.status != 'sent' and message.attempts >= settings.OUTBOX_MAX_ATTEMPTS:
+            fallback = channels.pick(notification.customer, after=message.provider)
+
+        if notification.status == 'sent':
+            message.status = 'sent'
+            message.last_error = None
+            stats['sent'] += 1
+            finished.append(notification)
+        elif fallback is not None:
+            message.provider = notification.sent_via = fallback
+            message.attempts = 0
+            message.next_attempt_at = now
+            message.last_error = notification.error_message
+            notification.status = 'pending'
+            stats['moved'] += 1
+            moved.append(notification)
+        elif message.attempts >= settings.OUTBOX_MAX_ATTEMPTS:
+            message.status = 'dead'
+            message.last_error = notification.error_message
+            stats['dead'] += 1
+            finished.append(notification)
+        else:
+            # still queued: the notification stays pending until a later attempt settles it
+            message.next_attempt_at = now + backoff(message.attempts)
+            message.last_error = notification.error_message
+            notification.status = 'pending'
+            stats['retried'] += 1
+
+    with transaction.atomic():
+        delivery.write_back(finished)
+        bulk_log(finished, LogEntry.Action.CREATE)
+        if moved:
+            Notification.objects.bulk_update(moved, ['sent_via', 'updated_at'])
+        OutboxMessage.objects.bulk_update(
+            messages, ['provider', 'status', 'attempts', 'next_attempt_at', 'last_error', 'updated_at'],
+        )
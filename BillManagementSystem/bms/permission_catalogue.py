@@ -0,0 +1,90 @@
+"""
+In-memory catalogue of permission codenames.
+
+Superusers are serialized with every permission codename in the system and
+regular users with the codenames assigned to them. Both change rarely but are
+read on almost every response, so:
+
+* the full codename list is loaded once per worker and kept in memory,
+* per-user codename lists are kept in the Django cache,
+* a version number stored in the shared cache is bumped whenever permissions
+  change; workers compare it (at most every PERMISSION_CATALOGUE_CHECK_INTERVAL
+  seconds) and reload when it moved. Per-user keys embed the version, so a bump
+  also retires every per-user entry.
+"""
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import Permission
+from django.core.cache import cache
+
+
+VERSION_KEY = 'permission_catalogue:version'
+USER_KEY = 'permission_catalogue:v{version}:user:{user_id}'
+USER_TIMEOUT = 60 * 60
+
+_lock = threading.Lock()
+_state = {'version': None, 'codenames': None, 'checked_at': 0.0}
+
+
+def current_version():
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        cache.add(VERSION_KEY, 1, timeout=None)
+        version = cache.get(VERSION_KEY, 1)
+    return version
+
+
+def all_codenames():
+    """Every permission codename, as a tuple, loaded at most once per version."""
+    now = time.monotonic()
+    interval = getattr(settings, 'PERMISSION_CATALOGUE_CHECK_INTERVAL', 5)
+    with _lock:
+        if _state['codenames'] is not None and now - _state['checked_at'] < interval:
+            return _state['codenames']
+
+        version = current_version()
+        if _state['codenames'] is None or _state['version'] != version:
+            _state['codenames'] = tuple(Permission.objects.values_list('codename', flat=True))
+            _state['version'] = version
+        _state['checked_at'] = now
+        return _state['codenames']
+
+
+def catalogue_version():
+    """The catalogue version this worker last saw, refreshed like all_codenames()."""
+    all_codenames()
+    return _state['version']
+
+
+def user_codenames(user):
+    """Codenames explicitly assigned to `user`, from the prefetch cache or the Django cache."""
+    if user.pk is None:
+        return []
+
+    if 'user_permissions' in getattr(user, '_prefetched_objects_cache', {}):
+        return [permission.codename for permission in user.user_permissions.all()]
+
+    key = USER_KEY.format(version=current_version(), user_id=user.pk)
+    codenames = cache.get(key)
+    if codenames is None:
+        codenames = list(user.user_permissions.values_list('codename', flat=True))
+        cache.set(key, codenames, timeout=USER_TIMEOUT)
+    return codenames
+
+
+def invalidate():
+    """Retire the catalogue and all per-user lists, in this worker and the others."""
+    cache.add(VERSION_KEY, 1, timeout=None)
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        # the key was evicted between add() and incr()
+        cache.set(VERSION_KEY, int(time.time()), timeout=None)
+    with _lock:
+        _state['codenames'] = None
+
+
+def invalidate_user(user_id):
+    cache.delete(USER_KEY.format(version=current_version(), user_id=user_id))
@@ -0,0 +1,104 @@
+"""
+Reminder timing.
+
+Billers say on which days, relative to the due date, their customers are
+reminded (ReminderPolicy: -7, -3, -1, 5, ...); billers without policies use
+REMINDER_DEFAULT_OFFSETS. Offsets up to 0 send upcoming_due reminders and
+later ones overdue reminders. Both the daily sweep and the schedule below
+evaluate an offset for all billers sharing it at once (reminded_at()).
+
+Every open bill has a ScheduledReminder row per moment still ahead of it:
+the start (UTC) of each reminder day, plus the day after the due date, when
+a pending bill turns overdue. Saving a bill keeps its rows in step
+(signals.py), changing a biller's policies reschedules its bills, and
+dispatch_due_reminders pops only the rows whose moment has come, so reminder
+work follows the number of reminders due rather than the size of the bill
+table.
+
+Bills written with bulk_create() or QuerySet.update() skip the signals; the
+daily send_due_notifications sweep still reminds them.
+"""
+from datetime import datetime, time, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+
+from .models import ReminderPolicy, ScheduledReminder
+
+
+OPEN_STATUSES = ('pending', 'overdue')
+# the day after the due date: pending bills turn overdue
+OVERDUE_OFFSET = 1
+
+# remove and return the due rows; SKIP LOCKED lets several dispatchers pop side by side
+POP_SQL = """
+    DELETE FROM {table} WHERE id IN (
+        SELECT id FROM {table} WHERE run_at <= %s ORDER BY run_at LIMIT %s FOR UPDATE SKIP LOCKED
+    )
+    RETURNING bill_id, days_offset
+"""
+
+
+def notification_type(offset):
+    return 'upcoming_due' if offset <= 0 else 'overdue'
+
+
+def bill_status(offset):
+    """The status of the bills reminded at `offset`; pending ones past due turn overdue first."""
+    return 'pending' if offset <= 0 else 'overdue'
+
+
+def offsets_in_use():
+    """Every offset some biller reminds at, in order."""
+    offsets = set(ReminderPolicy.objects.values_list('days_offset', flat=True).distinct())
+    return sorted(offsets | set(settings.REMINDER_DEFAULT_OFFSETS))
+
+
+def offsets_by_biller(biller_ids):
+    offsets = {biller_id: set() for biller_id in biller_ids}
+    for biller_id, offset in ReminderPolicy.objects.filter(biller__in=biller_ids).values_list('biller', 'days_offset'):
+        offsets[biller_id].add(offset)
+    return {biller_id: sorted(days or settings.REMINDER_DEFAULT_OFFSETS) for biller_id, days in offsets.items()}
+
+
+def reminded_at(offset):
+    """Condition on bills: their biller reminds `offset` days from the due date."""
+    condition = Exists(ReminderPolicy.objects.filter(biller=OuterRef('biller'), days_offset=offset))
+    if offset in settings.REMINDER_DEFAULT_OFFSETS:
+        condition |= ~Exists(ReminderPolicy.objects.filter(biller=OuterRef('biller')))
+    return condition
+
+
+def run_at(due_date, offset):
+    return datetime.combine(due_date + timedelta(days=offset), time.min, tzinfo=dt_timezone.utc)
+
+
+def schedule_reminders(bills):
+    """
+    Give open `bills` their moments from today on and drop any others they
+    had. A pending bill keeps its overdue moment even when it has passed, so
+    the dispatcher flips it right away.
+    """
+    today = timezone.now().date()
+    offsets = offsets_by_biller({bill.biller_id for bill in bills})
+    moments = [
+        ScheduledReminder(bill=bill, days_offset=offset, run_at=run_at(bill.due_date, offset))
+        for bill in bills if bill.status in OPEN_STATUSES
+        for offset in sorted(set(offsets[bill.biller_id]) | {OVERDUE_OFFSET})
+        if bill.due_date + timedelta(days=offset) >= today or (offset == OVERDUE_OFFSET and bill.status == 'pending')
+    ]
+    ScheduledReminder.objects.filter(bill__in=[bill.pk for bill in bills]).delete()
+    ScheduledReminder.objects.bulk_create(moments)
+
+
+def pop_due(now, limit):
+    """
+    Delete and return up to `limit` (bill_id, days_offset) pairs due by
+    `now`. Call it in the transaction that handles them, so a failure puts
+    them back.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(POP_SQL.format(table=connection.ops.quote_name(ScheduledReminder._meta.db_table)), [now, limit])
+        return cursor.fetchall()
@@ -0,0 +1,125 @@
+"""
+Cache of rendered serializer fragments.
+
+A serializer's own fields (relations rendered as ids, nothing expanded) only
+change when the row is saved, and every cached model carries an `updated_at`
+auto_now column, so the fragment is stored under
+(model, pk, updated_at, field selection). Expanded relations are cached as
+their own fragments and stitched together at render time, which keeps a
+biller or customer that appears on thousands of bills rendered once.
+
+Reads for a page are batched with get_many and writes with set_many through a
+RepresentationCache kept in the serializer context for the duration of one
+render. An optional in-process LRU (REPRESENTATION_CACHE_LOCAL_SIZE entries)
+sits in front of the shared cache; the shared cache bounds its own size
+(see the redis maxmemory settings in docker-compose.yml).
+"""
+import threading
+from contextlib import contextmanager
+
+from cachetools import LRUCache
+from django.conf import settings
+from django.core.cache import caches
+
+
+CONTEXT_KEY = 'representation_cache'
+
+_local_lock = threading.Lock()
+_local = {'cache': None}
+
+
+def _backend():
+    return caches[getattr(settings, 'REPRESENTATION_CACHE_ALIAS', 'default')]
+
+
+def _timeout():
+    return getattr(settings, 'REPRESENTATION_CACHE_TIMEOUT', 60 * 60)
+
+
+def _local_cache():
+    size = getattr(settings, 'REPRESENTATION_CACHE_LOCAL_SIZE', 0)
+    if not size:
+        return None
+    if _local['cache'] is None or _local['cache'].maxsize != size:
+        _local['cache'] = LRUCache(maxsize=size)
+    return _local['cache']
+
+
+def is_enabled():
+    return getattr(settings, 'REPRESENTATION_CACHE_ENABLED', True)
+
+
+class RepresentationCache:
+    """Per-render view of the fragment cache that batches round trips."""
+
+    def __init__(self):
+        self.found = {}
+        self.requested = set()
+        self.pending = {}
+
+    def prefetch(self, keys):
+        keys = [key for key in keys if key not in self.requested]
+        if not keys:
+            return
+        self.requested.update(keys)
+
+        missing = keys
+        local = _local_cache()
+        if local is not None:
+            missing = []
+            with _local_lock:
+                for key in keys:
+                    value = local.get(key)
+                    if value is None:
+                        missing.append(key)
+                    else:
+                        self.found[key] = value
+        if not missing:
+            return
+
+        found = _backend().get_many(missing)
+        self.found.update(found)
+        if local is not None and found:
+            with _local_lock:
+                local.update(found)
+
+    def get(self, key):
+        if key not in self.requested:
+            self.prefetch([key])
+        value = self.found.get(key)
+        # callers add expanded relations on top of the fragment
+        return dict(value) if value is not None else None
+
+    def set(self, key, value):
+        value = dict(value)
+        self.found[key] = value
+        self.pending[key] = value
+
+    def flush(self):
+        if not self.pending:
+            return
+        _backend().set_many(self.pending, timeout=_timeout())
+        local = _local_cache()
+        if local is not None:
+            with _local_lock:
+                local.update(self.pending)
+        self.pending = {}
+
+
+@contextmanager
+def representation_cache_scope(context):
+    """
+    Yield (cache, created). The outermost serializer of a render creates the
+    cache and flushes its writes when it is done; nested ones reuse it.
+    """
+    cache = context.get(CONTEXT_KEY)
+    if cache is not None:
+        yield cache, False
+        return
+
+    cache = context[CONTEXT_KEY] = RepresentationCache()
+    try:
+        yield cache, True
+    finally:
+        context.pop(CONTEXT_KEY, None)
+        cache.flush()
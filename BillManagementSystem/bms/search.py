@@ -0,0 +1,111 @@
+"""
+Weighted full-text search vectors for bills, notifications and users.
+
+Each searchable model stores a `search_vector` (GIN indexed) built from its
+own columns and, for bills and notifications, the names of related rows:
+
+* bill: A bill_number, B biller name/company, B customer email/name, C description
+* notification: A subject, B bill number, B customer email/name, C message
+* user: A email/names, B phone number, C address
+
+Vectors are recomputed with one UPDATE per save (see signals.py), including
+the rows embedding a biller's or customer's name or a bill's number when
+that changed (DEPENDENT_FIELDS). Related names are read through subqueries
+so the same expressions work in UPDATE statements and in migrations, where
+`apps` is the historical registry.
+"""
+from django.apps import apps as global_apps
+from django.conf import settings
+from django.contrib.postgres.search import SearchVector
+from django.db.models import OuterRef, Subquery
+
+
+# columns whose changes make dependent rows' vectors stale
+SOURCE_FIELDS = {
+    'bms.bill': {'bill_number', 'biller', 'customer', 'description'},
+    'bms.notification': {'subject', 'bill', 'customer', 'message'},
+    'bms.customuser': {'email', 'first_name', 'middle_name', 'last_name', 'phone_number', 'address'},
+}
+DEPENDENT_FIELDS = {
+    'bms.bill': ('bill_number',),
+    'bms.biller': ('name', 'company_name'),
+    'bms.customuser': ('email', 'first_name', 'last_name'),
+}
+
+
+def get_config():
+    return getattr(settings, 'SEARCH_CONFIG', 'simple')
+
+
+def related(model, field, outer_ref):
+    return Subquery(model._default_manager.filter(pk=OuterRef(outer_ref)).values(field)[:1])
+
+
+def bill_vector(apps=global_apps):
+    Biller = apps.get_model('bms', 'Biller')
+    User = apps.get_model('bms', 'CustomUser')
+    config = get_config()
+    return (
+        SearchVector('bill_number', weight='A', config=config)
+        + SearchVector(
+            related(Biller, 'name', 'biller_id'), related(Biller, 'company_name', 'biller_id'),
+            weight='B', config=config,
+        )
+        + SearchVector(
+            related(User, 'email', 'customer_id'), related(User, 'first_name', 'customer_id'),
+            related(User, 'last_name', 'customer_id'),
+            weight='B', config=config,
+        )
+        + SearchVector('description', weight='C', config=config)
+    )
+
+
+def notification_vector(apps=global_apps):
+    Bill = apps.get_model('bms', 'Bill')
+    User = apps.get_model('bms', 'CustomUser')
+    config = get_config()
+    return (
+        SearchVector('subject', weight='A', config=config)
+        + SearchVector(related(Bill, 'bill_number', 'bill_id'), weight='B', config=config)
+        + SearchVector(
+            related(User, 'email', 'customer_id'), related(User, 'first_name', 'customer_id'),
+            related(User, 'last_name', 'customer_id'),
+            weight='B', config=config,
+        )
+        + SearchVector('message', weight='C', config=config)
+    )
+
+
+def user_vector(apps=global_apps):
+    config = get_config()
+    return (
+        SearchVector('email', 'first_name', 'middle_name', 'last_name', weight='A', config=config)
+        + SearchVector('phone_number', weight='B', config=config)
+        + SearchVector('address', weight='C', config=config)
+    )
+
+
+VECTORS = {
+    'bms.bill': bill_vector,
+    'bms.notification': notification_vector,
+    'bms.customuser': user_vector,
+}
+
+
+def update_search_vectors(queryset, apps=global_apps):
+    """Recompute `search_vector` for every row of `queryset` in one UPDATE."""
+    return queryset.update(search_vector=VECTORS[queryset.model._meta.label_lower](apps))
+
+
+def update_dependent_search_vectors(instance):
+    """Refresh the vectors that embed `instance`'s DEPENDENT_FIELDS (its bills and notifications)."""
+    Bill = global_apps.get_model('bms', 'Bill')
+    Notification = global_apps.get_model('bms', 'Notification')
+    label = instance._meta.label_lower
+    if label == 'bms.bill':
+        update_search_vectors(Notification.objects.filter(bill_id=instance.pk))
+    elif label == 'bms.biller':
+        update_search_vectors(Bill.objects.filter(biller_id=instance.pk))
+    elif label == 'bms.customuser':
+        update_search_vectors(Bill.objects.filter(customer_id=instance.pk))
+        update_search_vectors(Notification.objects.filter(customer_id=instance.pk))
@@ -2,11 +2,312 @@ from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
 from django.contrib.auth.models import User,Group,Permission,ContentType
 from django.contrib.auth import get_user_model,authenticate
 from rest_framework import serializers
+import hashlib
+import json
+
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Prefetch
+from django.db.models.manager import BaseManager
 from .models import *
+from . import permission_catalogue
+from .representation_cache import is_enabled as representation_cache_enabled, representation_cache_scope
+from .identity_map import get_identity_map
 
 User = get_user_model()
 
 
+def parse_field_paths(value):
+    """
+    Turn "bill_number,biller.name,biller.user" (or a list of such paths) into a
+    tree: {'bill_number': {}, 'biller': {'name': {}, 'user': {}}}.
+    An empty tree means no restriction for `fields` and nothing for `expand`.
+    """
+    if not value:
+        return {}
+    if isinstance(value, dict):
+        return value
+    if isinstance(value, str):
+        value = value.split(',')
+
+    tree = {}
+    for path in value:
+        node = tree
+        for part in path.strip().split('.'):
+            if part:
+                node = node.setdefault(part, {})
+    return tree
+
+
+class EagerLoadingMixin:
+    """
+    Lets a serializer declare the relations it reads so list views can load
+    them up front instead of issuing queries per row.
+
+    `prefetch_related_fields` lists the serializer's own many-valued relations,
+    `get_nested_serializers()` maps relation names to the serializers that
+    render them when expanded. `field_dependencies` names extra columns a
+    readable field needs when the queryset is narrowed with only().
+
+    Relations rendered by an `identity_mapped` serializer are left out of the
+    plan; they are resolved through the request's identity map instead.
+    """
+    prefetch_related_fields = ()
+    field_dependencies = {}
+    identity_mapped = False
+
+    @classmethod
+    def get_nested_serializers(cls):
+        return {}
+
+    @classmethod
+    def get_eager_loading(cls, prefix='', fields=None, expand=None):
+        """
+        Return the (select_related, prefetch_related, only) lookups needed to
+        render `fields` with the relations in `expand` (both parsed trees).
+        `only` is None when this level renders all of its fields.
+        """
+        fields = fields or {}
+        expand = expand or {}
+        model = cls.Meta.model
+        select_related = []
+        prefetch_related = [prefix + name for name in cls.prefetch_related_fields if not fields or name in fields]
+        only = None
+
+        if fields:
+            only = [prefix + model._meta.pk.name]
+            if getattr(cls, 'cache_representation', False):
+                only.append(prefix + 'updated_at')
+            for name in fields:
+                only.extend(prefix + dependency for dependency in cls.field_dependencies.get(name, ()))
+                try:
+                    field = model._meta.get_field(name)
+                except FieldDoesNotExist:
+                    continue
+                if field.concrete and not field.many_to_many:
+                    only.append(prefix + name)
+
+        nested_serializers = cls.get_nested_serializers()
+        for name, nested_expand in expand.items():
+            if name not in nested_serializers or (fields and name not in fields):
+                continue
+            serializer_class = nested_serializers[name]
+            nested_fields = fields.get(name) or {}
+            field = model._meta.get_field(name)
+
+            if field.many_to_many or field.one_to_many:
+                if nested_fields and field.one_to_many:
+                    # the prefetch needs the foreign key back to this row
+                    nested_fields = {**nested_fields, field.field.name: {}}
+                related_queryset = serializer_class.setup_eager_loading(
+                    field.related_model._default_manager.all(), fields=nested_fields, expand=nested_expand
+                )
+                prefetch_related.append(Prefetch(prefix + name, queryset=related_queryset))
+            elif serializer_class.identity_mapped:
+                if only is not None:
+                    only.append(prefix + name)
+            else:
+                select_related.append(prefix + name)
+                nested_select, nested_prefetch, nested_only = serializer_class.get_eager_loading(
+                    prefix + name + '__', nested_fields, nested_expand
+                )
+                select_related.extend(nested_select)
+                prefetch_related.extend(nested_prefetch)
+                if only is not None:
+                    only.append(prefix + name)
+                    only.extend(nested_only or [])
+
+        return select_related, prefetch_related, only
+
+    @classmethod
+    def setup_eager_loading(cls, queryset, fields=None, expand=None):
+        select_related, prefetch_related, only = cls.get_eager_loading(
+            fields=parse_field_paths(fields), expand=parse_field_paths(expand)
+        )
+        if select_related:
+            queryset = queryset.select_related(*select_related)
+        if prefetch_related:
+            queryset = queryset.prefetch_related(*prefetch_related)
+        if only:
+            queryset = queryset.only(*only)
+        return queryset
+
+
+class FlexFieldsMixin(EagerLoadingMixin):
+    """
+    Sparse fieldsets and opt-in expansion. Relations render as primary keys
+    unless they are named in `expand`; `fields` limits the keys returned.
+    Both take comma separated dotted paths (or a parsed tree), e.g.
+    fields="bill_number,amount,biller.name" and expand="biller".
+
+    With `cache_representation` set, the serializer's own fields are kept in
+    the representation cache under (model, pk, updated_at, field selection).
+    """
+    cache_representation = False
+
+    def __init__(self, *args, **kwargs):
+        self._requested_fields = parse_field_paths(kwargs.pop('fields', None))
+        self._requested_expand = parse_field_paths(kwargs.pop('expand', None))
+        super().__init__(*args, **kwargs)
+
+    def get_fields(self):
+        fields = super().get_fields()
+        if self._requested_fields:
+            for name in list(fields):
+                if name not in self._requested_fields:
+                    fields.pop(name)
+        return fields
+
+    def get_expanded_relations(self):
+        nested_serializers = self.get_nested_serializers()
+        for name, expand in self._requested_expand.items():
+            if name not in nested_serializers:
+                continue
+            if self._requested_fields and name not in self._requested_fields:
+                continue
+            yield name, nested_serializers[name], expand
+
+    def get_prefetch_lookups(self):
+        return [name for name in self.prefetch_related_fields if not self._requested_fields or name in self._requested_fields]
+
+    def resolve_identity_map(self, instances, identity_map):
+        """
+        Attach the identity-mapped relations of `instances` and of everything
+        expanded below them: relations already in memory are walked first so
+        each model is loaded with one query per identity-mapped hop.
+        """
+        worklist = [(self, list(instances))]
+        while worklist:
+            requests = []
+            while worklist:
+                serializer, objs = worklist.pop()
+                for name, serializer_class, expand in serializer.get_expanded_relations():
+                    nested = serializer_class(
+                        context=self.context, fields=serializer._requested_fields.get(name), expand=expand
+                    )
+                    field = serializer.Meta.model._meta.get_field(name)
+                    if field.many_to_many or field.one_to_many:
+                        worklist.append((nested, [obj for instance in objs for obj in getattr(instance, name).all()]))
+                    elif serializer_class.identity_mapped:
+                        requests.append((nested, field, objs))
+                    else:
+                        related = (getattr(instance, name) for instance in objs)
+                        worklist.append((nested, [obj for obj in related if obj is not None]))
+
+            if requests:
+                results = identity_map.attach(
+                    [(field, objs, nested.get_prefetch_lookups()) for nested, field, objs in requests]
+                )
+                worklist = [(nested, related) for (nested, _, _), related in zip(requests, results)]
+
+    def get_identity_key(self, instance):
+        if instance.pk is None:
+            return None
+        selection = json.dumps([self._requested_fields, self._requested_expand], sort_keys=True)
+        return (type(self), selection, instance.pk)
+
+    def get_representation_signature(self):
+        """The parts of the cache key that depend on how, not what, is rendered."""
+        parts = [','.join(sorted(self._requested_fields))]
+        request = self.context.get('request')
+        if request is not None:
+            # file fields render absolute urls
+            parts.append(request.build_absolute_uri('/'))
+        return '|'.join(parts)
+
+    def get_representation_cache_key(self, instance):
+        if not self.cache_representation or not representation_cache_enabled():
+            return None
+        if instance.pk is None or 'updated_at' in instance.get_deferred_fields():
+            return None
+        if instance.updated_at is None:
+            return None
+        signature = hashlib.md5(self.get_representation_signature().encode()).hexdigest()
+        return f'repr:{instance._meta.label_lower}:{instance.pk}:{instance.updated_at.timestamp()}:{signature}'
+
+    def collect_representation_cache_keys(self, instances, keys):
+        """Add the cache keys of `instances` and of their expanded relations to `keys`."""
+        for instance in instances:
+            key = self.get_representation_cache_key(instance)
+            if key:
+                keys.append(key)
+
+        for name, serializer_class, expand in self.get_expanded_relations():
+            field = self.Meta.model._meta.get_field(name)
+            related = []
+            for instance in instances:
+                value = getattr(instance, name)
+                if value is None:
+                    continue
+                if field.many_to_many or field.one_to_many:
+                    related.extend(value.all())
+                else:
+                    related.append(value)
+            nested = serializer_class(context=self.context, fields=self._requested_fields.get(name), expand=expand)
+            nested.collect_representation_cache_keys(related, keys)
+
+    def prime_representation_cache(self, instances, cache):
+        keys = []
+        self.collect_representation_cache_keys(instances, keys)
+        cache.prefetch(keys)
+
+    def to_representation(self, instance):
+        with representation_cache_scope(self.context) as (cache, created):
+            identity_map = get_identity_map(self.context)
+            if created:
+                self.resolve_identity_map([instance], identity_map)
+                self.prime_representation_cache([instance], cache)
+
+            identity_key = self.get_identity_key(instance)
+            if identity_key is not None:
+                representation = identity_map.get_rendered(identity_key)
+                if representation is not None:
+                    return representation
+
+            key = self.get_representation_cache_key(instance)
+            representation = cache.get(key) if key else None
+            if representation is None:
+                representation = super().to_representation(instance)
+                if key:
+                    cache.set(key, representation)
+
+            for name, serializer_class, expand in self.get_expanded_relations():
+                representation[name] = self.to_nested_representation(instance, name, serializer_class, expand)
+
+            if identity_key is not None:
+                identity_map.set_rendered(identity_key, representation)
+            return representation
+
+    def to_nested_representation(self, instance, name, serializer_class, expand):
+        value = getattr(instance, name)
+        if value is None:
+            return None
+        kwargs = {
+            'context': self.context,
+            'fields': self._requested_fields.get(name),
+            'expand': expand,
+        }
+        field = self.Meta.model._meta.get_field(name)
+        if field.many_to_many or field.one_to_many:
+            return serializer_class(value.all(), many=True, **kwargs).data
+        return serializer_class(value, **kwargs).data
+
+
+class FlexListSerializer(serializers.ListSerializer):
+    """
+    Resolves identity-mapped relations for a whole page and primes the
+    representation cache with one get_many before rendering it.
+    """
+
+    def to_representation(self, data):
+        iterable = data.all() if isinstance(data, BaseManager) else data
+        with representation_cache_scope(self.context) as (cache, created):
+            if created:
+                iterable = list(iterable)
+                self.child.resolve_identity_map(iterable, get_identity_map(self.context))
+                self.child.prime_representation_cache(iterable, cache)
+            return [self.child.to_representation(item) for item in iterable]
+
+
 class CustomTokenObtainPairSerializer(TokenObtainPairSerializer):
 
     username_field = "email"
@@ -45,13 +346,44 @@ class CustomTokenObtainPairSerializer(TokenObtainPairSerializer):
         data['profile_picture'] = user.profile_picture.url if user.profile_picture else None
         return data
     
-class UserSerializer(serializers.ModelSerializer):
+class PermissionCodenamesField(serializers.ManyRelatedField):
+    """
+    Writes like a codename SlugRelatedField. Reads from the permission catalogue:
+    superusers receive all permissions, regular users only their explicitly
+    assigned ones, without a query per serialized user.
+    """
+
+    def get_attribute(self, instance):
+        return instance
+
+    def to_representation(self, user):
+        if user.pk is None:
+            return []
+        if user.is_superuser:
+            return list(permission_catalogue.all_codenames())
+        return permission_catalogue.user_codenames(user)
+
+
+class UserSerializer(FlexFieldsMixin, serializers.ModelSerializer):
+    prefetch_related_fields = ('user_permissions', 'groups')
+    field_dependencies = {'user_permissions': ('is_superuser',)}
+    cache_representation = True
+    identity_mapped = True
+
     password = serializers.CharField(write_only=True, required=False)
-    user_permissions = serializers.SlugRelatedField(slug_field="codename",queryset=Permission.objects.all(),many=True,required=False)
+    user_permissions = PermissionCodenamesField(
+        child_relation=serializers.SlugRelatedField(slug_field="codename",queryset=Permission.objects.all()),
+        required=False,
+    )
     groups = serializers.SlugRelatedField(slug_field="name",queryset=Group.objects.all(),many=True,required=False)
     class Meta:
         model = User
-        fields = "__all__"
+        exclude = ["search_vector"]
+        list_serializer_class = FlexListSerializer
+
+    def get_representation_signature(self):
+        # codenames (and for superusers the whole catalogue) change without touching the user row
+        return f"{super().get_representation_signature()}|{permission_catalogue.catalogue_version()}"
 
     def validate(self, data):
         if self.instance is None and "password" not in data:
@@ -74,19 +406,6 @@ class UserSerializer(serializers.ModelSerializer):
         instance.save()
         return instance
     
-    def to_representation(self, instance):
-        """Ensure superusers receive all permissions."""
-        representation = super().to_representation(instance)
-
-        if instance.is_superuser:
-            # Get all permission codenames for superusers
-            all_permissions = Permission.objects.values_list("codename", flat=True)
-            representation["user_permissions"] = list(all_permissions)
-        else:
-            # Regular users: only show explicitly assigned permissions
-            representation["user_permissions"] = list(instance.user_permissions.values_list("codename", flat=True))
-        return representation
-    
 class GroupSerializer(serializers.ModelSerializer):
     permissions = serializers.SlugRelatedField(slug_field="codename",queryset=Permission.objects.all(),many=True,required=False)
 
@@ -103,93 +422,104 @@ class PermissionSerializer(serializers.ModelSerializer):
 
 
 
-class BillerSerializer(serializers.ModelSerializer):
+class BillerSerializer(FlexFieldsMixin, serializers.ModelSerializer):
+    cache_representation = True
+    identity_mapped = True
+
     class Meta:
         model = Biller
         fields = '__all__'
-    
-    def to_representation(self, instance):
-        representation = super().to_representation(instance)
-        representation['user'] = UserSerializer(instance.user).data
-        return representation
+        list_serializer_class = FlexListSerializer
+
+    @classmethod
+    def get_nested_serializers(cls):
+        return {'user': UserSerializer}
         
 
         
         
-class CustomerBillerSerializer(serializers.ModelSerializer):
+class ReminderPolicySerializer(serializers.ModelSerializer):
+    class Meta:
+        model = ReminderPolicy
+        fields = '__all__'
+        # the caller's biller (ReminderPolicyCreateView)
+        read_only_fields = ['biller']
+
+    def validate_days_offset(self, value):
+        if abs(value) > 365:
+            raise serializers.ValidationError("reminders can be at most a year from the due date")
+        return value
+
+
+class CustomerBillerSerializer(FlexFieldsMixin, serializers.ModelSerializer):
+    cache_representation = True
+
     class Meta:
         model = CustomerBiller
         fields = "__all__"
-        
-    def to_representation(self, instance):
-        representation = super().to_representation(instance)
-        representation['user'] = UserSerializer(instance.user).data
-        representation['biller'] = BillerSerializer(instance.biller).data
-        return representation
-    
+        list_serializer_class = FlexListSerializer
 
-class BillSerializer(serializers.ModelSerializer):
+    @classmethod
+    def get_nested_serializers(cls):
+        return {'user': UserSerializer, 'biller': BillerSerializer}
     
+
+class BillSerializer(FlexFieldsMixin, serializers.ModelSerializer):
+    cache_representation = True
+    # a generated column, which ModelSerializer does not map
+    balance = serializers.DecimalField(max_digits=10, decimal_places=2, read_only=True)
+
     class Meta:
         model = Bill
-        fields = '__all__'
-        
-    def to_representation(self, instance):
-        representation = super().to_representation(instance)
-        representation['biller'] = BillerSerializer(instance.biller).data
-        representation['customer'] = UserSerializer(instance.customer).data
-        return representation
+        exclude = ['search_vector']
+        # derived from amount, due_date and paid_amount by Bill.save() and BillManager
+        read_only_fields = ['status']
+        list_serializer_class = FlexListSerializer
+
+    @classmethod
+    def get_nested_serializers(cls):
+        return {'biller': BillerSerializer, 'customer': UserSerializer}
     
 
-class PaymentSerializer(serializers.ModelSerializer):
+class PaymentSerializer(FlexFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Payment
         fields = '__all__'
-        
-    def to_representation(self, instance):
-        representation = super().to_representation(instance)
-        representation['customer'] = UserSerializer(instance.customer).data
-        representation['payment_bills'] = PaymentBillDemoSerializer(instance.payment_bills.filter(payment=instance), many=True).data
-        #representation['bills'] = BillSerializer(instance.bills, many=True).data
-        return representation
+        list_serializer_class = FlexListSerializer
+
+    @classmethod
+    def get_nested_serializers(cls):
+        return {'customer': UserSerializer, 'payment_bills': PaymentBillDemoSerializer}
     
     
 
 
-class NotificationSerializer(serializers.ModelSerializer):
+class NotificationSerializer(FlexFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Notification
-        fields = '__all__'
+        exclude = ['search_vector']
+        list_serializer_class = FlexListSerializer
 
-    def to_representation(self, instance):
-        representation = super().to_representation(instance)
-        representation['bill'] = BillSerializer(instance.bill).data
-        representation['customer'] = UserSerializer(instance.customer).data
-        return representation
+    @classmethod
+    def get_nested_serializers(cls):
+        return {'bill': BillSerializer, 'customer': UserSerializer}
     
-class PaymentBillSerializer(serializers.ModelSerializer):
+class PaymentBillSerializer(FlexFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = PaymentBill
         fields = '__all__'
-        
-    def to_representation(self, instance):
-        representation = super().to_representation(instance)
-        representation['payment'] = PaymentSerializer(instance.payment).data
-        representation['bill'] = BillSerializer(instance.bill).data
-        return representation
+        list_serializer_class = FlexListSerializer
 
-class PaymentBillDemoSerializer(serializers.ModelSerializer):
+    @classmethod
+    def get_nested_serializers(cls):
+        return {'payment': PaymentSerializer, 'bill': BillSerializer}
+
+class PaymentBillDemoSerializer(FlexFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = PaymentBill
         fields = '__all__'
-        
-    def to_representation(self, instance):
-        representation = super().to_representation(instance)
-        #representation['payment'] = PaymentSerializer(instance.payment).data
-        representation['bill'] = BillSerializer(instance.bill).data
-        return representation
-    
-    
-
-
+        list_serializer_class = FlexListSerializer
 
+    @classmethod
+    def get_nested_serializers(cls):
+        return {'bill': BillSerializer}
@@ -0,0 +1,156 @@
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Group, Permission
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from . import permission_catalogue, reminders, search, tasks
+from .models import Bill, Biller, Notification, PaymentBill, ReminderPolicy
+
+
+User = get_user_model()
+
+
+#-------------------------------permission catalogue invalidation-------------------------------
+@receiver([post_save, post_delete], sender=Permission)
+def invalidate_permission_catalogue(sender, **kwargs):
+    transaction.on_commit(permission_catalogue.invalidate)
+
+
+@receiver(m2m_changed, sender=User.user_permissions.through)
+def invalidate_user_permission_codenames(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+
+    if not reverse:
+        user_ids = [instance.pk]
+    elif pk_set:
+        user_ids = list(pk_set)
+    else:
+        # permission.customuser_set.clear() does not tell us which users were affected
+        transaction.on_commit(permission_catalogue.invalidate)
+        return
+
+    def invalidate_users():
+        for user_id in user_ids:
+            permission_catalogue.invalidate_user(user_id)
+
+    transaction.on_commit(invalidate_users)
+
+
+#-------------------------------user freshness for the representation cache-------------------------------
+# cached user fragments are keyed on updated_at, which m2m changes and group renames do not touch
+def touch_users(user_ids):
+    now = timezone.now()
+    if user_ids:
+        User.objects.filter(pk__in=user_ids).update(updated_at=now)
+    return now
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+@receiver(m2m_changed, sender=User.user_permissions.through)
+def touch_users_on_m2m_change(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            instance.updated_at = touch_users([instance.pk])
+        return
+
+    if action == 'pre_clear':
+        instance._cleared_user_ids = list(instance.customuser_set.values_list('pk', flat=True))
+    elif action == 'post_clear':
+        touch_users(getattr(instance, '_cleared_user_ids', []))
+    elif action in ('post_add', 'post_remove'):
+        touch_users(pk_set)
+
+
+@receiver(post_save, sender=Group)
+def touch_users_on_group_change(sender, instance, created, **kwargs):
+    if not created:
+        touch_users(list(instance.customuser_set.values_list('pk', flat=True)))
+
+
+#-------------------------------search vectors-------------------------------
+@receiver(post_save, sender=Bill)
+@receiver(post_save, sender=Notification)
+@receiver(post_save, sender=User)
+def update_search_vector(sender, instance, created, raw, update_fields=None, **kwargs):
+    if raw:
+        return
+    # e.g. login only touches last_login
+    if update_fields is not None and not set(update_fields) & search.SOURCE_FIELDS[sender._meta.label_lower]:
+        return
+    search.update_search_vectors(sender._default_manager.filter(pk=instance.pk))
+
+
+@receiver(pre_save, sender=Bill)
+@receiver(pre_save, sender=Biller)
+@receiver(pre_save, sender=User)
+def remember_search_names(sender, instance, raw, update_fields=None, **kwargs):
+    fields = search.DEPENDENT_FIELDS[sender._meta.label_lower]
+    if raw or instance.pk is None or (update_fields is not None and not set(update_fields) & set(fields)):
+        instance._search_names = None
+        return
+    instance._search_names = sender._default_manager.filter(pk=instance.pk).values_list(*fields).first()
+
+
+@receiver(post_save, sender=Bill)
+@receiver(post_save, sender=Biller)
+@receiver(post_save, sender=User)
+def update_dependent_search_vectors(sender, instance, created, raw, **kwargs):
+    if raw or created:
+        return
+    fields = search.DEPENDENT_FIELDS[sender._meta.label_lower]
+    names = tuple(getattr(instance, field) for field in fields)
+    if getattr(instance, '_search_names', None) not in (None, names):
+        search.update_dependent_search_vectors(instance)
+
+
+#-------------------------------reminder schedule-------------------------------
+@receiver(post_save, sender=Bill)
+def schedule_bill_reminders(sender, instance, created, raw, update_fields=None, **kwargs):
+    if raw or (update_fields is not None and not set(update_fields) & {'due_date', 'status', 'biller'}):
+        return
+    reminders.schedule_reminders([instance])
+
+
+@receiver([post_save, post_delete], sender=ReminderPolicy)
+def reschedule_biller_reminders(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    biller_id = instance.biller_id
+    transaction.on_commit(lambda: tasks.reschedule_reminders.delay(biller_id))
+
+
+#-------------------------------paid amounts-------------------------------
+# every allocation written, changed or deleted (one by one, in bulk or with its payment or
+# bill) moves its bill's paid_amount by the difference; bulk_create() and update() bypass this
+@receiver(pre_save, sender=PaymentBill)
+def remember_allocation(sender, instance, raw, **kwargs):
+    if raw or instance._state.adding:
+        instance._applied = None
+        return
+    instance._applied = (
+        sender._default_manager.select_for_update().filter(pk=instance.pk).values_list('bill', 'amount_applied').first()
+    )
+
+
+@receiver(post_save, sender=PaymentBill)
+def apply_allocation(sender, instance, raw, **kwargs):
+    if raw:
+        return
+    previous = getattr(instance, '_applied', None)
+    if previous is None:
+        Bill.objects.apply_payment(instance.bill_id, instance.amount_applied)
+    elif previous[0] == instance.bill_id:
+        if previous[1] != instance.amount_applied:
+            Bill.objects.apply_payment(instance.bill_id, instance.amount_applied - previous[1])
+    else:
+        Bill.objects.apply_payment(previous[0], -previous[1])
+        Bill.objects.apply_payment(instance.bill_id, instance.amount_applied)
+    instance._applied = None
+
+
+@receiver(post_delete, sender=PaymentBill)
+def take_back_allocation(sender, instance, **kwargs):
+    Bill.objects.apply_payment(instance.bill_id, -instance.amount_applied)
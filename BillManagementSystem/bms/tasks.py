@@ -1,77 +1,416 @@
-from celery import shared_task
-from django.utils import timezone
-from datetime import timedelta
-from django.core.mail import send_mail
+import logging
+from collections import defaultdict
+import resource
+import smtplib
+import time
+import tracemalloc
+from datetime import date, timedelta
+from functools import partial
+from itertools import islice
+
+from auditlog.models import LogEntry
+from celery import chord, shared_task
 from django.conf import settings
-from .models import Bill, Notification
+from django.contrib.auth import get_user_model
+from django.core.mail import send_mail
+from django.db import connection, transaction
+from django.db.models import F, Q, Window
+from django.db.models.functions import Mod, RowNumber
+from django.utils import timezone
+
+from . import channels, digests, dunning, outbox, reminders, search
+from .audit import bulk_log
+from .models import Bill, DunningStage, Notification
+
+logger = logging.getLogger(__name__)
+User = get_user_model()
+
+# open ends of the first and last chunk
+MIN_ID, MAX_ID = 0, 2 ** 63 - 1
+# what composing a reminder and picking its channel read of the customer
+CUSTOMER_FIELDS = ('customer__email', 'customer__first_name', 'customer__phone_number', 'customer__notification_channels')
+
+
+# one statement: flip the candidate bills to overdue and return what the audit log shows of them
+OVERDUE_SQL = """
+    UPDATE {bill} AS bill SET status = 'overdue', updated_at = %s
+    FROM {user} AS customer
+    WHERE bill.id IN ({candidates}) AND customer.id = bill.customer_id
+    RETURNING bill.id, bill.customer_id, customer.email
+"""
+# a batch of a sweep chunk; bills locked elsewhere are left to the next sweep
+CHUNK_CANDIDATES = (
+    "SELECT id FROM {bill} WHERE status = 'pending' AND due_date < %s AND id BETWEEN %s AND %s "
+    "ORDER BY id LIMIT %s FOR UPDATE SKIP LOCKED"
+)
+# bills with a post due date moment popped from the schedule
+SCHEDULED_CANDIDATES = "SELECT id FROM {bill} WHERE status = 'pending' AND due_date < %s AND id = ANY(%s) FOR UPDATE"
+
+
+@shared_task
+def dispatch_due_reminders():
+    """Handle the scheduled reminders whose moment has come (bms.reminders); beat runs it every few seconds."""
+    stats = _measured(_dispatch)
+    logger.info('dispatch_due_reminders: %s', stats)
+    if stats['queued']:
+        drain_outbox.delay()
+    return stats
+
 
 @shared_task
 def send_due_notifications():
+    """
+    Daily sweep over every open bill, for bills the schedule missed (written in bulk).
+
+    Splits the bills to turn overdue or to remind today (bms.reminders) into id
+    ranges of DUE_NOTIFICATIONS_CHUNK_SIZE and processes each range in its own
+    task; the chord's callback logs the run summary.
+    """
     today = timezone.now().date()
-    tomorrow = today + timedelta(days=1)
+    bounds = _chunk_bounds(today)
+    header = [send_due_notifications_chunk.s(today.isoformat(), first_id, last_id) for first_id, last_id in bounds]
+    result = chord(header)(summarize_due_notifications.s(time.time()))
+    return {'chunks': len(header), 'summary': result.id}
+
+
+@shared_task(bind=True, autoretry_for=(Exception,), max_retries=3, retry_backoff=True)
+def send_due_notifications_chunk(self, today, first_id, last_id):
+    """
+    Queue the reminders for the bills with ids in [first_id, last_id]
+    (None: unbounded) in the outbox; drain_outbox delivers them.
+
+    Overdue transitions are idempotent and claims skip reminders already
+    queued, so a retry resumes the chunk.
+    """
+    today = date.fromisoformat(today)
+    first_id = MIN_ID if first_id is None else first_id
+    last_id = MAX_ID if last_id is None else last_id
+    return _measured(_process_chunk, today, first_id, last_id)
+
+
+@shared_task
+def summarize_due_notifications(results, started_at):
+    summary = {'chunks': len(results), 'overdue': 0, 'queued': 0}
+    for result in results:
+        for key in ('overdue', 'queued'):
+            summary[key] += result[key]
+    summary['seconds'] = round(time.time() - started_at, 3)
+    summary['chunk_seconds'] = round(sum(result['seconds'] for result in results), 3)
+    summary['max_rss_kb'] = max((result['max_rss_kb'] for result in results), default=0)
+    if settings.TASK_TRACE_MEMORY:
+        summary['peak_memory_kb'] = max((result.get('peak_memory_kb', 0) for result in results), default=0)
+    summary['digests'] = digests.package()
+    logger.info('send_due_notifications: %s', summary)
+    if summary['queued']:
+        drain_outbox.delay()
+    return summary
+
+
+def _chunk_bounds(today):
+    """Id ranges holding DUE_NOTIFICATIONS_CHUNK_SIZE candidate bills each, together covering every id."""
+    offsets = reminders.offsets_in_use()
+    # one branch per partial index (bill_pending_due_idx, bill_overdue_due_idx)
+    pending = Bill.objects.filter(
+        Q(due_date__lt=today) | Q(due_date__in=[today - timedelta(days=offset) for offset in offsets if offset <= 0]),
+        status='pending',
+    )
+    overdue = Bill.objects.filter(
+        status='overdue', due_date__in=[today - timedelta(days=offset) for offset in offsets if offset > 0],
+    )
+    candidates = Bill.objects.filter(id__in=pending.values('id').union(overdue.values('id')))
+    starts = list(
+        candidates.annotate(slot=Mod(Window(RowNumber(), order_by=F('id').asc()), settings.DUE_NOTIFICATIONS_CHUNK_SIZE))
+        .filter(slot=1)
+        .values_list('id', flat=True)
+    )[1:]
+    firsts = [None] + starts
+    lasts = [start - 1 for start in starts] + [None]
+    return list(zip(firsts, lasts))
+
+
+def _measured(run, *args):
+    """
+    run(*args)'s stats plus its wall time and the worker's resident memory high-water mark.
+
+    max_rss_kb is the peak over the worker's whole life, so it only moves when a
+    run exceeds every earlier one. With TASK_TRACE_MEMORY on, peak_memory_kb is
+    this run's own peak of Python allocations, at tracemalloc's overhead.
+    """
+    trace = settings.TASK_TRACE_MEMORY
+    if trace:
+        owner = not tracemalloc.is_tracing()
+        if owner:
+            tracemalloc.start()
+        else:
+            tracemalloc.reset_peak()
+    started = time.perf_counter()
+    try:
+        stats = run(*args)
+    finally:
+        if trace:
+            peak = tracemalloc.get_traced_memory()[1]
+            if owner:
+                tracemalloc.stop()
+    stats['seconds'] = round(time.perf_counter() - started, 3)
+    if trace:
+        stats['peak_memory_kb'] = peak // 1024
+    # kilobytes on Linux
+    stats['max_rss_kb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return stats
+
+
+def _dispatch():
+    stats = {'popped': 0, 'overdue': 0, 'queued': 0}
+    while True:
+        with transaction.atomic():
+            now = timezone.now()
+            entries = reminders.pop_due(now, settings.DUE_NOTIFICATIONS_BATCH_SIZE)
+            if not entries:
+                break
+            due = defaultdict(list)
+            for bill_id, offset in entries:
+                due[offset].append(bill_id)
+            bills = _mark_overdue(
+                SCHEDULED_CANDIDATES, [now.date(), [bill_id for bill_id, offset in entries if offset > 0]],
+            )
+            # moments of bills paid or moved since they were scheduled, and the overdue
+            # moment of billers not reminding then, select nothing
+            queued = []
+            for offset, bill_ids in sorted(due.items()):
+                queued += _claim_reminders(list(_reminded_bills(now.date(), offset).filter(pk__in=bill_ids)), offset)
+        stats['popped'] += len(entries)
+        stats['overdue'] += len(bills)
+        stats['queued'] += len(queued)
+    stats['digests'] = digests.package()
+    return stats
+
+
+def _process_chunk(today, first_id, last_id):
+    stats = {'overdue': 0, 'queued': 0}
 
     # Overdue bills
-    overdue_bills = Bill.objects.filter(status='pending', due_date__lt=today)
-    for bill in overdue_bills:
-        _create_and_send_notification(
-            bill,
-            notif_type='overdue',
-            subject=f"Overdue Bill #{bill.bill_number}",
-            message=f"Dear {bill.customer.first_name or 'Customer'},\n\n"
-                    f"Your payment for bill #{bill.bill_number} (amount: {bill.amount} ETB) "
-                    f"was due on {bill.due_date}. Please make the payment as soon as possible."
-        )
-        bill.status = 'overdue'
-        bill.save()
-
-    # Upcoming (1 day left) bills
-    upcoming_bills = Bill.objects.filter(status='pending', due_date=tomorrow)
-    for bill in upcoming_bills:
-        _create_and_send_notification(
-            bill,
-            notif_type='upcoming_due',
-            subject=f"Reminder: Bill #{bill.bill_number} is due tomorrow!",
-            message=f"Dear {bill.customer.first_name or 'Customer'},\n\n"
-                    f"Your bill #{bill.bill_number} for {bill.amount} ETB is due tomorrow ({bill.due_date})."
+    for bills in _overdue_batches(today, first_id, last_id):
+        stats['overdue'] += len(bills)
+
+    # Reminders: one query per offset, for every biller reminding at it
+    for offset in reminders.offsets_in_use():
+        bills = (
+            _reminded_bills(today, offset).filter(id__range=(first_id, last_id))
+            .order_by('pk')
+            .iterator(chunk_size=settings.DUE_NOTIFICATIONS_BATCH_SIZE)
         )
+        for batch in _batches(bills):
+            with transaction.atomic():
+                stats['queued'] += len(_claim_reminders(batch, offset))
+    return stats
 
-def _create_and_send_notification(bill, notif_type, subject, message):
-    try:
-        # Create Notification
-        if Notification.objects.filter(
-            bill=bill,
-            notification_type=notif_type,
-            status='sent'
-        ).exists():
-            return  
-        Notification.objects.create(
+
+def _batches(iterable):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, settings.DUE_NOTIFICATIONS_BATCH_SIZE)):
+        yield batch
+
+
+def _overdue_batches(today, first_id, last_id):
+    """Mark the chunk's pending bills past their due date overdue, a batch at a time."""
+    while True:
+        with transaction.atomic():
+            bills = _mark_overdue(CHUNK_CANDIDATES, [today, first_id, last_id, settings.DUE_NOTIFICATIONS_BATCH_SIZE])
+        if not bills:
+            return
+        yield bills
+
+
+def _mark_overdue(candidates, params):
+    """Flip the `candidates` query's bills to overdue and audit it; call it in a transaction."""
+    if not params[-1]:
+        return []
+    bill_table = connection.ops.quote_name(Bill._meta.db_table)
+    sql = OVERDUE_SQL.format(
+        bill=bill_table,
+        user=connection.ops.quote_name(User._meta.db_table),
+        candidates=candidates.format(bill=bill_table),
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [timezone.now()] + params)
+        rows = cursor.fetchall()
+    bills = [
+        Bill(id=bill_id, status='overdue', customer=User(id=customer_id, email=email))
+        for bill_id, customer_id, email in rows
+    ]
+    bulk_log(bills, LogEntry.Action.UPDATE, changes={'status': ['pending', 'overdue']})
+    return bills
+
+
+def _reminded_bills(today, offset):
+    """Bills due `offset` days before `today` whose biller reminds at that offset."""
+    return (
+        Bill.objects.filter(reminders.reminded_at(offset), status=reminders.bill_status(offset),
+                            due_date=today - timedelta(days=offset))
+        .select_related('customer')
+        .only('bill_number', 'amount', 'due_date', 'biller', *CUSTOMER_FIELDS)
+    )
+
+
+def _overdue_message(bill, offset):
+    return (
+        f"Overdue Bill #{bill.bill_number}",
+        f"Dear {bill.customer.first_name or 'Customer'},\n\n"
+        f"Your payment for bill #{bill.bill_number} (amount: {bill.amount} ETB) "
+        f"was due on {bill.due_date}. Please make the payment as soon as possible."
+    )
+
+
+def _upcoming_message(bill, offset):
+    when = {0: 'today', -1: 'tomorrow'}.get(offset, f'in {-offset} days')
+    return (
+        f"Reminder: Bill #{bill.bill_number} is due {when}!",
+        f"Dear {bill.customer.first_name or 'Customer'},\n\n"
+        f"Your bill #{bill.bill_number} for {bill.amount} ETB is due {when} ({bill.due_date})."
+    )
+
+
+def _claim_reminders(bills, offset):
+    """
+    Save a pending reminder per bill for the day `offset` days from its due
+    date, skipping those another run already claimed (Notification.objects.claim),
+    and queue the new ones in the outbox unless their biller wants digests.
+    """
+    notif_type = reminders.notification_type(offset)
+    compose = _upcoming_message if notif_type == 'upcoming_due' else _overdue_message
+    candidates = []
+    for bill in bills:
+        subject, message = compose(bill, offset)
+        candidates.append(Notification(
             bill=bill,
             customer=bill.customer,
             notification_type=notif_type,
+            reminder_period=bill.due_date + timedelta(days=offset),
             subject=subject,
             message=message,
-            sent_via='email',
-            status='sent',
-            sent_at=timezone.now(),
-        )
+            sent_via=channels.pick(bill.customer) or 'email',
+            status='pending',
+        ))
+    notifications = Notification.objects.claim(candidates)
+    if notifications:
+        search.update_search_vectors(Notification.objects.filter(pk__in=[n.pk for n in notifications]))
+        # digest billers' reminders wait for digests.package() at the end of the run
+        folded = digests.digest_billers(bills)
+        outbox.enqueue([n for n in notifications if n.bill.biller_id not in folded])
+    return notifications
 
-        # Send email
-        send_mail(
-            subject,
-            message,
-            settings.DEFAULT_FROM_EMAIL,
-            [bill.customer.email],
-            fail_silently=False,
-        )
 
-    except Exception as e:
-        Notification.objects.create(
+@shared_task
+def reschedule_reminders(biller_id):
+    """Recompute the schedule of a biller's open bills after its reminder policies changed."""
+    bills = (
+        Bill.objects.filter(biller=biller_id, status__in=reminders.OPEN_STATUSES)
+        .only('biller', 'due_date', 'status')
+        .order_by('pk')
+        .iterator(chunk_size=settings.DUE_NOTIFICATIONS_BATCH_SIZE)
+    )
+    count = 0
+    for batch in _batches(bills):
+        with transaction.atomic():
+            reminders.schedule_reminders(batch)
+        count += len(batch)
+    return count
+
+
+@shared_task
+def run_dunning(today=None):
+    """
+    Move the bills between dunning stages (bms.dunning) in one pass over the
+    book and queue a notice for each bill reaching a notice stage.
+    """
+    today = date.fromisoformat(today) if today else timezone.now().date()
+    stats = _measured(_run_dunning, today)
+    logger.info('run_dunning: %s', stats)
+    if stats['notified']:
+        drain_outbox.delay()
+    return stats
+
+
+def _run_dunning(today):
+    stats = {'moved': 0, 'notified': 0, 'flagged': 0, 'cleared': 0}
+    with transaction.atomic():
+        transitions = dunning.advance(today)
+        stages = DunningStage.objects.in_bulk({t.stage_id for t in transitions if t.stage_id})
+        notices = []
+        for transition in transitions:
+            stage = stages.get(transition.stage_id)
+            if stage is None:
+                stats['cleared'] += 1
+            elif stage.action in dunning.NOTICE_ACTIONS:
+                notices.append((transition, stage))
+            else:
+                stats['flagged'] += 1
+        stats['notified'] = len(_claim_notices(today, notices))
+    stats['moved'] = len(transitions)
+    return stats
+
+
+def _notice_message(bill, transition, stage):
+    final = stage.action == 'final_notice'
+    return (
+        f"{'Final notice' if final else 'Payment reminder'}: Bill #{bill.bill_number} is "
+        f"{transition.days_past_due} days overdue",
+        f"Dear {bill.customer.first_name or 'Customer'},\n\n"
+        f"Your bill #{bill.bill_number} was due on {bill.due_date} and {transition.outstanding} ETB "
+        f"of it is still unpaid. "
+        + ("Please pay it now to avoid disconnection or collection." if final else "Please make the payment soon.")
+    )
+
+
+def _claim_notices(today, notices):
+    """Save and queue a dunning notice per (transition, stage), once per bill and day."""
+    bills = (
+        Bill.objects.select_related('customer')
+        .only('bill_number', 'due_date', *CUSTOMER_FIELDS)
+        .in_bulk([transition.bill_id for transition, _ in notices])
+    )
+    candidates = []
+    for transition, stage in notices:
+        bill = bills[transition.bill_id]
+        subject, message = _notice_message(bill, transition, stage)
+        candidates.append(Notification(
             bill=bill,
             customer=bill.customer,
-            notification_type=notif_type,
+            notification_type='dunning',
+            reminder_period=today,
             subject=subject,
             message=message,
-            sent_via='email',
-            status='failed',
-            error_message=str(e),
-        )
+            sent_via=channels.pick(bill.customer) or 'email',
+            status='pending',
+        ))
+    notifications = Notification.objects.claim(candidates)
+    if notifications:
+        search.update_search_vectors(Notification.objects.filter(pk__in=[n.pk for n in notifications]))
+        outbox.enqueue(notifications)
+    return notifications
+
+
+@shared_task
+def drain_outbox(provider=None):
+    """
+    Deliver `provider`'s due outbox messages; runs on the "outbox" queue's
+    sender workers. Without a provider, starts one drain per provider.
+    """
+    if provider is None:
+        for provider in settings.OUTBOX_PROVIDERS:
+            drain_outbox.delay(provider)
+        return None
+    stats = outbox.drain(provider, settings.OUTBOX_DRAIN_SECONDS)
+    logger.info('drain_outbox %s: %s', provider, stats)
+    return stats
+
+
+@shared_task(autoretry_for=(smtplib.SMTPException, OSError), max_retries=5, retry_backoff=True)
+def send_email(subject, message, recipient_list, from_email=None, html_message=None):
+    """Send an account email (verification, password reset, contact form) outside the request."""
+    send_mail(subject, message, from_email or settings.EMAIL_HOST_USER, recipient_list, html_message=html_message)
+
+
+def send_email_on_commit(subject, message, recipient_list, **kwargs):
+    """Queue send_email once the current transaction commits, so a rolled back sign-up sends nothing."""
+    transaction.on_commit(partial(send_email.delay, subject, message, recipient_list, **kwargs))
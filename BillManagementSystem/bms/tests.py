@@ -1,3 +1,1291 @@
-from django.test import TestCase
+import csv
+import datetime
+import io
+import json
+import tracemalloc
+import unittest
+from unittest import mock
+from decimal import Decimal
+from auditlog.models import LogEntry
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Group, Permission
+from django.contrib.contenttypes.models import ContentType
+from django.core import mail, signing
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory
+
+import redis
+from aiohttp import web
+
+from . import channels, digests, dunning, outbox, permission_catalogue
+from .api import reports
+from .api.bill import BillListView
+from .api.custom_pagination import CustomPagination, HybridPagination
+from .api.filters import RankedSearchFilter
+from .api.notification import NotificationListView
+from .api.payment import PaymentListView
+from .delivery import record, write_back
+from .models import (
+    Bill, Biller, CustomerBiller, DunningEvent, DunningStage, Notification, OutboxMessage, Payment, PaymentBill,
+    ReminderPolicy, ScheduledReminder,
+)
+from .management.commands.fake_gateway import Gateway
+from .reminders import schedule_reminders
+from .serializers import BillSerializer, UserSerializer
+from .tasks import (
+    _chunk_bounds, _dispatch, _measured, _reminded_bills, _run_dunning, reschedule_reminders, send_due_notifications_chunk,
+    send_email,
+)
+
+User = get_user_model()
 
 # Create your tests here.
+
+
+@unittest.skipUnless(connection.vendor == 'postgresql', 'the database JSON engine needs PostgreSQL')
+class DatabaseJSONEngineTests(TestCase):
+    """The database engine must produce the serializer's response byte for byte."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser(email='admin@example.com', password='x')
+        biller_user = User.objects.create_user(email='biller@example.com', password='x', is_biller=True)
+        biller = Biller.objects.create(user=biller_user, name='Biller', company_name='Électricité "Co"')
+        customer = User.objects.create_user(email='customer@example.com', password='x', is_customer=True)
+
+        descriptions = [None, '', 'plain', 'quote " backslash \\ slash /', 'tab\tnewline\ncr\r\x01\x1f\x7f',
+                        'ünïcödé ✓ 😀', 'line\u2028para\u2029end']
+        stamps = [
+            datetime.datetime(2025, 1, 2, 3, 4, 5, tzinfo=datetime.timezone.utc),
+            datetime.datetime(2025, 1, 2, 3, 4, 5, 120000, tzinfo=datetime.timezone.utc),
+            datetime.datetime(1999, 12, 31, 23, 59, 59, 1, tzinfo=datetime.timezone.utc),
+        ]
+        for index, description in enumerate(descriptions):
+            bill = Bill.objects.create(
+                bill_number=f'B-{index}', biller=biller, customer=customer, amount=Decimal('10.5') * index,
+                due_date=datetime.date(2025, 1, 1) + datetime.timedelta(days=index), description=description,
+            )
+            Bill.objects.filter(pk=bill.pk).update(created_at=stamps[index % len(stamps)])
+            Payment.objects.create(
+                customer=customer, amount=Decimal('0.01') * index, payment_method='cash',
+                payment_date=stamps[index % len(stamps)], notes=description,
+                reference_number=None if index % 2 else f'R-{index}',
+            )
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def get_both(self, view, url):
+        view.json_engine = 'serializer'
+        try:
+            expected = self.client.get(url)
+        finally:
+            view.json_engine = 'database'
+        actual = self.client.get(url)
+        self.assertTrue(actual.streaming)
+        return expected.content, b''.join(actual.streaming_content)
+
+    def test_bills_match_serializer(self):
+        for query in ('', '?page_size=3', '?page_size=3&page=2', '?fields=id,amount,created_at', '?ordering=-amount'):
+            expected, actual = self.get_both(BillListView, '/api/get_bills' + query)
+            self.assertEqual(actual, expected, query)
+
+    def test_payments_match_serializer(self):
+        for query in ('', '?page_size=2&page=3', '?fields=id,notes,payment_date'):
+            expected, actual = self.get_both(PaymentListView, '/api/get_payments' + query)
+            self.assertEqual(actual, expected, query)
+
+    def test_expand_uses_serializer(self):
+        response = self.client.get('/api/get_bills?expand=biller')
+        self.assertFalse(response.streaming)
+
+
+class ExportTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser(email='admin@example.com', password='x')
+        billers = [
+            Biller.objects.create(
+                user=User.objects.create_user(email=f'biller{index}@example.com', password='x', is_biller=True),
+                name=f'Biller {index}',
+            )
+            for index in range(2)
+        ]
+        customer = User.objects.create_user(email='customer@example.com', password='x', is_customer=True)
+        cls.descriptions = ['comma, here', 'say "hi"', 'two\nlines', 'plain']
+        for index, description in enumerate(cls.descriptions):
+            for biller in billers:
+                Bill.objects.create(
+                    bill_number=f'{biller.pk}-{index}', biller=biller, customer=customer, amount=Decimal('5.00'),
+                    due_date=datetime.date(2025, 1, 1), description=description,
+                    status='paid' if index % 2 else 'pending',
+                )
+        cls.biller = billers[0]
+        cls.biller.user.user_permissions.add(Permission.objects.get(codename='view_bill'))
+
+    def export(self, user, url):
+        client = APIClient()
+        client.force_authenticate(User.objects.get(pk=user.pk))
+        response = client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content).decode()
+
+    def test_csv_escapes_values(self):
+        content = self.export(self.admin, '/api/export_bills/csv?fields=bill_number,description&biller__user__id='
+                                          f'{self.biller.user_id}&ordering=id')
+        self.assertIn('"comma, here"', content)
+        self.assertIn('"say ""hi"""', content)
+        self.assertIn('"two\nlines"', content)
+        rows = list(csv.reader(io.StringIO(content)))
+        self.assertEqual(rows[0], ['bill_number', 'description'])
+        self.assertEqual(rows[1:], [[f'{self.biller.pk}-{index}', description]
+                                    for index, description in enumerate(self.descriptions)])
+
+    def test_ndjson_keeps_the_views_scoping_and_filters(self):
+        content = self.export(self.biller.user, '/api/export_bills/ndjson?fields=bill_number,biller&status=pending'
+                                                '&ordering=-id')
+        rows = [json.loads(line) for line in content.splitlines()]
+        self.assertEqual(rows, [{'bill_number': f'{self.biller.pk}-{index}', 'biller': self.biller.pk}
+                                for index in (2, 0)])
+
+    def test_unknown_format(self):
+        client = APIClient()
+        client.force_authenticate(self.admin)
+        self.assertEqual(client.get('/api/export_bills/xlsx').status_code, 404)
+
+
+@override_settings(REPRESENTATION_CACHE_ENABLED=False, IDENTITY_MAP_DEBUG_HEADER=True)
+class EagerLoadingTests(TestCase):
+    """List endpoints run the same queries for a page of 2 rows as for a page of 5."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser(email='admin@example.com', password='x')
+        billers = [
+            Biller.objects.create(
+                user=User.objects.create_user(email=f'biller{index}@example.com', password='x', is_biller=True),
+                name=f'Biller {index}',
+            )
+            for index in range(6)
+        ]
+        customers = [
+            User.objects.create_user(email=f'customer{index}@example.com', password='x', is_customer=True)
+            for index in range(6)
+        ]
+        for index in range(12):
+            biller, customer = billers[index % len(billers)], customers[index % 5]
+            CustomerBiller.objects.create(user=customer, biller=biller)
+            bill = Bill.objects.create(
+                bill_number=f'B-{index}', biller=biller, customer=customer, amount=Decimal('5.00'),
+                due_date=datetime.date(2025, 1, 1), description='-',
+            )
+            payment = Payment.objects.create(customer=customer, amount=bill.amount, payment_method='cash',
+                                             payment_date=timezone.now())
+            PaymentBill.objects.create(payment=payment, bill=bill, amount_applied=bill.amount)
+            Notification.objects.create(bill=bill, customer=customer, notification_type='general', subject='-',
+                                        message='-')
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def get(self, url, **params):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url, params)
+            content = b''.join(response.streaming_content) if response.streaming else response.content
+        self.assertEqual(response.status_code, 200)
+        return response, json.loads(content)['data'], context.captured_queries
+
+    def test_query_count_does_not_grow_with_the_page(self):
+        for url, params in [
+            ('/api/get_bills', {}),
+            ('/api/get_bills', {'expand': 'biller.user,customer'}),
+            ('/api/get_payments', {'expand': 'customer,payment_bills.bill.biller'}),
+            ('/api/get_notifications', {'expand': 'bill.biller,customer'}),
+            ('/api/get_billers', {'expand': 'user'}),
+            ('/api/get_customer_billers', {'expand': 'user,biller.user'}),
+            ('/api/get_users', {}),
+        ]:
+            # permission catalogue and the like are cached on first use
+            self.get(url, **params)
+            _, small, small_queries = self.get(url, page_size=2, **params)
+            _, large, large_queries = self.get(url, page_size=5, **params)
+            self.assertEqual((len(small), len(large)), (2, 5), url)
+            self.assertEqual(len(small_queries), len(large_queries), f'{url} {params}')
+
+    def test_fields_and_expand(self):
+        _, rows, queries = self.get('/api/get_bills', fields='id,biller.name', expand='biller', page_size=2)
+        self.assertEqual(rows, [{'id': bill.pk, 'biller': {'name': bill.biller.name}}
+                                for bill in Bill.objects.order_by('id')[:2]])
+        bill_query = next(query['sql'] for query in queries if 'FROM "bms_bill"' in query['sql']
+                          and 'COUNT' not in query['sql'])
+        self.assertNotIn('"bms_bill"."description"', bill_query)
+
+        _, rows, _ = self.get('/api/get_bills', fields='id,biller', page_size=2)
+        self.assertEqual(rows[0], {'id': rows[0]['id'], 'biller': Bill.objects.get(pk=rows[0]['id']).biller_id})
+
+    def test_identity_map_loads_shared_rows_once(self):
+        # each payment's customer is also its bill's customer
+        response, rows, queries = self.get('/api/get_payments', expand='customer,payment_bills.bill.customer',
+                                           page_size=5)
+        self.assertEqual(rows[0]['customer'], rows[0]['payment_bills'][0]['bill']['customer'])
+        self.assertEqual(len([query for query in queries if 'FROM "bms_customuser"' in query['sql']]), 1)
+        self.assertGreater(int(response['X-Identity-Map-Hits']), 0)
+
+        with override_settings(IDENTITY_MAP_DEBUG_HEADER=False):
+            response, _, _ = self.get('/api/get_payments', expand='customer', page_size=5)
+        self.assertNotIn('X-Identity-Map-Hits', response)
+
+
+@unittest.skipUnless(connection.vendor == 'postgresql', 'query plans are checked on PostgreSQL')
+class QueryPlanTests(TestCase):
+    """
+    EXPLAIN every statement of the hot paths against a seeded dataset.
+
+    Sequential scans are disabled for the test, so one still showing up in a
+    plan means no index can serve that query.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        today = timezone.now().date()
+        billers = [
+            Biller.objects.create(
+                user=User.objects.create_user(email=f'biller{index}@example.com', password='x', is_biller=True),
+                name=f'Biller {index}',
+            )
+            for index in range(3)
+        ]
+        customers = []
+        for index in range(20):
+            customer = User.objects.create_user(email=f'customer{index}@example.com', password='x', is_customer=True)
+            CustomerBiller.objects.create(user=customer, biller=billers[index % len(billers)])
+            customers.append(customer)
+        # enough customers on one biller that the typeahead narrows by name before it narrows by biller
+        members = User.objects.bulk_create([
+            User(email=f'member{index}@example.com', password='!', first_name=f'Member{index}', last_name='Member',
+                 phone_number=f'+251 911 {index:06d}', is_customer=True)
+            for index in range(2000)
+        ])
+        CustomerBiller.objects.bulk_create([CustomerBiller(user=member, biller=billers[0]) for member in members])
+
+        statuses = ['paid'] * 8 + ['pending', 'overdue']
+        bills = Bill.objects.bulk_create([
+            Bill(
+                bill_number=f'B-{index}', biller=billers[index % len(billers)], customer=customers[index % len(customers)],
+                amount=Decimal('25.00'), due_date=today + datetime.timedelta(days=index % 30 - 15),
+                status=statuses[index % len(statuses)],
+            )
+            for index in range(600)
+        ])
+        payments = Payment.objects.bulk_create([
+            Payment(customer=bill.customer, amount=bill.amount, payment_method='cash',
+                    payment_date=timezone.now() - datetime.timedelta(days=index))
+            for index, bill in enumerate(bills) if bill.status == 'paid'
+        ])
+        paid = [bill for bill in bills if bill.status == 'paid']
+        PaymentBill.objects.bulk_create([
+            PaymentBill(payment=payment, bill=bill, amount_applied=bill.amount) for payment, bill in zip(payments, paid)
+        ])
+        Notification.objects.bulk_create([
+            Notification(bill=bill, customer=bill.customer, notification_type='upcoming_due', subject='Reminder', message='-')
+            for bill in bills[::5]
+        ])
+        schedule_reminders(bills)
+        cls.biller = billers[0]
+        cls.customer = customers[0]
+
+        with connection.cursor() as cursor:
+            for model in (User, Biller, CustomerBiller, Bill, Payment, PaymentBill, Notification, ScheduledReminder):
+                cursor.execute(f'ANALYZE {model._meta.db_table}')
+
+    def explain(self, run):
+        """The plans of the statements `run()` reads or updates with."""
+        with CaptureQueriesContext(connection) as context:
+            run()
+        plans = []
+        with connection.cursor() as cursor:
+            cursor.execute('SET LOCAL enable_seqscan = off')
+            for query in context.captured_queries:
+                sql = query['sql']
+                if not sql.lstrip().upper().startswith(('SELECT', 'UPDATE', 'DELETE', 'WITH')):
+                    continue
+                cursor.execute('EXPLAIN ' + sql)
+                plans.append((sql, '\n'.join(row[0] for row in cursor.fetchall())))
+        return plans
+
+    def assertIndexed(self, run, *index_names):
+        plans = self.explain(run)
+        self.assertTrue(plans)
+        for sql, plan in plans:
+            self.assertNotIn('Seq Scan', plan, f'{sql}\n{plan}')
+        used = '\n'.join(plan for _, plan in plans)
+        for name in index_names:
+            self.assertIn(name, used, used)
+
+    def test_send_due_notifications(self):
+        today = timezone.now().date()
+        self.assertIndexed(lambda: _chunk_bounds(today), 'bill_pending_due_idx')
+        self.assertIndexed(lambda: send_due_notifications_chunk(today.isoformat(), None, None),
+                           'bill_pending_due_idx')
+        self.assertIndexed(lambda: list(_reminded_bills(today, 1)), 'bill_overdue_due_idx')
+
+    def test_dispatch_due_reminders(self):
+        self.assertIndexed(_dispatch, 'scheduled_reminder_run_at_idx')
+
+    def test_package_digests(self):
+        self.assertIndexed(digests.package, 'notification_undigested_idx')
+
+    def test_dunning(self):
+        self.assertIndexed(lambda: dunning.advance(timezone.now().date()), 'bill_dunning_idx')
+
+    def test_customer_reports(self):
+        self.assertIndexed(lambda: reports.outstanding_payments(self.customer), 'bill_customer_open_idx')
+        self.assertIndexed(lambda: list(reports.monthly_spending(self.customer)), 'payment_customer_date_idx')
+        self.assertIndexed(lambda: reports.total_spending(self.customer))
+        self.assertIndexed(lambda: list(reports.spending_by_biller(self.customer)))
+
+    def test_biller_reports(self):
+        self.assertIndexed(lambda: reports.biller_outstanding_invoices(self.biller), 'bill_biller_open_idx')
+        self.assertIndexed(lambda: reports.biller_customer_statistics(self.biller), 'bill_customer_open_idx')
+        self.assertIndexed(lambda: reports.biller_total_revenue(self.biller))
+        self.assertIndexed(lambda: list(reports.biller_monthly_revenue(self.biller)))
+
+    def test_customer_typeahead(self):
+        client = APIClient()
+        client.force_authenticate(self.biller.user)
+        # limit=1 is met by the prefix matches, so the trigram fallback does not run
+        self.assertIndexed(lambda: client.get('/api/customer_typeahead?q=customer1&limit=1'),
+                           'user_email_prefix_idx', 'user_first_name_prefix_idx', 'user_last_name_prefix_idx')
+        self.assertIndexed(lambda: client.get('/api/customer_typeahead?q=0911'), 'user_phone_digits_idx')
+
+
+class CustomerTypeaheadTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.billers = [
+            Biller.objects.create(
+                user=User.objects.create_user(email=f'biller{index}@example.com', password='x', is_biller=True),
+                name=f'Biller {index}',
+            )
+            for index in range(2)
+        ]
+        for biller, (first_name, last_name) in zip(cls.billers, [('Abebe', 'Kebede'), ('Abel', 'Tesfaye')]):
+            customer = User.objects.create_user(
+                email=f'{first_name.lower()}@example.com', password='x', is_customer=True,
+                first_name=first_name, last_name=last_name,
+            )
+            CustomerBiller.objects.create(user=customer, biller=biller)
+        cls.customer = customer
+
+    def typeahead(self, user, term):
+        client = APIClient()
+        client.force_authenticate(user)
+        return client.get('/api/customer_typeahead', {'q': term})
+
+    def test_billers_see_only_their_customers(self):
+        for biller, name in zip(self.billers, ['Abebe Kebede', 'Abel Tesfaye']):
+            response = self.typeahead(biller.user, 'abe')
+            self.assertEqual([customer['name'] for customer in response.data['data']], [name])
+            # the trigram fallback is scoped too
+            response = self.typeahead(biller.user, 'example')
+            self.assertEqual([customer['name'] for customer in response.data['data']], [name])
+        self.assertEqual(self.typeahead(self.customer, 'abe').status_code, 403)
+
+
+@unittest.skipUnless(connection.vendor == 'postgresql', 'search vectors need PostgreSQL')
+class SearchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.biller = Biller.objects.create(
+            user=User.objects.create_user(email='biller@example.com', password='x', is_biller=True), name='Northwind',
+        )
+        cls.customer = User.objects.create_user(
+            email='customer@example.com', password='x', is_customer=True, first_name='Abebe', last_name='Kebede',
+        )
+
+    def bill(self, bill_number, description=''):
+        return Bill.objects.create(
+            bill_number=bill_number, biller=self.biller, customer=self.customer, amount=Decimal('5.00'),
+            due_date=timezone.now().date(), description=description,
+        )
+
+    def search(self, view, text, **params):
+        request = Request(APIRequestFactory().get('/', {'search': text, **params}))
+        queryset = view.queryset.model.objects.all()
+        return list(RankedSearchFilter().filter_queryset(request, queryset, view).values_list('pk', flat=True))
+
+    def test_ranked_by_weight(self):
+        described = self.bill('B-1', description='water meter reading')
+        numbered = self.bill('WATER-2')
+        self.bill('B-3', description='electricity')
+        self.assertEqual(self.search(BillListView(), 'water'), [numbered.pk, described.pk])
+        self.assertEqual(self.search(BillListView(), 'water', ordering='-id'), [described.pk, numbered.pk])
+
+    def test_words_match_as_prefixes(self):
+        bill = self.bill('B-1', description='monthly electricity usage')
+        self.assertEqual(self.search(BillListView(), 'electr month'), [bill.pk])
+        self.assertEqual(self.search(BillListView(), 'lectricity'), [])
+
+    def test_trigram_fields_match_substrings(self):
+        bill = self.bill('INV-77421')
+        self.assertEqual(self.search(BillListView(), '7742'), [bill.pk])
+        self.assertEqual(self.search(BillListView(), 'v-774'), [bill.pk])
+
+    def test_dependent_vectors_follow_renames(self):
+        bill = self.bill('B-1')
+        notification = Notification.objects.create(
+            bill=bill, customer=self.customer, notification_type='general', subject='Hello', message='-',
+        )
+        self.assertEqual(self.search(NotificationListView(), 'abebe'), [notification.pk])
+
+        self.biller.name = 'Southwind'
+        self.biller.save()
+        self.assertEqual(self.search(BillListView(), 'southwind'), [bill.pk])
+        self.assertEqual(self.search(BillListView(), 'northwind'), [])
+
+        bill.bill_number = 'ZX-9'
+        bill.save()
+        self.assertEqual(self.search(NotificationListView(), 'zx'), [notification.pk])
+
+        self.customer.first_name = 'Almaz'
+        self.customer.save()
+        self.assertEqual(self.search(NotificationListView(), 'almaz'), [notification.pk])
+        self.assertEqual(self.search(BillListView(), 'almaz'), [bill.pk])
+        self.assertEqual(self.search(NotificationListView(), 'abebe'), [])
+
+
+@unittest.skipUnless(connection.vendor == 'postgresql', 'claims use INSERT ... ON CONFLICT')
+class NotificationClaimTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        biller = Biller.objects.create(
+            user=User.objects.create_user(email='biller@example.com', password='x', is_biller=True), name='Biller',
+        )
+        customer = User.objects.create_user(email='customer@example.com', password='x', is_customer=True)
+        cls.bills = [
+            Bill.objects.create(bill_number=f'B-{index}', biller=biller, customer=customer, amount=Decimal('5.00'),
+                                due_date=datetime.date(2025, 1, 1))
+            for index in range(3)
+        ]
+
+    def reminders(self, bills, status='pending'):
+        return [
+            Notification(bill=bill, customer=bill.customer, notification_type='overdue', reminder_period=bill.due_date,
+                         subject='Overdue', message='-', status=status)
+            for bill in bills
+        ]
+
+    def test_claims_each_reminder_once(self):
+        claimed = Notification.objects.claim(self.reminders(self.bills[:2]))
+        self.assertEqual([n.bill_id for n in claimed], [bill.pk for bill in self.bills[:2]])
+        self.assertTrue(all(n.pk for n in claimed))
+
+        claimed = Notification.objects.claim(self.reminders(self.bills))
+        self.assertEqual([n.bill_id for n in claimed], [self.bills[2].pk])
+        self.assertEqual(Notification.objects.filter(notification_type='overdue').count(), 3)
+
+    def test_failed_reminder_can_be_claimed_again(self):
+        Notification.objects.claim(self.reminders(self.bills[:1], status='failed'))
+        self.assertEqual(len(Notification.objects.claim(self.reminders(self.bills[:1]))), 1)
+
+
+@unittest.skipUnless(connection.vendor == 'postgresql', 'the schedule is popped with FOR UPDATE SKIP LOCKED')
+class ReminderScheduleTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.biller = Biller.objects.create(
+            user=User.objects.create_user(email='biller@example.com', password='x', is_biller=True), name='Biller',
+        )
+        cls.customer = User.objects.create_user(email='customer@example.com', password='x', is_customer=True)
+
+    def create_bill(self, due_date):
+        return Bill.objects.create(bill_number=f'B-{Bill.objects.count()}', biller=self.biller, customer=self.customer,
+                                   amount=Decimal('5.00'), due_date=due_date)
+
+    def schedule(self, bill):
+        return dict(bill.scheduled_reminders.values_list('days_offset', 'run_at'))
+
+    def test_saving_a_bill_keeps_its_schedule(self):
+        bill = self.create_bill(datetime.date(2030, 1, 10))
+        self.assertEqual(self.schedule(bill), {
+            -1: datetime.datetime(2030, 1, 9, tzinfo=datetime.timezone.utc),
+            1: datetime.datetime(2030, 1, 11, tzinfo=datetime.timezone.utc),
+        })
+
+        bill.due_date = datetime.date(2030, 2, 1)
+        bill.save()
+        self.assertEqual(self.schedule(bill)[1], datetime.datetime(2030, 2, 2, tzinfo=datetime.timezone.utc))
+
+        bill.status = 'paid'
+        bill.save(update_fields=['status'])
+        self.assertEqual(self.schedule(bill), {})
+
+    def test_dispatch_pops_due_reminders(self):
+        bill = self.create_bill(timezone.now().date() - datetime.timedelta(days=1))
+        upcoming = self.create_bill(timezone.now().date() + datetime.timedelta(days=5))
+
+        self.assertEqual(_dispatch(), {'popped': 1, 'overdue': 1, 'queued': 1, 'digests': 0})
+        bill.refresh_from_db()
+        self.assertEqual(bill.status, 'overdue')
+        notification = Notification.objects.get(bill=bill, notification_type='overdue', status='pending')
+        self.assertTrue(OutboxMessage.objects.filter(notification=notification).exists())
+        self.assertEqual(self.schedule(bill), {})
+        self.assertEqual(len(self.schedule(upcoming)), 2)
+        self.assertEqual(_dispatch(), {'popped': 0, 'overdue': 0, 'queued': 0, 'digests': 0})
+
+    def test_sweep_marks_bills_overdue_once(self):
+        today = timezone.now().date()
+        late, later, paid, upcoming = Bill.objects.bulk_create([
+            Bill(bill_number=f'S-{index}', biller=self.biller, customer=self.customer, amount=Decimal('5.00'),
+                 status=status, due_date=today + datetime.timedelta(days=days))
+            for index, (status, days) in enumerate([('pending', -2), ('pending', -9), ('paid', -2), ('pending', 3)])
+        ])
+
+        stats = send_due_notifications_chunk(today.isoformat(), late.pk, late.pk)
+        self.assertEqual(stats['overdue'], 1)
+        self.assertIsInstance(stats['max_rss_kb'], int)
+        self.assertNotIn('peak_memory_kb', stats)
+        self.assertEqual(send_due_notifications_chunk(today.isoformat(), None, None)['overdue'], 1)
+        self.assertEqual(send_due_notifications_chunk(today.isoformat(), None, None)['overdue'], 0)
+
+        statuses = dict(Bill.objects.values_list('pk', 'status'))
+        self.assertEqual([statuses[bill.pk] for bill in (late, later, paid, upcoming)], ['overdue', 'overdue', 'paid', 'pending'])
+        entries = LogEntry.objects.filter(action=LogEntry.Action.UPDATE, content_type__model='bill').order_by('object_id')
+        self.assertEqual(
+            [(entry.object_id, entry.object_repr, entry.changes_dict) for entry in entries],
+            [(bill.pk, f'Bill #{bill.pk} - customer@example.com - overdue', {'status': ['pending', 'overdue']})
+             for bill in (late, later)],
+        )
+
+    @override_settings(TASK_TRACE_MEMORY=True)
+    def test_traced_peak_is_per_run(self):
+        large = _measured(lambda: {'size': len(bytearray(8 * 2 ** 20))})
+        small = _measured(lambda: {'size': len(bytearray(2 ** 10))})
+        self.assertGreaterEqual(large['peak_memory_kb'], 8 * 1024)
+        self.assertLess(small['peak_memory_kb'], 1024)
+        self.assertFalse(tracemalloc.is_tracing())
+
+    def test_billers_manage_only_their_policies(self):
+        other = Biller.objects.create(
+            user=User.objects.create_user(email='other@example.com', password='x', is_biller=True), name='Other',
+        )
+        theirs = ReminderPolicy.objects.create(biller=other, days_offset=-3)
+        self.biller.user.user_permissions.add(*Permission.objects.filter(
+            codename__in=['view_reminderpolicy', 'add_reminderpolicy', 'delete_reminderpolicy'],
+        ))
+        client = APIClient()
+        client.force_authenticate(User.objects.get(pk=self.biller.user.pk))
+
+        response = client.post('/api/post_reminder_policy', {'biller': other.pk, 'days_offset': 2}, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['biller'], self.biller.pk)
+        self.assertEqual(client.post('/api/post_reminder_policy', {'days_offset': 2}, format='json').status_code, 400)
+
+        listed = client.get('/api/get_reminder_policies').data['data']
+        self.assertEqual([(policy['biller'], policy['days_offset']) for policy in listed], [(self.biller.pk, 2)])
+        self.assertEqual(client.delete(f'/api/delete_reminder_policy/{theirs.pk}').status_code, 404)
+        self.assertTrue(ReminderPolicy.objects.filter(pk=theirs.pk).exists())
+
+    def test_biller_policies(self):
+        today = timezone.now().date()
+        bills = {offset: self.create_bill(today - datetime.timedelta(days=offset)) for offset in (-7, -3, -1, 5)}
+        with self.captureOnCommitCallbacks() as callbacks:
+            ReminderPolicy.objects.bulk_create([ReminderPolicy(biller=self.biller, days_offset=offset) for offset in (-7, -3)])
+            ReminderPolicy.objects.create(biller=self.biller, days_offset=5)
+        self.assertEqual(len(callbacks), 1)
+        reschedule_reminders(self.biller.pk)
+        self.assertEqual(sorted(self.schedule(bills[-7])), [-7, -3, 1, 5])
+        self.assertEqual(sorted(self.schedule(bills[-1])), [1, 5])
+
+        stats = send_due_notifications_chunk(today.isoformat(), None, None)
+        self.assertEqual((stats['overdue'], stats['queued']), (1, 3))
+        reminded = dict(Notification.objects.values_list('bill__due_date', 'subject'))
+        self.assertEqual(reminded, {
+            bills[-7].due_date: f'Reminder: Bill #{bills[-7].bill_number} is due in 7 days!',
+            bills[-3].due_date: f'Reminder: Bill #{bills[-3].bill_number} is due in 3 days!',
+            bills[5].due_date: f'Overdue Bill #{bills[5].bill_number}',
+        })
+
+
+class AccountEmailTests(TestCase):
+
+    def test_sign_up_sends_verification_after_commit(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            response = APIClient().post('/api/sign_up', {'email': 'new@example.com', 'password': 'x', 'first_name': 'New'},
+                                        format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(mail.outbox, [])
+        self.assertEqual(len(callbacks), 1)
+
+        queued = callbacks[0]
+        send_email(*queued.args, **queued.keywords)
+        self.assertEqual(mail.outbox[0].to, ['new@example.com'])
+        self.assertIn('/api/verify-email/', mail.outbox[0].body)
+
+    @override_settings(METRICS_TOKEN='scrape')
+    def test_latency_is_exported(self):
+        APIClient().post('/api/send_password_reset_email', {}, format='json')
+        response = self.client.get('/api/metrics', HTTP_AUTHORIZATION='Bearer scrape')
+        self.assertContains(response, 'bms_request_latency_seconds_count{method="POST",view="send_password_reset_email"}')
+
+    def test_metrics_need_the_token(self):
+        self.assertEqual(self.client.get('/api/metrics').status_code, 403)
+        with override_settings(METRICS_TOKEN='scrape'):
+            self.assertEqual(self.client.get('/api/metrics').status_code, 403)
+            self.assertEqual(self.client.get('/api/metrics', HTTP_AUTHORIZATION='Bearer guess').status_code, 403)
+
+
+CHANNEL_SETTINGS = {
+    'TWILIO_ACCOUNT_SID': 'AC1',
+    'CHANNEL_GATEWAYS': {'sms': {'from': '+15550100', 'concurrency': 2}, 'whatsapp': {'from': '+15550101', 'concurrency': 2}},
+    'OUTBOX_PROVIDERS': {provider: {'rate': 10, 'burst': 10} for provider in ('email', 'sms', 'whatsapp')},
+}
+
+
+@override_settings(**CHANNEL_SETTINGS)
+class ChannelTests(TestCase):
+
+    def setUp(self):
+        self.gateway = Gateway()
+        loop = channels.get_loop()
+        self.runner = web.AppRunner(self.gateway.app())
+        loop.run_until_complete(self.runner.setup())
+        site = web.TCPSite(self.runner, '127.0.0.1', 0)
+        loop.run_until_complete(site.start())
+        port = self.runner.addresses[0][1]
+        self.enterContext(override_settings(TWILIO_API_URL=f'http://127.0.0.1:{port}'))
+
+    def tearDown(self):
+        channels.close()
+        channels.get_loop().run_until_complete(self.runner.cleanup())
+
+    def test_picks_first_reachable_channel(self):
+        customer = User(email='c@example.com', phone_number='+251911000000', notification_channels=['whatsapp', 'sms'])
+        self.assertEqual(channels.pick(customer), 'whatsapp')
+        self.assertEqual(channels.pick(customer, after='whatsapp'), 'sms')
+        self.assertIsNone(channels.pick(customer, after='sms'))
+        customer.phone_number = None
+        self.assertIsNone(channels.pick(customer))
+        self.assertEqual(channels.pick(User(email='c@example.com', notification_channels=[])), 'email')
+
+    def test_delivers_concurrently_and_reports_each_outcome(self):
+        notifications = [
+            Notification(customer=User(phone_number=phone), subject='-', message=f'Message {index}')
+            for index, phone in enumerate(['+251911000001', '+251911000002', 'not a number', None, '+251911000003'])
+        ]
+        channels.deliver('whatsapp', notifications)
+
+        self.assertEqual([n.status for n in notifications], ['sent', 'sent', 'failed', 'failed', 'sent'])
+        self.assertIn('400', notifications[2].error_message)
+        self.assertEqual(notifications[3].error_message, 'no phone number')
+        self.assertEqual(sorted(message['To'] for message in self.gateway.received),
+                         ['whatsapp:+251911000001', 'whatsapp:+251911000002', 'whatsapp:+251911000003'])
+        self.assertEqual({message['From'] for message in self.gateway.received}, {'whatsapp:+15550101'})
+        self.assertLessEqual(len(self.gateway.connections), 2)
+
+    def test_message_out_of_attempts_moves_to_next_channel(self):
+        customer = User.objects.create_user(email='customer@example.com', password='x', phone_number='+251911000000',
+                                            notification_channels=['sms', 'email'])
+        biller = Biller.objects.create(
+            user=User.objects.create_user(email='biller@example.com', password='x', is_biller=True), name='Biller',
+        )
+        bill = Bill.objects.create(bill_number='B-1', biller=biller, customer=customer, amount=Decimal('5.00'),
+                                   due_date=datetime.date(2025, 1, 1))
+        notification = Notification.objects.create(bill=bill, customer=customer, notification_type='overdue',
+                                                   subject='-', message='-', sent_via='sms', status='pending')
+        message = OutboxMessage.objects.create(notification=notification, provider='sms', attempts=5)
+
+        stats = {'sent': 0, 'retried': 0, 'moved': 0, 'dead': 0}
+        with self.settings(OUTBOX_MAX_ATTEMPTS=6):
+            outbox._send([message], lambda notifications: record(notifications, ['503']), stats)
+        self.assertEqual(stats['moved'], 1)
+        message.refresh_from_db()
+        notification.refresh_from_db()
+        self.assertEqual((message.provider, message.status, message.attempts), ('email', 'pending', 0))
+        self.assertEqual((notification.sent_via, notification.status), ('email', 'pending'))
+
+
+def redis_reachable():
+    try:
+        return outbox.get_redis().ping()
+    except redis.exceptions.ConnectionError:
+        return False
+
+
+OUTBOX_SETTINGS = {
+    'OUTBOX_PROVIDERS': {'email': {'rate': 100, 'burst': 100}},
+    'OUTBOX_BATCH_SIZE': 1,
+    'OUTBOX_MAX_ATTEMPTS': 3,
+    'OUTBOX_BACKOFF_BASE': 30,
+    'OUTBOX_BACKOFF_MAX': 100,
+    'OUTBOX_BREAKER_THRESHOLD': 2,
+    'OUTBOX_BREAKER_COOLDOWN': 60,
+}
+
+
+@unittest.skipUnless(connection.vendor == 'postgresql' and redis_reachable(), 'the outbox needs PostgreSQL and Redis')
+@override_settings(**OUTBOX_SETTINGS)
+class OutboxTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        biller = Biller.objects.create(
+            user=User.objects.create_user(email='biller@example.com', password='x', is_biller=True), name='Biller',
+        )
+        cls.customer = User.objects.create_user(email='customer@example.com', password='x', notification_channels=['email'])
+        cls.bill = Bill.objects.create(bill_number='O-1', biller=biller, customer=cls.customer, amount=Decimal('5.00'),
+                                       due_date=datetime.date(2025, 1, 1))
+
+    def setUp(self):
+        client = outbox.get_redis()
+        client.delete(*client.keys('outbox:*:email*') or ['-'])
+
+    def queue(self, count, attempts=0):
+        notifications = [
+            Notification.objects.create(bill=self.bill, customer=self.customer, notification_type='general',
+                                        subject=f'Message {index}', message='-', status='pending')
+            for index in range(count)
+        ]
+        return [OutboxMessage.objects.create(notification=notification, attempts=attempts) for notification in notifications]
+
+    def drain(self, *errors, seconds=1):
+        """Drain with a sender failing batch n with errors[n] (None: sent), sending whatever is left."""
+        depth = len(connection.atomic_blocks)
+        self.sent = []
+
+        def send(notifications):
+            # the provider is called outside the claim transaction, with the batch leased
+            self.assertEqual(len(connection.atomic_blocks), depth)
+            self.assertFalse(OutboxMessage.objects.filter(pk__in=[n.outbox.pk for n in notifications],
+                                                          next_attempt_at__lte=timezone.now()).exists())
+            error = errors[len(self.sent)] if len(self.sent) < len(errors) else None
+            self.sent.append([notification.subject for notification in notifications])
+            record(notifications, [error] * len(notifications))
+
+        with mock.patch.dict(outbox.SENDERS, {'email': send}):
+            return outbox.drain('email', seconds)
+
+    def test_backoff_schedule(self):
+        with mock.patch('bms.outbox.random.uniform', side_effect=lambda low, high: high):
+            self.assertEqual([outbox.backoff(attempts).total_seconds() for attempts in range(1, 6)], [30, 60, 100, 100, 100])
+        for attempts in range(1, 6):
+            delay = min(100, 30 * 2 ** (attempts - 1))
+            self.assertTrue(delay / 2 <= outbox.backoff(attempts).total_seconds() <= delay)
+
+    def test_retries_then_dead_letters(self):
+        message, = self.queue(1)
+        started = timezone.now()
+        stats = self.drain('503')
+        self.assertEqual((stats['sent'], stats['retried'], stats['dead']), (0, 1, 0))
+        message.refresh_from_db()
+        self.assertEqual((message.status, message.attempts, message.last_error), ('pending', 1, '503'))
+        self.assertTrue(started + datetime.timedelta(seconds=15) <= message.next_attempt_at
+                        <= timezone.now() + datetime.timedelta(seconds=30))
+        self.assertEqual(Notification.objects.get(pk=message.notification_id).status, 'pending')
+
+        # the last attempt fails too and no other channel is left
+        OutboxMessage.objects.filter(pk=message.pk).update(attempts=2, next_attempt_at=timezone.now())
+        stats = self.drain('503')
+        self.assertEqual(stats['dead'], 1)
+        message.refresh_from_db()
+        self.assertEqual((message.status, message.attempts), ('dead', 3))
+        self.assertEqual(Notification.objects.get(pk=message.notification_id).status, 'failed')
+
+    def test_breaker_opens_after_failed_batches_and_probes(self):
+        self.queue(4)
+        stats = self.drain('503', '503')
+        self.assertTrue(stats['breaker_open'])
+        self.assertEqual(self.sent, [['Message 0'], ['Message 1']])
+        self.assertEqual(self.drain()['sent'], 0)
+
+        # after the cooldown one message probes; it goes through and the breaker closes
+        outbox.get_redis().delete('outbox:breaker:email:open')
+        self.assertTrue(outbox.CircuitBreaker('email').is_probing())
+        stats = self.drain()
+        self.assertEqual((stats['sent'], stats['breaker_open']), (2, False))
+        self.assertFalse(outbox.CircuitBreaker('email').is_probing())
+
+    @override_settings(OUTBOX_PROVIDERS={'email': {'rate': 2, 'burst': 2}}, OUTBOX_BATCH_SIZE=5)
+    def test_token_bucket_caps_the_rate(self):
+        self.assertEqual(outbox.TokenBucket('email').take(5), 2)
+        self.assertEqual(outbox.TokenBucket('email').take(1), 0)
+
+        outbox.get_redis().delete('outbox:bucket:email')
+        self.queue(5)
+        stats = self.drain(seconds=0.3)
+        self.assertEqual(stats['sent'], 2)
+        self.assertEqual(OutboxMessage.objects.filter(status='pending').count(), 3)
+
+
+@unittest.skipUnless(connection.vendor == 'postgresql', 'claims use INSERT ... ON CONFLICT')
+class DigestTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.customer = User.objects.create_user(email='customer@example.com', password='x', first_name='Abebe')
+        cls.other = User.objects.create_user(email='other@example.com', password='x')
+        billers = [
+            Biller.objects.create(
+                user=User.objects.create_user(email=f'biller{index}@example.com', password='x', is_biller=True),
+                name=name, digest_reminders=digest,
+            )
+            for index, (name, digest) in enumerate([('Water', True), ('Power', True), ('Telecom', False)])
+        ]
+        due_date = timezone.now().date() - datetime.timedelta(days=1)
+        for index, (biller, customer) in enumerate([
+            (billers[0], cls.customer), (billers[1], cls.customer), (billers[1], cls.customer),
+            (billers[2], cls.customer), (billers[0], cls.other),
+        ]):
+            bill = Bill.objects.create(bill_number=f'B-{index}', biller=biller, customer=customer,
+                                       amount=Decimal('10.00'), due_date=due_date)
+            # left to the sweep
+            bill.scheduled_reminders.all().delete()
+
+    def test_one_message_per_customer(self):
+        stats = send_due_notifications_chunk(timezone.now().date().isoformat(), None, None)
+        self.assertEqual(stats['queued'], 5)
+        self.assertEqual(digests.package(), 2)
+
+        queued = Notification.objects.filter(outbox__isnull=False)
+        self.assertEqual(queued.count(), 3)
+        digest = queued.get(customer=self.customer, bill__biller__name__in=['Water', 'Power'])
+        self.assertEqual(digest.subject, '3 overdue bills')
+        self.assertIn('Total: 30.00 ETB', digest.message)
+        self.assertEqual(digest.covered.count(), 3)
+        telecom = queued.get(customer=self.customer, bill__biller__name='Telecom')
+        self.assertIsNone(telecom.digest_id)
+        single = queued.get(customer=self.other)
+        self.assertEqual(single.digest_id, single.pk)
+        self.assertEqual(single.subject, 'Overdue Bill #B-4')
+
+        digest.status = 'sent'
+        write_back([digest])
+        self.assertEqual(set(digest.covered.values_list('status', flat=True)), {'sent'})
+        self.assertEqual(digests.package(), 0)
+
+
+@unittest.skipUnless(connection.vendor == 'postgresql', 'dunning runs one PostgreSQL statement')
+class DunningTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        DunningStage.objects.all().delete()
+        cls.reminder, cls.final, cls.collections = DunningStage.objects.bulk_create([
+            DunningStage(name='Reminder', action='reminder', days_past_due=3),
+            DunningStage(name='Final notice', action='final_notice', days_past_due=10),
+            DunningStage(name='Collections', action='collections', days_past_due=10, min_outstanding=Decimal('50.00')),
+        ])
+        biller = Biller.objects.create(
+            user=User.objects.create_user(email='biller@example.com', password='x', is_biller=True), name='Biller',
+        )
+        cls.customer = User.objects.create_user(email='customer@example.com', password='x', first_name='Abebe')
+        today = timezone.now().date()
+        cls.bills = Bill.objects.bulk_create([
+            Bill(bill_number=f'B-{index}', biller=biller, customer=cls.customer, amount=amount, status=status,
+                 due_date=today - datetime.timedelta(days=days))
+            for index, (amount, status, days) in enumerate([
+                (Decimal('20.00'), 'overdue', 1), (Decimal('20.00'), 'overdue', 5), (Decimal('20.00'), 'overdue', 12),
+                (Decimal('80.00'), 'overdue', 12), (Decimal('80.00'), 'partially_paid', 12), (Decimal('80.00'), 'paid', 30),
+            ])
+        ])
+        payment = Payment.objects.create(customer=cls.customer, amount=Decimal('40.00'), payment_method='cash')
+        for _ in range(2):
+            PaymentBill.objects.create(payment=payment, bill=cls.bills[4], amount_applied=Decimal('20.00'))
+
+    def stages(self):
+        return list(Bill.objects.order_by('pk').values_list('dunning_stage', flat=True))
+
+    def test_moves_only_bills_whose_stage_changed(self):
+        today = timezone.now().date()
+        stats = _run_dunning(today)
+        self.assertEqual((stats['moved'], stats['notified'], stats['flagged']), (4, 3, 1))
+        r, f, c = self.reminder.pk, self.final.pk, self.collections.pk
+        self.assertEqual(self.stages(), [None, r, f, c, f, None])
+        # a moved bill's cached representation is keyed on updated_at
+        moved = Bill.objects.get(pk=self.bills[1].pk)
+        self.assertEqual(moved.updated_at, moved.dunning_stage_at)
+        notice = Notification.objects.get(bill=self.bills[4])
+        self.assertEqual(notice.subject, 'Final notice: Bill #B-4 is 12 days overdue')
+        self.assertIn('40.00 ETB', notice.message)
+        self.assertTrue(OutboxMessage.objects.filter(notification=notice).exists())
+
+        self.assertEqual(_run_dunning(today)['moved'], 0)
+        self.assertEqual(DunningEvent.objects.count(), 4)
+
+        Bill.objects.filter(pk=self.bills[3].pk).update(status='paid')
+        stats = _run_dunning(today + datetime.timedelta(days=5))
+        self.assertEqual((stats['moved'], stats['cleared']), (3, 1))
+        self.assertEqual(self.stages(), [r, f, f, None, f, None])
+        self.assertEqual(
+            DunningEvent.objects.get(bill=self.bills[3], stage=None).previous_stage_id, self.collections.pk,
+        )
+
+
+class PaidAmountTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        biller = Biller.objects.create(
+            user=User.objects.create_user(email='biller@example.com', password='x', is_biller=True), name='Biller',
+        )
+        cls.customer = User.objects.create_user(email='customer@example.com', password='x')
+        due_date = timezone.now().date() + datetime.timedelta(days=10)
+        cls.bill, cls.other = [
+            Bill.objects.create(bill_number=f'B-{index}', biller=biller, customer=cls.customer,
+                                amount=Decimal('100.00'), due_date=due_date)
+            for index in range(2)
+        ]
+        cls.payment = Payment.objects.create(customer=cls.customer, amount=Decimal('100.00'), payment_method='cash')
+
+    def paid(self, bill):
+        bill.refresh_from_db()
+        return bill.paid_amount, bill.balance, bill.status
+
+    def status_changes(self, bill):
+        entries = LogEntry.objects.get_for_object(bill).filter(action=LogEntry.Action.UPDATE).order_by('pk')
+        return [entry.changes_dict['status'] for entry in entries if 'status' in entry.changes_dict]
+
+    def test_allocations_move_paid_amount(self):
+        allocation = PaymentBill.objects.create(payment=self.payment, bill=self.bill, amount_applied=Decimal('40.00'))
+        self.assertEqual(self.paid(self.bill), (Decimal('40.00'), Decimal('60.00'), 'partially_paid'))
+        self.assertEqual(allocation.bill.status, 'partially_paid')
+
+        allocation.amount_applied = Decimal('100.00')
+        allocation.save()
+        self.assertEqual(self.paid(self.bill), (Decimal('100.00'), Decimal('0.00'), 'paid'))
+
+        allocation.bill = self.other
+        allocation.save()
+        self.assertEqual(self.paid(self.bill), (Decimal('0.00'), Decimal('100.00'), 'pending'))
+        self.assertEqual(self.paid(self.other), (Decimal('100.00'), Decimal('0.00'), 'paid'))
+
+        self.payment.delete()
+        self.assertEqual(self.paid(self.other), (Decimal('0.00'), Decimal('100.00'), 'pending'))
+        self.assertEqual(self.status_changes(self.bill), [
+            ['pending', 'partially_paid'], ['partially_paid', 'paid'], ['paid', 'pending'],
+        ])
+        self.assertEqual(self.status_changes(self.other), [['pending', 'paid'], ['paid', 'pending']])
+
+    def test_stale_bill_keeps_paid_amount(self):
+        stale = Bill.objects.get(pk=self.bill.pk)
+        PaymentBill.objects.create(payment=self.payment, bill=self.bill, amount_applied=Decimal('30.00'))
+        stale.description = 'edited'
+        stale.save()
+        self.assertEqual(self.paid(self.bill)[0], Decimal('30.00'))
+        self.assertEqual(self.paid(self.bill)[2], 'partially_paid')
+        self.assertEqual(stale.status, 'partially_paid')
+
+    def test_lowering_amount_derives_status(self):
+        PaymentBill.objects.create(payment=self.payment, bill=self.bill, amount_applied=Decimal('30.00'))
+        bill = Bill.objects.get(pk=self.bill.pk)
+        bill.amount = Decimal('20.00')
+        bill.save()
+        self.assertEqual(bill.status, 'paid')
+        self.assertEqual(self.paid(self.bill)[2], 'paid')
+
+    def test_repair(self):
+        PaymentBill.objects.bulk_create([PaymentBill(payment=self.payment, bill=self.bill, amount_applied=Decimal('100.00'))])
+        before = Bill.objects.get(pk=self.bill.pk).updated_at
+        out = io.StringIO()
+        call_command('repair_paid_amounts', stdout=out)
+        self.assertEqual(out.getvalue().strip(), '1 bills repaired')
+        self.assertEqual(self.paid(self.bill), (Decimal('100.00'), Decimal('0.00'), 'paid'))
+        self.assertGreater(self.bill.updated_at, before)
+        self.assertEqual(self.status_changes(self.bill), [['pending', 'paid']])
+        self.assertEqual(self.paid(self.other)[0], Decimal('0.00'))
+
+    def test_bulk_payment_query_count_does_not_grow_with_bills(self):
+        bills = Bill.objects.bulk_create([
+            Bill(bill_number=f'S-{index}', biller=self.bill.biller, customer=self.customer, amount=Decimal('10.00'),
+                 due_date=self.bill.due_date)
+            for index in range(30)
+        ])
+        client = APIClient()
+        client.force_authenticate(self.customer)
+
+        def settle(settled, amount, payment_method='cash'):
+            return client.post('/api/post_payment_bulk', {
+                'payment_method': payment_method,
+                'allocations': [{'bill_id': bill.pk, 'amount_applied': amount} for bill in settled],
+            }, format='json')
+
+        with CaptureQueriesContext(connection) as few:
+            self.assertEqual(settle(bills[:2], '10.00').status_code, 201)
+        with CaptureQueriesContext(connection) as many:
+            response = settle(bills[2:], '0.10')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(many), len(few))
+
+        self.assertEqual(Payment.objects.get(pk=response.data['payment_id']).amount, Decimal('2.80'))
+        self.assertEqual(response.data['total_amount'], '2.80')
+        self.assertEqual({a['amount_applied'] for a in response.data['allocations']}, {'0.10'})
+        self.assertEqual({a['bill_status'] for a in response.data['allocations']}, {'partially_paid'})
+        self.assertEqual(self.paid(bills[0]), (Decimal('10.00'), Decimal('0.00'), 'paid'))
+        self.assertEqual(self.status_changes(bills[0]), [['pending', 'paid']])
+        self.assertEqual(self.status_changes(bills[2]), [['pending', 'partially_paid']])
+        self.assertEqual(self.paid(bills[2])[0], Decimal('0.10'))
+        self.assertEqual(settle([bills[0], Bill(pk=0)], '1.00').status_code, 400)
+        self.assertEqual(settle([bills[0]], '-1').status_code, 400)
+        self.assertEqual(settle([bills[0]], '0.001').status_code, 400)
+        self.assertEqual(settle([bills[0]], '1.00', payment_method='cheque').status_code, 400)
+
+
+@override_settings(PERMISSION_CATALOGUE_CHECK_INTERVAL=0)
+class PermissionCatalogueTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(email='user@example.com', password='x')
+        cls.admin = User.objects.create_superuser(email='admin@example.com', password='x')
+        cls.group = Group.objects.create(name='Billing clerks')
+        cls.user.groups.add(cls.group)
+        cls.view_bill = Permission.objects.get(codename='view_bill')
+
+    def setUp(self):
+        cache.clear()
+        permission_catalogue.invalidate()
+
+    def codenames(self, user):
+        user = User.objects.get(pk=user.pk)
+        return permission_catalogue.user_codenames(user), UserSerializer(user).data['user_permissions']
+
+    def test_user_grants_and_revokes(self):
+        self.assertEqual(self.codenames(self.user), ([], []))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.user_permissions.add(self.view_bill)
+        self.assertEqual(self.codenames(self.user), (['view_bill'], ['view_bill']))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.user_permissions.remove(self.view_bill)
+        self.assertEqual(self.codenames(self.user), ([], []))
+
+        # from the permission's side, including a clear() that does not name the users
+        with self.captureOnCommitCallbacks(execute=True):
+            self.view_bill.customuser_set.add(self.user)
+        self.assertEqual(self.codenames(self.user), (['view_bill'], ['view_bill']))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.view_bill.customuser_set.clear()
+        self.assertEqual(self.codenames(self.user), ([], []))
+
+    def test_group_grants_and_revokes(self):
+        # the catalogue lists explicit permissions only; group ones reach has_perm() directly
+        self.codenames(self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.group.permissions.add(self.view_bill)
+        self.assertTrue(User.objects.get(pk=self.user.pk).has_perm('bms.view_bill'))
+        self.assertEqual(self.codenames(self.user), ([], []))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.group.permissions.remove(self.view_bill)
+        self.assertFalse(User.objects.get(pk=self.user.pk).has_perm('bms.view_bill'))
+
+    def test_deleted_permission_leaves_the_catalogue(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            permission = Permission.objects.create(
+                codename='settle_bill', name='Can settle bill', content_type=ContentType.objects.get_for_model(Bill),
+            )
+            self.user.user_permissions.add(permission)
+        self.assertIn('settle_bill', self.codenames(self.admin)[1])
+        self.assertEqual(self.codenames(self.user)[0], ['settle_bill'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            permission.delete()
+        self.assertNotIn('settle_bill', permission_catalogue.all_codenames())
+        self.assertNotIn('settle_bill', self.codenames(self.admin)[1])
+        self.assertEqual(self.codenames(self.user), ([], []))
+
+
+class KeysetPaginationTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        biller = Biller.objects.create(
+            user=User.objects.create_user(email='biller@example.com', password='x', is_biller=True), name='Biller',
+        )
+        customer = User.objects.create_user(email='customer@example.com', password='x')
+        bills = Bill.objects.bulk_create([
+            Bill(bill_number=f'K-{index}', biller=biller, customer=customer, amount=Decimal('5.00'),
+                 due_date=datetime.date(2030, 1, 1))
+            for index in range(7)
+        ])
+        # runs of equal created_at, so pages break between rows told apart only by id
+        start = datetime.datetime(2025, 1, 1, tzinfo=datetime.timezone.utc)
+        for bill, hours in zip(bills, [2, 0, 2, 1, 0, 2, 1]):
+            Bill.objects.filter(pk=bill.pk).update(created_at=start + datetime.timedelta(hours=hours))
+        cls.stamps = dict(Bill.objects.values_list('pk', 'created_at'))
+
+    def page(self, ordering, cursor=None):
+        params = {'pagination': 'cursor', 'page_size': 3}
+        if cursor is not None:
+            params['cursor'] = cursor
+        paginator = HybridPagination()
+        bills = paginator.paginate_queryset(Bill.objects.order_by(*ordering), Request(APIRequestFactory().get('/', params)))
+        return [bill.pk for bill in bills], paginator.next_cursor, paginator.previous_cursor
+
+    def walk(self, ordering):
+        pages, cursor = [], None
+        while True:
+            bills, cursor, previous = self.page(ordering, cursor)
+            pages.append(bills)
+            if cursor is None:
+                break
+        # and back again from the last page
+        back = [bills]
+        while previous is not None:
+            bills, _, previous = self.page(ordering, previous)
+            back.append(bills)
+        self.assertEqual(back[::-1], pages)
+        return [pk for bills in pages for pk in bills]
+
+    def test_ascending_pages_break_ties_by_id(self):
+        expected = sorted(self.stamps, key=lambda pk: (self.stamps[pk], pk))
+        self.assertEqual(self.walk(['created_at']), expected)
+
+    def test_descending_pages_break_ties_by_id(self):
+        expected = sorted(self.stamps, key=lambda pk: (self.stamps[pk], pk), reverse=True)
+        self.assertEqual(self.walk(['-created_at']), expected)
+        self.assertEqual(self.walk(['-id']), sorted(self.stamps, reverse=True))
+
+    def test_rejects_tampered_and_foreign_cursors(self):
+        _, cursor, _ = self.page(['created_at'])
+        tampered = cursor[:-1] + ('A' if cursor[-1] != 'A' else 'B')
+        forged = signing.dumps({'o': ['created_at', 'id'], 'v': ['2025-01-01T00:00:00+00:00', 0], 'r': False})
+        for ordering, bad in ((['created_at'], tampered), (['created_at'], forged), (['-created_at'], cursor),
+                              (['id'], cursor)):
+            with self.assertRaises(NotFound):
+                self.page(ordering, bad)
+
+
+@override_settings(PAGINATION_COUNT_CAP=3, PAGINATION_COUNT_STRATEGY='exact')
+class CountStrategyTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.biller = Biller.objects.create(
+            user=User.objects.create_user(email='biller@example.com', password='x', is_biller=True), name='Biller',
+        )
+        cls.customer = User.objects.create_user(email='customer@example.com', password='x')
+        cls.other = User.objects.create_user(email='other@example.com', password='x')
+        for index in range(5):
+            cls.create_bill(index)
+
+    @classmethod
+    def create_bill(cls, index, status='pending'):
+        return Bill.objects.create(bill_number=f'C-{index}', biller=cls.biller, customer=cls.customer,
+                                   amount=Decimal('5.00'), due_date=datetime.date(2030, 1, 1), status=status)
+
+    def setUp(self):
+        cache.clear()
+
+    def page(self, count=None, page=1, queryset=None, view=None, user=None, **filters):
+        params = {'page_size': 2, 'page': page, **filters}
+        if count is not None:
+            params['count'] = count
+        request = Request(APIRequestFactory().get('/', params))
+        request.user = user or self.customer
+        paginator = CustomPagination()
+        bills = paginator.paginate_queryset(
+            Bill.objects.order_by('pk') if queryset is None else queryset, request, BillListView() if view is None else view,
+        )
+        data = paginator.get_paginated_data([bill.pk for bill in bills])
+        return data['count'], data['total_pages'], len(data['data']), data['next'] is not None
+
+    def test_exact(self):
+        self.assertEqual(self.page(), (5, 3, 2, True))
+        self.assertEqual(self.page(page=3), (5, 3, 1, False))
+
+    def test_capped(self):
+        self.assertEqual(self.page('capped'), ('3+', '2+', 2, True))
+        # pages past the cap are served until they run out
+        self.assertEqual(self.page('capped', page=3), ('3+', '2+', 1, False))
+        second = Bill.objects.order_by('pk')[1].pk
+        self.assertEqual(self.page('capped', queryset=Bill.objects.filter(pk__lte=second).order_by('pk'), id__lte=second),
+                         (2, 1, 2, False))
+
+    def test_estimate(self):
+        filtered = Bill.objects.filter(status='pending').order_by('pk')
+        self.assertEqual(self.page('estimate', queryset=filtered, status='pending'), ('3+', '2+', 2, True))
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE bms_bill')
+            self.assertEqual(self.page('estimate'), ('~5', '~3', 2, True))
+
+    def test_none(self):
+        self.assertEqual(self.page('none'), (None, None, 2, True))
+        self.assertEqual(self.page('none', page=3), (None, None, 1, False))
+        with self.assertRaises(ValidationError):
+            self.page('all')
+
+    def test_counts_are_cached_per_view_filter_and_tenant(self):
+        self.assertEqual(self.page()[0], 5)
+        self.create_bill(5, status='paid')
+        self.assertEqual(self.page()[0], 5)
+        # PaymentListView defaults to capped counts
+        self.assertEqual(self.page('exact', view=PaymentListView())[0], 6)
+        self.assertEqual(self.page(user=self.other)[0], 6)
+        self.assertEqual(self.page(queryset=Bill.objects.filter(status='paid').order_by('pk'), status='paid')[0], 1)
+        self.assertEqual(self.page(queryset=Bill.objects.filter(status='pending').order_by('pk'), status='pending')[0], 5)
+
+
+@override_settings(REPRESENTATION_CACHE_ENABLED=True, REPRESENTATION_CACHE_LOCAL_SIZE=0)
+class RepresentationCacheTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.biller = Biller.objects.create(
+            user=User.objects.create_user(email='biller@example.com', password='x', is_biller=True), name='Biller',
+        )
+        customer = User.objects.create_user(email='customer@example.com', password='x')
+        cls.bill = Bill.objects.create(bill_number='R-1', biller=cls.biller, customer=customer, amount=Decimal('5.00'),
+                                       due_date=datetime.date(2030, 1, 1), description='first')
+
+    def setUp(self):
+        cache.clear()
+
+    def render(self, **kwargs):
+        return BillSerializer(Bill.objects.get(pk=self.bill.pk), **kwargs).data
+
+    def test_hit_until_updated_at_moves(self):
+        self.assertEqual(self.render()['description'], 'first')
+        # a write that leaves updated_at alone is not seen: the fragment comes from the cache
+        Bill.objects.filter(pk=self.bill.pk).update(description='unseen')
+        self.assertEqual(self.render()['description'], 'first')
+
+        Bill.objects.filter(pk=self.bill.pk).update(description='updated', updated_at=timezone.now())
+        self.assertEqual(self.render()['description'], 'updated')
+
+        bill = Bill.objects.get(pk=self.bill.pk)
+        bill.description = 'saved'
+        bill.save()
+        self.assertEqual(self.render()['description'], 'saved')
+
+    def test_field_selections_are_cached_apart(self):
+        self.assertEqual(set(self.render(fields='bill_number,amount')), {'bill_number', 'amount'})
+        self.assertEqual(set(self.render(fields='bill_number,description')), {'bill_number', 'description'})
+        self.assertIn('due_date', self.render())
+        # each selection has its own entry: only one never rendered before sees the new value
+        Bill.objects.filter(pk=self.bill.pk).update(description='unseen')
+        self.assertEqual(self.render(fields='bill_number,description')['description'], 'first')
+        self.assertEqual(self.render(fields='description')['description'], 'unseen')
+
+        self.assertEqual(self.render(expand='biller')['biller']['name'], 'Biller')
+        self.assertEqual(self.render()['biller'], self.biller.pk)
+        self.assertEqual(self.render(fields='biller', expand='biller')['biller']['name'], 'Biller')
+
+    def test_related_change_reaches_the_parent(self):
+        self.assertEqual(self.render(expand='biller')['biller']['name'], 'Biller')
+        biller = Biller.objects.get(pk=self.biller.pk)
+        biller.name = 'Renamed'
+        biller.save()
+        self.assertEqual(self.render(expand='biller')['biller']['name'], 'Renamed')
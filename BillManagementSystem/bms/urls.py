@@ -13,6 +13,8 @@ from .api.bill import *
 from .api.payment import *
 from .api.notification import *
 from .api.reports import *
+from .api.reminderPolicy import *
+from .metrics import metrics
 
 
 
@@ -35,6 +37,7 @@ urlpatterns = [
   path("get_tenants",GetTenats.as_view(),name="get_tenants"),
   path('sign_up',CustomerRegistrationView.as_view(), name='sign_up'),
   path('get_cutomers', get_customers, name='get_customers'),
+  path('customer_typeahead', customer_typeahead, name='customer_typeahead'),
 
   #path('register',sign_up_zone_owner, name='register'),
   path('verify-email/<uuid:token>', verify_email, name='verify_email'),
@@ -90,9 +93,15 @@ urlpatterns = [
     path('get_customer_biller/<int:pk>/',CustomerBillerRetrieveView.as_view(), name='customer-biller-retrieve'),
     path('update_customer_biller/<int:pk>',CustomerBillerUpdateView.as_view(), name='customer-biller-update'),
     path('delete_customer_biller/<int:pk>', CustomerBillerDeleteView.as_view(), name='customer-biller-delete'),
+
+    #---------------------reminder policy routes------------------------------------
+    path('get_reminder_policies', ReminderPolicyListView.as_view(), name='reminder-policy-list'),
+    path('post_reminder_policy', ReminderPolicyCreateView.as_view(), name='reminder-policy-create'),
+    path('delete_reminder_policy/<int:pk>', ReminderPolicyDeleteView.as_view(), name='reminder-policy-delete'),
     
     #---------------------Bill routes------------------------------------
     path('get_bills', BillListView.as_view(), name='bill-list'),
+    path('export_bills/<str:export_format>', BillExportView.as_view(), name='bill-export'),
     path('post_bill', BillCreateView.as_view(), name='bill-create'),
     path('get_bill/<int:pk>/', BillRetrieveView.as_view(), name='bill-retrieve'),
     path('update_bill/<int:pk>', BillUpdateView.as_view(), name='bill-update'),
@@ -100,6 +109,7 @@ urlpatterns = [
     
     #---------------------payment routes------------------------------------
     path('get_payments', PaymentListView.as_view(), name='payment-list'),
+    path('export_payments/<str:export_format>', PaymentExportView.as_view(), name='payment-export'),
     path('post_payment', PaymentCreateView.as_view(), name='payment-create'),
     path('post_payment_bulk', BulkPaymentCreateView.as_view(), name='bulk-payment-create'),
 
@@ -110,6 +120,7 @@ urlpatterns = [
     
     #------------------------Notifications routes----------------------------------------
     path('get_notifications', NotificationListView.as_view(), name='notification-list'),
+    path('export_notifications/<str:export_format>', NotificationExportView.as_view(), name='notification-export'),
     path('post_notification', NotificationCreateView.as_view(), name='notification-create'),
     path('get_notification/<int:pk>/', NotificationRetrieveView.as_view(), name='notification-retrieve'),
     path('update_notification/<int:pk>', NotificationUpdateView.as_view(), name='notification-update'),
@@ -132,6 +143,10 @@ urlpatterns = [
     path('biller/outstanding_invoices', BillerOutstandingInvoicesView.as_view(), name='biller_outstanding_invoices'),
     path('biller/customer_statistics', BillerCustomerStatisticsView.as_view(), name='biller_customer_statistics'),
     path('biller/payment_methods', BillerPaymentMethodsView.as_view(), name='biller_payment_methods'),
+
+    #-------------------monitoring routes--------------------------------
+
+    path('metrics', metrics, name='metrics'),
     
     
 ]
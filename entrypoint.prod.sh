@@ -8,6 +8,11 @@ python manage.py migrate --noinput
 echo "Collecting static files..."
 python manage.py collectstatic --noinput
 
+# Drop the previous run's per-worker metric files (bms/metrics.py)
+if [ -n "$PROMETHEUS_MULTIPROC_DIR" ]; then
+    rm -rf "$PROMETHEUS_MULTIPROC_DIR" && mkdir -p "$PROMETHEUS_MULTIPROC_DIR"
+fi
+
 # Start Gunicorn
 echo "Starting Gunicorn server..."
 gunicorn BillManagementSystem.wsgi:application --bind 0.0.0.0:8000